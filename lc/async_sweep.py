@@ -0,0 +1,190 @@
+# Asynchronous instrument control and frequency sweeps
+#
+# The drivers in ds1054z.py and fy6600.py are blocking. The
+# classes here wrap them so that each method becomes a coroutine
+# which runs the blocking call in a worker thread. Each instrument
+# has a lock, so commands to one instrument are never interleaved,
+# but commands to different instruments can run at the same time.
+#
+# AsyncSweep uses this to run the sweep of a FrequencyResponse so
+# that, at each frequency, the generator retune, the oscilloscope
+# timebase change and the settling delay all overlap. Measured
+# points are passed to a separate task, so saving or plotting the
+# results never holds up the instruments:
+#
+#   fr = FrequencyResponse(1e3, 6e7, 100, 0.4)
+#   df = asyncio.run(AsyncSweep(fr).run(on_point = print))
+#
+import logging
+import asyncio
+import numpy as np
+from results import read_results
+
+log = logging.getLogger(__name__)
+
+async def settle(seconds):
+    '''
+    Wait for the circuit to settle after a change of frequency
+    '''
+    await asyncio.sleep(seconds)
+
+class AsyncDriver:
+    '''
+    Wraps a blocking instrument driver, so that calling any of its
+    methods returns a coroutine. The method is run in a worker
+    thread while holding the lock for the instrument.
+    '''
+    def __init__(self, driver):
+        self.driver = driver
+        self.lock = asyncio.Lock()
+
+    def __getattr__(self, name):
+        method = getattr(self.driver, name)
+        async def call(*args, **kwargs):
+            async with self.lock:
+                return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+    async def locked(self, func):
+        '''
+        Hold the lock for the instrument while calling func(driver)
+        in a worker thread, and return the result. Use this to make
+        several calls without other commands in between (for
+        example, inside DS1054Z.batch()).
+        '''
+        async with self.lock:
+            return await asyncio.to_thread(func, self.driver)
+
+class AsyncSweep:
+    '''
+    Run the frequency sweep of a FrequencyResponse object using
+    asyncio. At each frequency, the generator is retuned and the
+    oscilloscope timebase is changed at the same time, while the
+    settling delay runs (settle_time seconds, by default the
+    settle_time of the FrequencyResponse). The levelling of the input amplitude
+    and the measurement use the methods of FrequencyResponse (in a
+    worker thread, holding the locks for both instruments).
+
+    If pipeline is True and the FrequencyResponse measures
+    waveforms, the timebase for the next frequency is queued in
+    the same batch as the measurement of the current frequency, so
+    that it is sent together with the last commands of the
+    measurement instead of in a separate round trip. (In statistic
+    mode, the measurement delays must not be batched, so pipeline
+    has no effect.)
+
+    If the FrequencyResponse has a calibration profile, each
+    frequency starts from its entry (as FrequencyResponse.run()),
+    and the profile is saved at the end of the sweep.
+    '''
+    def __init__(self, fr, settle_time = None, pipeline = False):
+        self.fr = fr
+        self.gen = AsyncDriver(fr.gen)
+        self.osc = AsyncDriver(fr.osc)
+        self.settle_time = settle_time if settle_time is not None \
+            else fr.settle_time
+        self.pipeline = pipeline
+
+    async def set_frequency(self, f):
+        '''
+        Set the generator frequency and oscilloscope timebase for
+        frequency f, and wait for the circuit to settle. If the
+        calibration profile has an entry for f, the generator
+        voltage, vertical scales, timebase and settle time are set
+        from it. Returns the settle time.
+        '''
+        fr = self.fr
+        entry = fr.calibration.lookup(f) if fr.calibration else None
+        if entry is None:
+            await asyncio.gather(self.gen.set_frequency(f),
+                                 self.osc.set_timebase(fr.seconds_per_div(f)),
+                                 settle(self.settle_time))
+            settle_time = self.settle_time
+        else:
+            async def retune():
+                await self.gen.set_frequency(f)
+                await self.gen.set_amplitude(entry["v_gen"])
+            def configure(osc):
+                with osc.batch():
+                    osc.set_timebase(entry["timebase"])
+                    for channel, volts_per_div in entry["scales"].items():
+                        osc.set_vertical_scale(int(channel), volts_per_div)
+            settle_time = max(entry["settle_time"], self.settle_time)
+            await asyncio.gather(retune(), self.osc.locked(configure),
+                                 settle(settle_time))
+            fr.v_gen = entry["v_gen"]
+        fr.f = f
+        if fr.measurement == "statistic":
+            await self.osc.reset_statistic_data()
+        return settle_time
+
+    def measure(self, next_f):
+        '''
+        Level the input amplitude and measure the current frequency
+        (blocking; run in a worker thread)
+        '''
+        fr = self.fr
+        with fr.step("level"):
+            v_gen = fr.set_input_amplitude(fr.target_input_amplitude)
+        if self.pipeline and fr.measurement == "waveform" and next_f is not None:
+            with fr.osc.batch():
+                point = fr.measure_point()
+                fr.osc.set_timebase(fr.seconds_per_div(next_f))
+        else:
+            point = fr.measure_point()
+        return {"v_gen": v_gen, **point}
+
+    async def measure_frequency(self, f, next_f = None):
+        '''
+        Measure the response at frequency f. Returns a dictionary
+        of the generator voltage and the measurements (as
+        FrequencyResponse.measure_frequency()).
+        '''
+        with self.fr.point(f):
+            with self.fr.step("settle"):
+                settle_time = await self.set_frequency(f)
+            async with self.gen.lock, self.osc.lock:
+                point = await asyncio.to_thread(self.measure, next_f)
+                await asyncio.to_thread(self.fr.record_calibration, f,
+                                        point["v_gen"], settle_time)
+        return point
+
+    async def consume(self, queue, writer, on_point):
+        '''
+        Write the measured points from the queue to the results
+        file (until None is received), and pass each one to
+        on_point, in a worker thread
+        '''
+        while (row := await queue.get()) is not None:
+            await asyncio.to_thread(writer.write, row)
+            if on_point is not None:
+                await asyncio.to_thread(on_point, row)
+
+    async def run(self, savefile = "meas.csv", on_point = None,
+                  resume = False):
+        '''
+        Run the frequency sweep and return (and save) the frequency
+        response data as a dataframe, in the same format as
+        FrequencyResponse.run(). If on_point is given, it is called
+        with a dictionary of the results for each frequency as soon
+        as it has been measured, without delaying the sweep. If
+        resume is True, frequencies already in savefile are skipped.
+        '''
+        writer, previous = self.fr.open_results(savefile, resume)
+        freq = [f for f in self.fr.freq
+                if not np.isclose(previous["f"], f, rtol = 1e-9).any()]
+        queue = asyncio.Queue()
+        consumer = asyncio.create_task(self.consume(queue, writer, on_point))
+        try:
+            for n, f in enumerate(freq):
+                log.info(f"Measuring frequency {f} Hz ({n}/{len(freq)})")
+                next_f = freq[n + 1] if n + 1 < len(freq) else None
+                point = await self.measure_frequency(f, next_f)
+                queue.put_nowait({"f": f, **point})
+        finally:
+            queue.put_nowait(None)
+            await consumer
+            writer.close()
+
+        await asyncio.to_thread(self.fr.save_calibration)
+        return await asyncio.to_thread(lambda: read_results(savefile)[0])
@@ -0,0 +1,131 @@
+# Frequency sweeps on several benches in parallel
+#
+# A bench is a signal generator and oscilloscope pair, connected
+# to one circuit under test. find_benches() lists the generators
+# and oscilloscopes attached to this computer and pairs them up,
+# and run_benches() runs the same sweep on every bench at once (one
+# thread per bench), so that N circuits are measured in the time
+# taken to measure one. Each bench writes its own results file,
+# and a combined progress line is logged as each point is
+# measured:
+#
+#   benches = open_benches(find_benches())
+#   results = run_benches(benches, 1e3, 6e7, 100, 0.4)
+#
+import logging
+import threading
+import time
+from discovery import resource_manager
+from ds1054z import DS1054Z, rigol_resources
+from fy6600 import FY6600, fy6600_ports
+from frequency_response import FrequencyResponse
+
+log = logging.getLogger(__name__)
+
+def find_benches(rm = None):
+    '''
+    Find the oscilloscopes and signal generators attached, and
+    return a dictionary mapping the name of each bench ("bench0",
+    "bench1", and so on) to the VISA resource name of its
+    oscilloscope and the serial device of its generator. The
+    instruments are paired in sorted order of resource name and
+    device, so either connect them in matching order, or write the
+    dictionary by hand.
+    '''
+    if rm is None:
+        rm = resource_manager()
+    scopes = rigol_resources(rm)
+    generators = fy6600_ports()
+    if len(scopes) != len(generators):
+        raise RuntimeError(f"Found {len(scopes)} oscilloscopes, but "
+                           f"{len(generators)} signal generators")
+    return {f"bench{n}": pair
+            for n, pair in enumerate(zip(scopes, generators))}
+
+def open_benches(benches):
+    '''
+    Open the instruments of the benches returned by find_benches(),
+    and return a dictionary mapping the name of each bench to its
+    (generator, oscilloscope) pair
+    '''
+    return {name: (FY6600(device), DS1054Z(resource = resource))
+            for name, (resource, device) in benches.items()}
+
+class Progress:
+    '''
+    Combined progress of the sweeps on several benches. The worker
+    threads call update() after measuring each point, and a line
+    showing the progress of every bench is logged.
+    '''
+    def __init__(self, totals):
+        self.totals = totals
+        self.done = {name: 0 for name in totals}
+        self.status = {name: "" for name in totals}
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self, name, status = None):
+        '''
+        Record that a point has been measured on a bench (or, if
+        status is given, that the sweep has finished with that
+        status), and log the progress
+        '''
+        with self.lock:
+            if status is None:
+                self.done[name] += 1
+            else:
+                self.status[name] = f" ({status})"
+            log.info(self.summary())
+
+    def summary(self):
+        '''
+        Return a line showing the progress of all the benches
+        '''
+        benches = ", ".join(f"{name} {self.done[name]}/{self.totals[name]}"
+                            f"{self.status[name]}" for name in self.totals)
+        done = sum(self.done.values())
+        total = sum(self.totals.values())
+        elapsed = time.monotonic() - self.start
+        return f"[{elapsed:.0f} s] {done}/{total} points: {benches}"
+
+def run_benches(benches, freq_low, freq_high, freq_steps, vin_amplitude,
+                savefile = "meas_{name}.csv", resume = False, **kwargs):
+    '''
+    Run the same frequency sweep (see FrequencyResponse.run()) on
+    each bench, in parallel. benches is a dictionary mapping the
+    name of each bench to its (generator, oscilloscope) pair, and
+    the other keyword arguments are passed to FrequencyResponse.
+    The results of each bench are saved to savefile, formatted
+    with the name of the bench.
+
+    Returns a dictionary mapping the name of each bench to its
+    results. If the sweep fails on some benches, the others still
+    run to completion, and then RuntimeError is raised.
+    '''
+    progress = Progress({name: freq_steps for name in benches})
+    results = {}
+    errors = {}
+
+    def worker(name, gen, osc):
+        try:
+            fr = FrequencyResponse(freq_low, freq_high, freq_steps,
+                                   vin_amplitude, gen = gen, osc = osc,
+                                   **kwargs)
+            results[name] = fr.run(savefile.format(name = name), resume,
+                                   on_point = lambda row: progress.update(name))
+            progress.update(name, "done")
+        except Exception as e:
+            errors[name] = e
+            progress.update(name, f"failed: {e}")
+
+    threads = [threading.Thread(target = worker, args = (name, gen, osc),
+                                name = name)
+               for name, (gen, osc) in benches.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError(f"Sweep failed on {', '.join(errors)}") \
+            from next(iter(errors.values()))
+    return results
@@ -0,0 +1,313 @@
+# Sweep throughput benchmarks using the simulated instruments
+#
+# Each benchmark runs a frequency sweep against the simulated
+# generator and oscilloscope in sim.py, and reports:
+#
+# * the wall-clock time taken by the benchmark
+# * the simulated time, which is the time the same sweep would
+#   take on the real instruments (all sleeps, instrument latency
+#   and settling run on the simulated clock)
+# * the number of commands sent to the scope and the generator
+# * the simulated time, commands and messages (round trips, which
+#   may contain several commands) per sweep point
+#
+# The simulated clock runs faster than real time (see --speedup),
+# so a sweep that would take minutes on the bench can be timed in
+# a few seconds. Run all the benchmarks with
+#
+#   python3 benchmark.py
+#
+# or pass the names of the benchmarks to run. Use --help for the
+# other options. With --profile, the commands of each sweep are
+# traced (see tracing.py), and the mean time per point spent on
+# each step and the commands taking the most time are listed.
+#
+import argparse
+import asyncio
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+import async_sweep
+import discovery
+import ds1054z
+import frequency_response
+import multisine
+import readiness
+import settling
+from async_sweep import AsyncSweep
+from benches import run_benches
+from campaign import Campaign
+from frequency_response import FrequencyResponse
+from multisine import MultisineSweep
+from sim import SimBench, SimClock
+from tracing import Tracer
+
+# Benchmarks, by name. Each is a function taking a SimBench and
+# the command line arguments, and returning the number of sweep
+# points that were measured.
+BENCHMARKS = {}
+
+def benchmark(func):
+    '''
+    Decorator to add a function to BENCHMARKS
+    '''
+    BENCHMARKS[func.__name__] = func
+    return func
+
+@contextmanager
+def simulated_sleep(clock):
+    '''
+    Make the sleep() calls in the drivers, FrequencyResponse,
+    MultisineSweep, settling, readiness and reconnection (and the
+    settling delay in AsyncSweep) wait on the simulated clock
+    instead of real time, and make the settling, readiness and
+    reconnection timeouts (and the point deadlines of
+    FrequencyResponse, and the transfer rates and deadlines of the
+    oscilloscope) use simulated time
+    '''
+    async def settle(seconds):
+        await asyncio.sleep(seconds / clock.speedup)
+    modules = [discovery, frequency_response, multisine, readiness, settling]
+    saved = [module.sleep for module in modules]
+    saved_settle = async_sweep.settle
+    clocked = [discovery, ds1054z, frequency_response, readiness, settling]
+    saved_monotonic = [module.monotonic for module in clocked]
+    for module in modules:
+        module.sleep = clock.sleep
+    async_sweep.settle = settle
+    for module in clocked:
+        module.monotonic = clock.time
+    try:
+        yield
+    finally:
+        for module, sleep in zip(modules, saved):
+            module.sleep = sleep
+        async_sweep.settle = saved_settle
+        for module, monotonic in zip(clocked, saved_monotonic):
+            module.monotonic = monotonic
+
+def run_sweep(bench, args, **kwargs):
+    '''
+    Run FrequencyResponse.run() on the simulated bench, passing
+    the keyword arguments to the FrequencyResponse constructor.
+    '''
+    fr = FrequencyResponse(args.f_low, args.f_high, args.points, args.vin,
+                           gen = bench.generator(), osc = bench.scope(),
+                           tracer = args.tracer, **kwargs)
+    with tempfile.TemporaryDirectory() as tmp:
+        df = fr.run(savefile = Path(tmp) / "meas.csv")
+    return len(df)
+
+@benchmark
+def sweep(bench, args):
+    '''
+    The standard sweep, using the oscilloscope statistics
+    '''
+    return run_sweep(bench, args)
+
+@benchmark
+def sweep_waveform(bench, args):
+    '''
+    Sweep measuring the amplitude and phase from waveforms
+    '''
+    return run_sweep(bench, args, measurement = "waveform")
+
+@benchmark
+def sweep_adaptive(bench, args):
+    '''
+    Adaptive sweep, starting from a quarter of the points and
+    refining up to the same number of points as the other sweeps
+    '''
+    fr = FrequencyResponse(args.f_low, args.f_high, max(args.points // 4, 2),
+                           args.vin, gen = bench.generator(),
+                           osc = bench.scope(), tracer = args.tracer)
+    with tempfile.TemporaryDirectory() as tmp:
+        df = fr.run_adaptive(savefile = Path(tmp) / "meas.csv",
+                             max_points = args.points)
+    return len(df)
+
+@benchmark
+def sweep_async(bench, args):
+    '''
+    Waveform sweep using AsyncSweep, with pipelining
+    '''
+    fr = FrequencyResponse(args.f_low, args.f_high, args.points, args.vin,
+                           gen = bench.generator(), osc = bench.scope(),
+                           measurement = "waveform", tracer = args.tracer)
+    with tempfile.TemporaryDirectory() as tmp:
+        sweep = AsyncSweep(fr, pipeline = True)
+        df = asyncio.run(sweep.run(savefile = Path(tmp) / "meas.csv"))
+    return len(df)
+
+@benchmark
+def sweep_reconnect(bench, args):
+    '''
+    Waveform sweep in which the instruments are unplugged for two
+    seconds halfway through, and reconnect
+    '''
+    fr = FrequencyResponse(args.f_low, args.f_high, args.points, args.vin,
+                           gen = bench.generator(reconnect = True),
+                           osc = bench.scope(reconnect = True),
+                           measurement = "waveform", tracer = args.tracer)
+    def on_point(row):
+        if row["f"] == fr.freq[len(fr.freq) // 2]:
+            bench.unplug(2)
+    with tempfile.TemporaryDirectory() as tmp:
+        df = fr.run(savefile = Path(tmp) / "meas.csv", on_point = on_point)
+    return len(df)
+
+@benchmark
+def sweep_multisine(bench, args):
+    '''
+    Sweep using multisine excitation up to 1 MHz (one multisine per
+    decade), and sine waveform measurements above
+    '''
+    fr = FrequencyResponse(args.f_low, args.f_high, args.points, args.vin,
+                           gen = bench.generator(), osc = bench.scope(),
+                           measurement = "waveform", tracer = args.tracer)
+    with tempfile.TemporaryDirectory() as tmp:
+        df = MultisineSweep(fr).run(savefile = Path(tmp) / "meas.csv")
+    return len(df)
+
+@benchmark
+def sweep_campaign(bench, args):
+    '''
+    Repeated waveform sweeps (at most five passes), re-measuring
+    only the frequencies whose phase is not yet known to 0.5
+    degrees. Every measurement counts as a point.
+    '''
+    fr = FrequencyResponse(args.f_low, args.f_high, args.points, args.vin,
+                           gen = bench.generator(), osc = bench.scope(),
+                           measurement = "waveform", tracer = args.tracer)
+    points = []
+    with tempfile.TemporaryDirectory() as tmp:
+        Campaign(fr, max_passes = 5, phase_tolerance = 0.5).run(
+            savefile = Path(tmp) / "meas.csv", on_point = points.append)
+    return len(points)
+
+@benchmark
+def read_memory(bench, args):
+    '''
+    Deep-memory capture of channel 2 at 1.5 MHz, read in RAW mode
+    in chunks of --chunk-points (every sample counts as a point;
+    for BYTE format, 1 / (sim s/pt) is the rate in bytes/s)
+    '''
+    fr = FrequencyResponse(args.f_low, args.f_high, 2, args.vin,
+                           gen = bench.generator(), osc = bench.scope(),
+                           measurement = "waveform")
+    fr.measure_frequency(1.5e6)
+    fr.osc.set_memory_depth(args.memory_depth)
+    fr.osc.single()
+    with tempfile.TemporaryDirectory() as tmp:
+        samples, _ = fr.osc.read_memory(2, Path(tmp) / "capture.npy",
+                                        chunk_points = args.chunk_points)
+        points = len(samples)
+        del samples
+    fr.osc.run()
+    return points
+
+@benchmark
+def sweep_parallel(bench, args):
+    '''
+    Waveform sweeps on three simulated benches at once, using
+    run_benches(). The commands of all the benches are counted
+    (but not traced).
+    '''
+    others = [SimBench(clock = bench.clock, seed = args.seed + n)
+              for n in range(1, 3)]
+    benches = {f"bench{n}": (b.generator(), b.scope())
+               for n, b in enumerate([bench, *others])}
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run_benches(benches, args.f_low, args.f_high, args.points,
+                              args.vin, savefile = f"{tmp}/meas_{{name}}.csv",
+                              measurement = "waveform")
+    for other in others:
+        bench.commands.update(other.commands)
+        bench.messages.update(other.messages)
+    return sum(len(df) for df in results.values())
+
+def run_benchmark(name, args):
+    '''
+    Run one benchmark on a new simulated bench and return the
+    results as a dictionary
+    '''
+    bench = SimBench(clock = SimClock(args.speedup), seed = args.seed)
+    # The durations are traced in simulated time
+    args.tracer = Tracer(clock = bench.clock.time) if args.profile else None
+    wall_start = time.perf_counter()
+    sim_start = bench.clock.time()
+    with simulated_sleep(bench.clock):
+        points = BENCHMARKS[name](bench, args)
+    sim_time = bench.clock.time() - sim_start
+    commands = bench.total_commands()
+    return {
+        "benchmark": name,
+        "points": points,
+        "wall_s": time.perf_counter() - wall_start,
+        "sim_s": sim_time,
+        "sim_s_per_point": sim_time / points,
+        "scope_cmds": bench.total_commands("scope"),
+        "gen_cmds": bench.total_commands("gen"),
+        "cmds_per_point": commands / points,
+        "msgs_per_point": sum(bench.messages.values()) / points,
+        "top_commands": bench.commands.most_common(args.top),
+        "tracer": args.tracer,
+    }
+
+def print_results(results):
+    '''
+    Print a table of the results of the benchmarks
+    '''
+    header = (f"{'benchmark':<16}{'points':>8}{'wall s':>10}{'sim s':>10}"
+              f"{'sim s/pt':>10}{'scope':>8}{'gen':>8}{'cmd/pt':>8}"
+              f"{'msg/pt':>8}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['benchmark']:<16}{r['points']:>8}{r['wall_s']:>10.2f}"
+              f"{r['sim_s']:>10.1f}{r['sim_s_per_point']:>10.2f}"
+              f"{r['scope_cmds']:>8}{r['gen_cmds']:>8}"
+              f"{r['cmds_per_point']:>8.1f}{r['msgs_per_point']:>8.1f}")
+    for r in results:
+        if len(r["top_commands"]) == 0:
+            continue
+        print(f"\nMost frequent commands ({r['benchmark']}):")
+        for (instrument, cmd), count in r["top_commands"]:
+            print(f"  {count:>6}  {instrument:<6}{cmd}")
+    for r in results:
+        if r["tracer"] is None or len(r["tracer"].commands) == 0:
+            continue
+        print(f"\nProfile ({r['benchmark']}, simulated time):")
+        print(r["tracer"].summary(top = 5))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description = "Sweep throughput benchmarks using the simulated instruments")
+    parser.add_argument("names", nargs = "*", default = list(BENCHMARKS),
+                        help = f"benchmarks to run (from {list(BENCHMARKS)})")
+    parser.add_argument("--points", type = int, default = 10,
+                        help = "number of frequency points in the sweep")
+    parser.add_argument("--f-low", type = float, default = 1e3)
+    parser.add_argument("--f-high", type = float, default = 6e7)
+    parser.add_argument("--vin", type = float, default = 0.4,
+                        help = "target input amplitude (V)")
+    parser.add_argument("--speedup", type = float, default = 20,
+                        help = "how much faster simulated time runs")
+    parser.add_argument("--seed", type = int, default = 0,
+                        help = "seed for the simulated measurement noise")
+    parser.add_argument("--memory-depth", type = int, default = 1200000,
+                        help = "points per channel for read_memory")
+    parser.add_argument("--chunk-points", type = int,
+                        help = "points per read for read_memory (default "
+                        "the largest allowed)")
+    parser.add_argument("--top", type = int, default = 5,
+                        help = "number of most frequent commands to list")
+    parser.add_argument("--profile", action = "store_true",
+                        help = "trace the commands and time of each point")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)} "
+                     f"(choose from {', '.join(BENCHMARKS)})")
+    print_results([run_benchmark(name, args) for name in args.names])
@@ -0,0 +1,183 @@
+# Bipolar transistor model
+#
+# The DC currents of the Gummel-Poon model used by SPICE (with the
+# parameters of a .model card; see netlist.py), and the junction
+# and diffusion charges and capacitances, for the operating point
+# and small-signal (linearised) analysis in mna.py and the
+# transient analysis in transient.py. The series resistances (RB,
+# RC and RE) are added by mna.py as separate resistors.
+#
+# The methods work on arrays of junction voltages, and stack()
+# combines several transistors into one BJT whose parameters are
+# arrays, so that all the transistors of a circuit are evaluated
+# at once.
+#
+# Not modelled: temperature dependence (the circuit is at 27 C),
+# the substrate junction, high-current base resistance (IRB, RBM),
+# the bias dependence of the transit time (XTF, VTF, ITF) and
+# excess phase (PTF).
+#
+import numpy as np
+
+# Thermal voltage kT/q at 27 C
+VT = 0.025864
+
+# Default values of the model parameters (as in SPICE)
+DEFAULTS = {
+    "is": 1e-16, "bf": 100.0, "br": 1.0, "nf": 1.0, "nr": 1.0,
+    "vaf": np.inf, "var": np.inf, "ikf": np.inf, "ikr": np.inf,
+    "ise": 0.0, "ne": 1.5, "isc": 0.0, "nc": 2.0,
+    "rb": 0.0, "rc": 0.0, "re": 0.0,
+    "cje": 0.0, "vje": 0.75, "mje": 0.33, "cjc": 0.0, "vjc": 0.75,
+    "mjc": 0.33, "fc": 0.5, "tf": 0.0, "tr": 0.0,
+}
+
+class BJT:
+    '''
+    Gummel-Poon model of a bipolar transistor, with the
+    parameters of a .model card (params, with lower-case names;
+    missing parameters take their SPICE defaults, and zero for
+    VAF, VAR, IKF and IKR means infinity, as in SPICE). kind is
+    "npn" or "pnp", and area scales the currents and capacitances.
+    The voltages and currents of the methods are those of an NPN
+    transistor; for a PNP transistor, the caller reverses the
+    signs of the terminal voltages and currents (see polarity).
+    '''
+    def __init__(self, params, kind = "npn", area = 1.0):
+        if kind not in ("npn", "pnp"):
+            raise ValueError(f"Unknown transistor type '{kind}'")
+        self.polarity = 1 if kind == "npn" else -1
+        p = {**DEFAULTS, **params}
+        for name in ["vaf", "var", "ikf", "ikr"]:
+            if p[name] == 0:
+                p[name] = np.inf
+        for name in ["is", "ise", "isc", "ikf", "ikr", "cje", "cjc"]:
+            p[name] = p[name] * area
+        for name in ["rb", "rc", "re"]:
+            p[name] = p[name] / area
+        self.p = p
+
+    def junction(self, v, i_s, n):
+        '''
+        Return the current of a diode junction (saturation current
+        i_s and emission coefficient n) at voltage v, and its
+        derivative. The exponential is continued linearly above
+        40 thermal voltages, to avoid overflow.
+        '''
+        nvt = n * VT
+        x = np.minimum(v / nvt, 40)
+        e = np.exp(x)
+        i = i_s * (e - 1) + i_s * e * (v / nvt - x)
+        return i, i_s * e / nvt
+
+    def currents(self, vbe, vbc):
+        '''
+        Return the collector and base currents (flowing into the
+        transistor) at the junction voltages vbe and vbc, and the
+        matrix of their derivatives with respect to vbe and vbc
+        ([[dic/dvbe, dic/dvbc], [dib/dvbe, dib/dvbc]]), and the
+        forward and reverse diode currents and their derivatives,
+        and the normalised base charge qb and its derivatives (for
+        the diffusion charges; see charges()).
+        '''
+        p = self.p
+        i_f, g_f = self.junction(vbe, p["is"], p["nf"])
+        i_r, g_r = self.junction(vbc, p["is"], p["nr"])
+        i_le, g_le = self.junction(vbe, p["ise"], p["ne"])
+        i_lc, g_lc = self.junction(vbc, p["isc"], p["nc"])
+
+        # Base charge: Early effect (q1) and high injection (q2)
+        q1 = 1 / (1 - vbc / p["vaf"] - vbe / p["var"])
+        q2 = i_f / p["ikf"] + i_r / p["ikr"]
+        root = np.sqrt(np.maximum(1 + 4*q2, 1e-12))
+        qb = q1 * (1 + root) / 2
+        dq1_dvbe, dq1_dvbc = q1**2 / p["var"], q1**2 / p["vaf"]
+        dqb_dvbe = dq1_dvbe * (1 + root) / 2 + q1 * g_f / p["ikf"] / root
+        dqb_dvbc = dq1_dvbc * (1 + root) / 2 + q1 * g_r / p["ikr"] / root
+
+        i_t = (i_f - i_r) / qb
+        dit_dvbe = (g_f - i_t * dqb_dvbe) / qb
+        dit_dvbc = (-g_r - i_t * dqb_dvbc) / qb
+
+        ib = i_f / p["bf"] + i_le + i_r / p["br"] + i_lc
+        ic = i_t - i_r / p["br"] - i_lc
+        jacobian = np.array([[dit_dvbe, dit_dvbc - g_r / p["br"] - g_lc],
+                             [g_f / p["bf"] + g_le, g_r / p["br"] + g_lc]])
+        return ic, ib, jacobian, (i_f, g_f, i_r, g_r, qb, dqb_dvbe, dqb_dvbc)
+
+    def depletion(self, v, cj, vj, m):
+        '''
+        Return the charge and capacitance of a depletion region
+        (zero-bias capacitance cj, built-in potential vj and grading
+        m < 1) at voltage v. The capacitance is continued linearly
+        above fc*vj, as in SPICE.
+        '''
+        fc = self.p["fc"]
+        v1 = fc * vj
+        below = np.minimum(v, v1)
+        q = cj * vj / (1 - m) * (1 - (1 - below / vj) ** (1 - m))
+        c = cj * (1 - below / vj) ** -m
+        # Linear continuation of the capacitance (and so a quadratic
+        # charge) above v1
+        above = np.maximum(v - v1, 0)
+        slope = cj * m / vj / (1 - fc) ** (1 + m)
+        return q + c * above + slope * above**2 / 2, c + slope * above
+
+    def charges(self, vbe, vbc, diodes = None):
+        '''
+        Return the base-emitter and base-collector charges
+        (depletion plus diffusion) at the junction voltages vbe and
+        vbc, their capacitances (their derivatives with respect to
+        vbe and vbc), and the derivative of the base-emitter charge
+        with respect to vbc. As in SPICE, the forward diffusion
+        charge is TF*If/qb, so it falls at high injection (and with
+        the Early effect). diodes are the diode currents returned by
+        currents() at the same voltages, if they have been found
+        already.
+        '''
+        p = self.p
+        if diodes is None:
+            diodes = self.currents(vbe, vbc)[3]
+        i_f, g_f, i_r, g_r, qb, dqb_dvbe, dqb_dvbc = diodes
+        q_je, c_je = self.depletion(vbe, p["cje"], p["vje"], p["mje"])
+        q_jc, c_jc = self.depletion(vbc, p["cjc"], p["vjc"], p["mjc"])
+        q_f = p["tf"] * i_f / qb
+        c_f = (p["tf"] * g_f - q_f * dqb_dvbe) / qb
+        return (q_je + q_f, q_jc + p["tr"] * i_r,
+                c_je + c_f, c_jc + p["tr"] * g_r, -q_f * dqb_dvbc / qb)
+
+    def capacitances(self, vbe, vbc):
+        '''
+        Return the base-emitter and base-collector capacitances
+        (depletion plus diffusion) at the junction voltages vbe and
+        vbc, and the transcapacitance of the base-emitter charge
+        with respect to vbc (see charges())
+        '''
+        return self.charges(vbe, vbc)[2:]
+
+def stack(models):
+    '''
+    Return a BJT combining the BJTs models, whose parameters and
+    polarity are arrays (with one element per transistor), so that
+    its methods evaluate all the transistors at once, given arrays
+    of their junction voltages
+    '''
+    stacked = BJT({})
+    stacked.polarity = np.array([model.polarity for model in models])
+    stacked.p = {name: np.array([model.p[name] for model in models])
+                 for name in models[0].p}
+    return stacked
+
+def limit_junction(v_new, v_old, n = 1.0, i_s = 1e-16):
+    '''
+    Limit the change of a junction voltage between Newton
+    iterations (as SPICE's pnjlim), so that the exponential does
+    not overshoot. The arguments may be arrays.
+    '''
+    nvt = n * VT
+    v_crit = nvt * np.log(nvt / (np.sqrt(2) * i_s))
+    arg = 1 + (v_new - v_old) / nvt
+    from_old = np.where(arg > 0, v_old + nvt * np.log(np.maximum(arg, 1e-300)), v_crit)
+    from_zero = nvt * np.log(np.maximum(v_new / nvt, 1e-300))
+    limit = (v_new > v_crit) & (abs(v_new - v_old) > 2 * nvt)
+    return np.where(limit, np.where(v_old > 0, from_old, from_zero), v_new)[()]
@@ -0,0 +1,140 @@
+# Calibration profiles to warm-start repeated sweeps
+#
+# At each frequency, a sweep finds the generator voltage that
+# gives the target input amplitude, and the vertical scales that
+# fit the signals on the screen, by measuring and adjusting. When
+# the same circuit is swept again on the same bench, the same
+# values are found again. A calibration profile records them at
+# each frequency of a sweep (with the timebase and the settle
+# time), and FrequencyResponse sets them all before the first
+# measurement at that frequency, so that most frequencies need no
+# adjustments. If a reading misses (the input amplitude is not
+# within tolerance, or a waveform does not fit on the screen),
+# the usual adjustments carry on from the recorded values, and
+# the profile is updated with the new ones:
+#
+#   fr = FrequencyResponse(1e3, 6e7, 100, 0.4, calibration = CalibrationCache(),
+#                          circuit = config["circuit"])
+#   fr.run()                              # saves the profile at the end
+#
+# The profiles are saved in one JSON file, keyed by the bench (the
+# oscilloscope ID and the generator's serial port), the circuit,
+# and the sweep settings that change the calibration (the input
+# amplitude, channels and measurement type), so changing any of
+# them starts a new profile. The file keeps the max_profiles most
+# recently used profiles.
+#
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+# File the profiles are saved in, if no other is given
+CACHE_FILE = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) \
+    / "radios" / "calibration.json"
+
+def frequency_key(f):
+    '''
+    Return the key of frequency f in a profile (the same for
+    frequencies that differ only by rounding errors)
+    '''
+    return f"{f:.9g}"
+
+class CalibrationProfile:
+    '''
+    The calibration of one bench and circuit at each frequency (see
+    above), in entries, a dictionary mapping the key of each
+    frequency (see frequency_key()) to a dictionary of v_gen,
+    scales (a dictionary of the volts per division of each
+    channel), timebase and settle_time. Use
+    CalibrationCache.profile() to load one.
+    '''
+    def __init__(self, cache, key, entries):
+        self.cache = cache
+        self.key = key
+        self.entries = entries
+        # Frequencies measured with the profile, and those of them
+        # that needed no adjustments
+        self.looked_up = 0
+        self.hits = 0
+
+    def lookup(self, f):
+        '''
+        Return the entry for frequency f, or None if there is none
+        '''
+        self.looked_up += 1
+        return self.entries.get(frequency_key(f))
+
+    def record(self, f, entry):
+        '''
+        Record the calibration found at frequency f (replacing any
+        entry), counting a hit if it is the same as the old entry
+        '''
+        key = frequency_key(f)
+        if self.entries.get(key) == entry:
+            self.hits += 1
+        self.entries[key] = entry
+
+    def save(self):
+        '''
+        Save the profile in its cache file
+        '''
+        log.info(f"Calibration profile: {self.hits}/{self.looked_up} frequencies "
+                 f"needed no adjustment ({len(self.entries)} frequencies saved)")
+        self.cache.save(self)
+
+class CalibrationCache:
+    '''
+    A file of calibration profiles (by default, CACHE_FILE), keeping
+    the max_profiles most recently used
+    '''
+    def __init__(self, path = CACHE_FILE, max_profiles = 20):
+        self.path = Path(path).expanduser()
+        self.max_profiles = max_profiles
+
+    def load(self):
+        '''
+        Return the dictionary of profiles in the file (empty if
+        there is no file, or it cannot be read), mapping each key
+        to a dictionary of the time it was last used and its entries
+        '''
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def profile(self, bench, circuit, **settings):
+        '''
+        Return the profile (see CalibrationProfile) for a bench (a
+        dictionary identifying the instruments), circuit (a
+        dictionary of its component values) and the sweep settings
+        given as keyword arguments, which is empty if there is no
+        such profile in the file
+        '''
+        key = json.dumps({"bench": bench, "circuit": circuit, **settings},
+                         sort_keys = True)
+        profile = self.load().get(key)
+        entries = profile["entries"] if profile is not None else {}
+        log.debug(f"Loaded calibration profile of {len(entries)} frequencies")
+        return CalibrationProfile(self, key, entries)
+
+    def save(self, profile):
+        '''
+        Save a profile (replacing the saved one with the same key),
+        keeping only the max_profiles most recently used profiles
+        '''
+        profiles = self.load()
+        profiles[profile.key] = {"used": time.time(), "entries": profile.entries}
+        recent = sorted(profiles, key = lambda key: profiles[key]["used"],
+                        reverse = True)[:self.max_profiles]
+        profiles = {key: profiles[key] for key in recent}
+        try:
+            self.path.parent.mkdir(parents = True, exist_ok = True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(profiles))
+            tmp.replace(self.path)
+        except OSError as e:
+            log.warning(f"Unable to save calibration profile: {e}")
@@ -0,0 +1,206 @@
+# Repeated frequency sweeps with running statistics
+#
+# A single sweep gives one noisy sample per frequency. A campaign
+# repeats the sweep of a FrequencyResponse, and keeps the running
+# mean and variance of each measurement at each frequency (with
+# Welford's algorithm, so only three numbers per quantity and
+# frequency are kept, however many passes are made). After each
+# pass, the frequencies whose means are known to within the
+# tolerances are left out of later passes, so the time goes to
+# the noisy frequencies:
+#
+#   fr = FrequencyResponse(1e3, 6e7, 100, 0.4, measurement = "waveform")
+#   df = Campaign(fr, max_passes = 20, phase_tolerance = 0.2).run()
+#
+# The results have the same columns as FrequencyResponse.run(),
+# where the measurements are the means over the passes, and the
+# confidence intervals are those of the means, with a column n of
+# the number of passes at each frequency. The results file is
+# rewritten after each pass, so an interrupted campaign keeps the
+# means of the completed passes.
+#
+import logging
+import os
+from pathlib import Path
+import numpy as np
+from results import ResultsWriter, read_results
+from settling import Z_95
+
+log = logging.getLogger(__name__)
+
+# Measurements averaged over the passes
+QUANTITIES = ["v_gen", "v_in", "v_out", "phase"]
+
+class RunningStats:
+    '''
+    Running means and variances of a number of quantities (such
+    as one measurement at each frequency), updated one sample at
+    a time with Welford's algorithm, which is accurate even when
+    the variance is much smaller than the mean. If angle is True,
+    the quantities are angles in degrees, and each sample is
+    unwrapped to within 180 degrees of the first sample of that
+    quantity (so that a phase near +/-180 degrees averages
+    correctly), and the means are wrapped to (-180, 180].
+    '''
+    def __init__(self, size, angle = False):
+        self.n = np.zeros(size, dtype = int)
+        self.m = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self.angle = angle
+        self.reference = np.zeros(size)
+
+    def add(self, x, index = None):
+        '''
+        Add a sample of the quantities with the indices index (by
+        default, all of them; the indices must be different). NaN
+        samples are ignored.
+        '''
+        index = np.arange(len(self.n)) if index is None else np.atleast_1d(index)
+        x = np.broadcast_to(np.asarray(x, dtype = float), index.shape)
+        valid = np.isfinite(x)
+        index, x = index[valid], x[valid]
+        if self.angle:
+            first = self.n[index] == 0
+            self.reference[index[first]] = x[first]
+            reference = self.reference[index]
+            x = reference + (x - reference + 180) % 360 - 180
+        self.n[index] += 1
+        delta = x - self.m[index]
+        self.m[index] += delta / self.n[index]
+        self.m2[index] += delta * (x - self.m[index])
+
+    def mean(self):
+        '''
+        Return the means (NaN where there are no samples)
+        '''
+        mean = np.where(self.n > 0, self.m, np.nan)
+        if self.angle:
+            mean = 180 - (180 - mean) % 360
+        return mean
+
+    def variance(self):
+        '''
+        Return the sample variances (NaN where there are fewer
+        than two samples)
+        '''
+        return np.where(self.n > 1, self.m2 / np.maximum(self.n - 1, 1), np.nan)
+
+    def ci(self):
+        '''
+        Return the half-widths of the 95% confidence intervals of
+        the means
+        '''
+        return Z_95 * np.sqrt(self.variance() / np.maximum(self.n, 1))
+
+class Campaign:
+    '''
+    Repeat the frequency sweep of a FrequencyResponse object (fr)
+    up to max_passes times. After at least min_passes passes, a
+    frequency is converged (and is not measured again) once the
+    95% confidence intervals of the means of v_in and v_out are
+    within amplitude_tolerance (relative to the mean) and that of
+    the phase is within phase_tolerance (in degrees). The campaign
+    ends when every frequency has converged, or after max_passes.
+    '''
+    def __init__(self, fr, max_passes = 10, min_passes = 3,
+                 amplitude_tolerance = 0.002, phase_tolerance = 0.2):
+        if min_passes < 2 or max_passes < min_passes:
+            raise ValueError("Need 2 <= min_passes <= max_passes")
+        self.fr = fr
+        self.max_passes = max_passes
+        self.min_passes = min_passes
+        self.amplitude_tolerance = amplitude_tolerance
+        self.phase_tolerance = phase_tolerance
+        self.freq = np.sort(fr.freq)
+        self.stats = {name: RunningStats(len(self.freq), angle = name == "phase")
+                      for name in QUANTITIES}
+        self.passes = 0
+
+    def converged(self):
+        '''
+        Return a boolean array of the frequencies that have
+        converged
+        '''
+        stats = self.stats
+        converged = stats["phase"].ci() <= self.phase_tolerance
+        for name in ["v_in", "v_out"]:
+            converged &= stats[name].ci() <= \
+                self.amplitude_tolerance * abs(stats[name].mean())
+        return converged & (stats["phase"].n >= self.min_passes)
+
+    def measure_pass(self, on_point = None):
+        '''
+        Measure the frequencies that have not converged once each
+        (in order of increasing frequency), updating the
+        statistics, and return the number of frequencies measured
+        '''
+        active = np.flatnonzero(~self.converged())
+        for count, n in enumerate(active):
+            f = self.freq[n]
+            log.info(f"Pass {self.passes + 1}: measuring frequency {f} Hz "
+                     f"({count}/{len(active)})")
+            row = {"f": f, **self.fr.measure_frequency(f)}
+            for name in QUANTITIES:
+                self.stats[name].add(row[name], n)
+            if on_point is not None:
+                on_point(row)
+        self.passes += 1
+        return len(active)
+
+    def results(self):
+        '''
+        Return the columns of the results (a dictionary of arrays):
+        the means and the confidence intervals of the measurements
+        at each frequency that has been measured, and the number
+        of passes n
+        '''
+        stats = self.stats
+        measured = stats["phase"].n > 0
+        columns = {"f": self.freq}
+        columns.update({name: stats[name].mean() for name in QUANTITIES})
+        columns.update({f"{name}_ci": stats[name].ci()
+                        for name in ["v_in", "v_out", "phase"]})
+        columns["n"] = stats["phase"].n
+        return {name: values[measured] for name, values in columns.items()}
+
+    def metadata(self):
+        '''
+        Return the metadata of the campaign (see
+        FrequencyResponse.metadata())
+        '''
+        return {**self.fr.metadata(), "passes": self.passes,
+                "max_passes": self.max_passes, "min_passes": self.min_passes,
+                "amplitude_tolerance": self.amplitude_tolerance,
+                "phase_tolerance": self.phase_tolerance}
+
+    def save(self, savefile):
+        '''
+        Write the results so far to savefile, replacing it only
+        once the new file is complete
+        '''
+        temporary = Path(f"{savefile}.tmp")
+        columns = self.results()
+        with ResultsWriter(temporary, self.metadata(), columns = list(columns)) \
+                as writer:
+            for values in zip(*columns.values()):
+                writer.write(dict(zip(columns, values)))
+        os.replace(temporary, savefile)
+
+    def run(self, savefile = "meas.csv", on_point = None):
+        '''
+        Run the campaign, and return (and save) the results as a
+        dataframe (see results()). Each measurement is passed to
+        on_point (if it is given) as it is made, and the results
+        file is rewritten after each pass.
+        '''
+        while self.passes < self.max_passes:
+            if self.measure_pass(on_point) == 0:
+                break
+            self.save(savefile)
+            converged = self.converged()
+            log.info(f"After pass {self.passes}, {converged.sum()}/"
+                     f"{len(self.freq)} frequencies have converged")
+            if converged.all():
+                break
+        self.fr.save_calibration()
+        return read_results(savefile)[0]
@@ -0,0 +1,103 @@
+# Circuit, sweep and plot settings
+#
+# The settings are read from a TOML file (radios.toml in the
+# current directory, by default), with one table for each group
+# of settings. Any setting that is not in the file keeps its
+# default value (the values of the circuit in this folder):
+#
+#   [circuit]
+#   L = 30e-6
+#   C = 303e-12
+#
+#   [sweep]
+#   steps = 50
+#
+# See radios.toml for all the settings.
+#
+import copy
+from pathlib import Path
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+# Config file used if none is given
+CONFIG_FILE = "radios.toml"
+
+DEFAULTS = {
+    "circuit": {
+        # Inductor with series resistance R, capacitor, and sense
+        # resistor
+        "L": 30e-6,
+        "R": 0.6,
+        "C": 303e-12,
+        "Rs": 22,
+    },
+    "sweep": {
+        "f_low": 1e3,
+        "f_high": 6e7,
+        "steps": 100,
+        # Input amplitude (V)
+        "vin": 0.4,
+        "measurement": "statistic",
+        "savefile": "meas.csv",
+        # Store that the results of each sweep are added to (see
+        # store.py)
+        "store": "results.store",
+        # File of calibration profiles, which start each sweep from
+        # the settings found by the last sweep of the same circuit
+        # (see calibration.py), or "" to start from scratch
+        "calibration": "~/.cache/radios/calibration.json",
+    },
+    "tolerance": {
+        # Relative tolerances of the components (see tolerance.py),
+        # their distribution ("uniform" or "normal"), and the number
+        # of sets of components drawn
+        "L": 0.05,
+        "C": 0.05,
+        "R": 0.2,
+        "Rs": 0.01,
+        "distribution": "uniform",
+        "samples": 10000,
+    },
+    "plot": {
+        # Minimum measurement amplitude of the oscilloscope (V)
+        "vlim": 0.5e-3,
+        # AM channel bandwidth, and the frequencies of the station
+        # and the intermediate frequency
+        "bw_kHz": 10,
+        "station": "BBC Radio Somerset",
+        "station_kHz": 1566,
+        "f_if_kHz": 455,
+    },
+    "server": {
+        # Unix socket of the bench server (see server.py)
+        "socket": "~/.cache/radios/bench.sock",
+    },
+}
+
+def load_config(path = None):
+    '''
+    Return the settings (a dictionary of tables, as DEFAULTS),
+    updated from the config file path (by default, CONFIG_FILE if
+    it exists). ValueError is raised if the file contains a table
+    or setting that does not exist.
+    '''
+    config = copy.deepcopy(DEFAULTS)
+    if path is None:
+        if not Path(CONFIG_FILE).is_file():
+            return config
+        path = CONFIG_FILE
+    if tomllib is None:
+        raise RuntimeError("Reading config files needs Python 3.11 or later")
+    with open(path, "rb") as f:
+        settings = tomllib.load(f)
+    for table, values in settings.items():
+        if table not in config or not isinstance(values, dict):
+            raise ValueError(f"Unknown table '{table}' in {path}")
+        for key, value in values.items():
+            if key not in config[table]:
+                raise ValueError(f"Unknown setting '{table}.{key}' in {path}")
+            config[table][key] = value
+    return config
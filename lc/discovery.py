@@ -0,0 +1,178 @@
+# Finding and reconnecting to the instruments
+#
+# Listing the VISA resources probes every VISA backend, which is
+# the slowest part of connecting to the oscilloscope. The address
+# of each instrument that is found (the VISA resource name of the
+# oscilloscope, and the serial device of the signal generator) is
+# saved in a cache file, and tried first the next time. A full
+# search is only made if the cached address cannot be opened.
+# One VISA ResourceManager is shared by the whole process.
+#
+# The connections are wrapped in Reconnecting, so that if an
+# instrument is disconnected during a sweep (for example, the USB
+# connection drops out), it is reopened and the command that
+# failed is repeated, and the sweep carries on.
+#
+import json
+import logging
+import os
+import threading
+from time import sleep, monotonic
+from pathlib import Path
+import pyvisa
+
+log = logging.getLogger(__name__)
+
+# File containing the last known address of each instrument
+CACHE_FILE = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) \
+    / "radios" / "instruments.json"
+
+_rm = None
+_rm_lock = threading.Lock()
+
+def resource_manager():
+    '''
+    Return the VISA ResourceManager shared by the process (which
+    is created the first time)
+    '''
+    global _rm
+    with _rm_lock:
+        if _rm is None:
+            _rm = pyvisa.ResourceManager()
+        return _rm
+
+def load_cache():
+    '''
+    Return the dictionary of cached instrument addresses (empty if
+    there is no cache file, or it cannot be read)
+    '''
+    try:
+        return json.loads(CACHE_FILE.read_text())
+    except (OSError, ValueError):
+        return {}
+
+def save_address(key, address):
+    '''
+    Save the address of an instrument in the cache file
+    '''
+    cache = load_cache()
+    if cache.get(key) == address:
+        return
+    cache[key] = address
+    try:
+        CACHE_FILE.parent.mkdir(parents = True, exist_ok = True)
+        tmp = CACHE_FILE.with_suffix(".tmp")
+        tmp.write_text(json.dumps(cache, indent = 1))
+        tmp.replace(CACHE_FILE)
+    except OSError as e:
+        log.warning(f"Unable to save instrument cache: {e}")
+
+def disconnected(e):
+    '''
+    Return True if the exception e means that the instrument has
+    been disconnected (rather than, for example, a timeout)
+    '''
+    if isinstance(e, pyvisa.errors.VisaIOError):
+        return e.error_code != pyvisa.constants.VI_ERROR_TMO
+    return isinstance(e, (OSError, pyvisa.errors.InvalidSession))
+
+def open_cached(key, scan, open_address):
+    '''
+    Open an instrument, trying its cached address first. scan()
+    searches for the instrument, and returns its address (or
+    raises RuntimeError if it cannot be found), and
+    open_address(address) opens the connection. The address that
+    is opened is saved in the cache. Returns the connection.
+    '''
+    address = load_cache().get(key)
+    if address is not None:
+        try:
+            connection = open_address(address)
+            log.debug(f"Opened {key} at cached address {address}")
+            return connection
+        except Exception as e:
+            if not disconnected(e) and not isinstance(e, ValueError):
+                raise
+            log.info(f"Cached {key} address {address} failed ({e}); searching")
+    address = scan()
+    connection = open_address(address)
+    save_address(key, address)
+    return connection
+
+class Reconnecting:
+    '''
+    Instrument connection (VISA resource or serial port) which
+    reopens itself if the instrument is disconnected, and repeats
+    the command that failed. reopen() returns a new connection.
+    Attributes set on the connection (such as the timeout) are set
+    again on the new connection, and then on_reconnect() is called
+    (if it is set). If a read fails, the last command written is
+    sent again before repeating the read, because the response
+    was lost. Reconnection is attempted every interval seconds,
+    for up to timeout seconds, before RuntimeError is raised.
+    '''
+    def __init__(self, connection, reopen, on_reconnect = None,
+                 timeout = 60, interval = 1):
+        self.__dict__.update(connection = connection, reopen = reopen,
+                             on_reconnect = on_reconnect, timeout = timeout,
+                             interval = interval, attributes = {},
+                             last_write = None)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.connection, name)
+        if not callable(attribute) or name == "close":
+            return attribute
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__:
+            self.__dict__[name] = value
+        else:
+            self.attributes[name] = value
+            setattr(self.connection, name, value)
+
+    def call(self, name, *args, **kwargs):
+        '''
+        Call a method of the connection, reconnecting and repeating
+        the call if the instrument has been disconnected
+        '''
+        if name == "write":
+            self.__dict__["last_write"] = (args, kwargs)
+        try:
+            return getattr(self.connection, name)(*args, **kwargs)
+        except Exception as e:
+            if not disconnected(e):
+                raise
+            log.warning(f"Instrument disconnected ({e}); reconnecting")
+            self.reconnect()
+        if name.startswith("read") and self.last_write is not None:
+            args_written, kwargs_written = self.last_write
+            self.connection.write(*args_written, **kwargs_written)
+        return getattr(self.connection, name)(*args, **kwargs)
+
+    def reconnect(self):
+        '''
+        Reopen the connection, retrying until it succeeds or the
+        timeout is reached
+        '''
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+        deadline = monotonic() + self.timeout
+        while True:
+            try:
+                connection = self.reopen()
+                break
+            except Exception as e:
+                if not disconnected(e) and not isinstance(e, RuntimeError):
+                    raise
+                if monotonic() > deadline:
+                    raise RuntimeError(f"Unable to reconnect: {e}") from e
+                sleep(self.interval)
+        for name, value in self.attributes.items():
+            setattr(connection, name, value)
+        self.__dict__["connection"] = connection
+        log.info("Reconnected")
+        if self.on_reconnect is not None:
+            self.on_reconnect()
@@ -1,127 +1,411 @@
+import json
+import logging
 import pyvisa
 import re
-from time import sleep
+import numpy as np
+from contextlib import contextmanager
+from pathlib import Path
+from time import monotonic
+from discovery import Reconnecting, open_cached, resource_manager
+from dsp import tone_phasors
+from readiness import wait_until
 
-def open_rigol_resource(rm):
+log = logging.getLogger(__name__)
+
+# USB vendor and product IDs of the Rigol DS1054z
+RIGOL_VENDOR_ID = "6833"
+RIGOL_PRODUCT_ID = "1230"
+
+# Number of horizontal divisions on the screen (the waveform read
+# in NORMAL mode covers all of them)
+HORIZONTAL_DIVS = 12
+
+# Most points that can be read by one :WAVEFORM:DATA? in RAW mode,
+# and the type of the samples, for each waveform format. (In WORD
+# format, each 8-bit sample is sent as two bytes.)
+MAX_RAW_POINTS = {"BYTE": 250000, "WORD": 125000}
+SAMPLE_TYPES = {"BYTE": np.dtype(np.uint8), "WORD": np.dtype("<u2")}
+
+# Fastest rate at which the measurements are updated: with short
+# timebases, there is one new value of each measurement every
+# MEASUREMENT_PERIOD seconds (s)
+MEASUREMENT_PERIOD = 0.05
+
+# Statistics larger than this are not valid (the oscilloscope
+# returns 9.9E37)
+MAX_VALID = 1e6
+
+# Operation complete bit of the event status register (*ESR?), and
+# the event summary bit of the status byte (*STB?)
+OPERATION_COMPLETE = 0x01
+EVENT_SUMMARY = 0x20
+
+# Service request events, and how long to wait for one when finding
+# out whether the connection supports them
+SERVICE_REQUEST = pyvisa.constants.EventType.service_request
+EVENT_QUEUE = pyvisa.constants.EventMechanism.queue
+SRQ_PROBE_MS = 100
+
+# Errors raised by connections without service requests or status
+# byte reads
+UNSUPPORTED = (AttributeError, NotImplementedError, pyvisa.errors.VisaIOError)
+
+def rigol_resources(rm):
     '''
-    Search for the Rigol DS1054z oscilloscope in the VISA
-    resource list, and return the opened resource
-    '''
-    # Rigol DS1054z
-    vender_id = "6833"
-    product_id = "1230"
-
-    resources = rm.list_resources()
-    matches = [i for i, elem in enumerate(resources) if
-               re.search(vender_id, elem) and
-               re.search(product_id, elem)]
-    if len(matches) != 1:
-        raise RuntimeError("Unable to open connection to DS1054z")
+    Return the names of all the Rigol DS1054z oscilloscopes in
+    the VISA resource list (sorted, so that the order does not
+    change between runs)
+    '''
+    return sorted(r for r in rm.list_resources()
+                  if re.search(RIGOL_VENDOR_ID, r)
+                  and re.search(RIGOL_PRODUCT_ID, r))
+
+def find_rigol_resource(rm = None):
+    '''
+    Search the VISA resource list for the Rigol DS1054z, and
+    return its resource name. RuntimeError is raised unless there
+    is exactly one.
+    '''
+    resources = rigol_resources(rm if rm is not None else resource_manager())
+    if len(resources) != 1:
+        raise RuntimeError("Unable to open connection to DS1054z "
+                           f"(found {len(resources)})")
+    return resources[0]
+
+def open_scope(resource = None):
+    '''
+    Open the Rigol DS1054z (the given resource, or by default,
+    the last one opened, or the only one in the VISA resource
+    list) using the shared ResourceManager. The resource reopens
+    itself if the oscilloscope is disconnected (see discovery.py).
+    '''
+    rm = resource_manager()
+    if resource is not None:
+        open_resource = lambda: rm.open_resource(resource)
     else:
-        return rm.open_resource(resources[matches[0]])
+        open_resource = lambda: open_cached("scope", find_rigol_resource,
+                                            rm.open_resource)
+    return Reconnecting(open_resource(), open_resource)
+
+def decode(codes, preamble, dtype = np.float32):
+    '''
+    Return the voltages of the samples codes (read by
+    DS1054Z.read_memory()), using the scale and offset in the
+    preamble. The voltages are calculated in place in a new array
+    of dtype (single precision by default, which is plenty for
+    8-bit samples and halves the size of long captures).
+    '''
+    v = np.empty(len(codes), dtype = dtype)
+    np.subtract(codes, preamble["yorigin"] + preamble["yreference"], out = v,
+                casting = "unsafe")
+    v *= preamble["yincrement"]
+    return v
+
+def sample_times(preamble, start = 0, stop = None):
+    '''
+    Return the times (relative to the trigger) of the samples from
+    start to stop of a waveform with the given preamble
+    '''
+    stop = preamble["points"] if stop is None else stop
+    return (np.arange(start, stop) - preamble["xreference"]) \
+        * preamble["xincrement"] + preamble["xorigin"]
+
+def load_capture(path):
+    '''
+    Open a capture saved by DS1054Z.read_memory(), and return the
+    (memory-mapped, read-only) array of samples and the preamble
+    '''
+    path = Path(path)
+    preamble = json.loads(path.with_suffix(".json").read_text())
+    return np.load(path, mmap_mode = "r"), preamble
+
+def open_rigol_resource(rm, resource = None):
+    '''
+    Search for the Rigol DS1054z oscilloscope in the VISA
+    resource list, and return the opened resource. If there
+    are several oscilloscopes, pass the name of the resource
+    to open (see rigol_resources()).
+    '''
+    if resource is None:
+        resource = find_rigol_resource(rm)
+    return rm.open_resource(resource)
 
 class DS1054Z:
     '''
     Rigol DS1054z oscilloscope connection. Use to set timebase, control vertical
     range, and make measurements of waveforms.
+
+    The settings (vertical scale and offset, timebase and trigger)
+    are cached, so that setting a value that is already set does
+    not send any commands, and reading a setting back only queries
+    the oscilloscope the first time after it changes. Call
+    invalidate() if the settings are changed in some other way
+    (for example, from the front panel).
+
+    Commands can be batched using batch(), which sends all the
+    commands written inside the with block as one message, and
+    waits for completion once at the end.
+
+    Waits for readings to become valid, and for acquisitions to
+    finish, back off exponentially between queries (see
+    readiness.py), and end with RuntimeError at a deadline. The
+    end of an acquisition is signalled by the oscilloscope (see
+    wait_for_event()), using service requests if the connection
+    supports them.
     '''
-    def __init__(self, timeout_seconds = 1):
+    def __init__(self, timeout_seconds = 1, dev = None, resource = None):
         '''
-        Create a new oscilloscope object
+        Create a new oscilloscope object. By default, the
+        DS1054z is opened at its last known address, or found in
+        the VISA resource list (pass the resource name if there is
+        more than one), and is reconnected if the connection drops
+        out (see open_scope()). Pass an already-open resource as
+        dev to use that instead (for example, a simulated
+        oscilloscope from sim.py).
         '''
-        rm = pyvisa.ResourceManager()
-        self.dev = open_rigol_resource(rm)
-        id = self.dev.query("*IDN?")
-        print(f"Connected to: {id}")
+        if dev is None:
+            dev = open_scope(resource)
+        if isinstance(dev, Reconnecting):
+            dev.on_reconnect = self.reconnected
+        self.dev = dev
+        self.invalidate()
+        # Commands waiting to be sent (None unless batching)
+        self.queue = None
+        self.idn = self.dev.query("*IDN?").strip()
+        log.info(f"Connected to: {self.idn}")
         self.dev.timeout = timeout_seconds * 1e3
-        print(f"Set device timeout to {self.dev.timeout} ms")
+        log.debug(f"Set device timeout to {self.dev.timeout} ms")
+        self.probe_events()
 
     def reset(self):
         '''
         Reset the device
         '''
-        print("Resetting the device")
-        self.dev.write("*RST")
+        log.info("Resetting the device")
+        self.write("*RST")
+        self.invalidate()
         self.wait_for_completion()
-            
+
+    def write(self, command):
+        '''
+        Write a command to the oscilloscope, or add it to the
+        queue if the commands are being batched
+        '''
+        if self.queue is None:
+            self.dev.write(command)
+        else:
+            self.queue.append(command)
+
+    def query(self, command):
+        '''
+        Write any batched commands, and then send the query and
+        return the response
+        '''
+        self.flush()
+        return self.dev.query(command)
+
+    def flush(self):
+        '''
+        Send the batched commands as one message (separated by ;)
+        '''
+        if self.queue:
+            self.dev.write(";".join(self.queue))
+            self.queue.clear()
+            self.batch_written = True
+
+    @contextmanager
+    def batch(self):
+        '''
+        Context manager which batches the commands written inside
+        the with block. The commands are sent as one message when
+        the block ends (or before the next query), and the wait
+        for completion (*OPC?) is only made once at the end,
+        instead of after each command. Batches may be nested, in
+        which case the outermost batch sends the commands. If the
+        block raises an exception, the commands still queued are
+        dropped, and the cached settings are forgotten (they may
+        have been recorded for commands that were never sent).
+        '''
+        if self.queue is not None:
+            yield
+            return
+        self.queue = []
+        self.batch_written = False
+        try:
+            yield
+            self.flush()
+        except BaseException:
+            self.invalidate()
+            raise
+        finally:
+            self.queue = None
+        if self.batch_written:
+            self.wait_for_completion()
+
+    def reconnected(self):
+        '''
+        Called after reconnecting: the settings may have changed
+        while disconnected, and the events need enabling again
+        '''
+        self.invalidate()
+        self.enable_events()
+
+    def invalidate(self):
+        '''
+        Forget the cached settings, so that they are read from
+        (and written to) the oscilloscope next time they are used
+        '''
+        # Values requested by the setters, and the values read back
+        # (which may differ, because the oscilloscope rounds them)
+        self.requested = {}
+        self.settings = {}
+
+    def write_setting(self, key, value, command, rounded = False):
+        '''
+        Write command to change the setting key to value, unless
+        the setting already has that value. If the oscilloscope
+        rounds the value (rounded is True), the value is read back
+        from the oscilloscope the next time it is needed. Returns
+        True if the command was written.
+        '''
+        if self.requested.get(key) == value or self.settings.get(key) == value:
+            return False
+        self.write(command)
+        self.requested[key] = value
+        if rounded:
+            self.settings.pop(key, None)
+        else:
+            self.settings[key] = value
+        return True
+
+    def read_setting(self, key, command):
+        '''
+        Return the value of the setting key, using the cached value
+        if there is one, otherwise querying the oscilloscope using
+        command
+        '''
+        if key not in self.settings:
+            self.settings[key] = float(self.query(command))
+        return self.settings[key]
 
     def enable_channel(self, n):
         '''
         Turn on the specified channel, set the vertical
         scale to 0.2V/div and zero the vertical offset.
         '''
-        self.dev.write(f":CHANNEL{n}:DISPLAY ON")
-        self.set_vertical_scale(n, 0.2)
-        self.dev.write(f":CHANNEL{n}:OFFSET 0")
-        self.wait_for_completion()
+        with self.batch():
+            self.write_setting(("display", n), True, f":CHANNEL{n}:DISPLAY ON")
+            self.set_vertical_scale(n, 0.2)
+            self.write_setting(("offset", n), 0, f":CHANNEL{n}:OFFSET 0")
         
     def reset_statistic_data(self):
         '''
         Clear the data being used to calculate a statistic,
         ready for a new statistic.
         '''
-        self.dev.write(f":MEASURE:STATISTIC:RESET")
+        self.write(f":MEASURE:STATISTIC:RESET")
         self.wait_for_completion()
         
-    def average_vpp(self, n, max_attempts = 10):
-        '''
-        Read the average peak-to-peak voltage on a channel. If
-        the measurement fails, make repeated attempts up to
-        max_attempts, separated by 0.1 second. RuntimeError is
-        raised if measured fails after max_attempts.
-        '''
-        # Wait until the command returns sensible numbers
-        # (when the statistic is first turned on, it prints
-        # ***** to the screen, and returns 9.9E37 here. The check
-        # for validity is whether vpp < 1e6 (1 MV)
-        cmd = f":MEASURE:STATISTIC:ITEM? AVERAGES,VPP,CHANNEL{n}"
-        for n in range(max_attempts):
-            print(f"Reading Vpp, attempt {n}")
-            vpp = float(self.dev.query(cmd))
-            if abs(vpp) < 1e6:
-                return vpp
-            sleep(0.1)
-        raise RuntimeError("Reached maximum attempts while reading Vpp")
-    
-    def average_phase_difference(self, n1, n2):
-        '''
-        Read the average peak-to-peak voltage on a channel
-        '''
-        # Wait until the command returns sensible numbers
-        # (when the statistic is first turned on, it prints
-        # ***** to the screen, and returns 9.9E37 here
-        cmd = f":MEASURE:STATISTIC:ITEM? AVERAGES,RPHASE,CHANNEL{n1},CHANNEL{n2}"
-        phase = 9.9e37
-        while abs(phase) > 1e6:
-            phase = float(self.dev.query(cmd))
-        print(f"Obtained average phase = {phase} deg between channels {n1} and {n2}")
-        return phase
+    def statistic(self, kind, item, *channels):
+        '''
+        Read a statistic (such as AVERAGES or CURRENT) of a
+        measurement item (for example, VPP with one channel or
+        RPHASE with two). Returns None if the statistic is not
+        valid: when the statistic is first turned on (or reset),
+        the oscilloscope shows ***** until it has made an
+        acquisition, and returns 9.9E37 here.
+        '''
+        sources = ",".join(f"CHANNEL{n}" for n in channels)
+        value = float(self.query(f":MEASURE:STATISTIC:ITEM? {kind},{item},{sources}"))
+        return value if abs(value) < MAX_VALID else None
+
+    def average(self, item, *channels, timeout = 1):
+        '''
+        Read the average of a measurement item (see statistic()),
+        querying again with backoff until it is valid. RuntimeError
+        is raised if it is still not valid after timeout seconds
+        (for example, because the waveform is off the screen).
+        '''
+        sources = ",".join(f"CHANNEL{n}" for n in channels)
+        # The statistics are not valid until after the first
+        # acquisition, so start with a longer delay
+        value = wait_until(lambda: self.statistic("AVERAGES", item, *channels),
+                           timeout, initial = 0.05,
+                           what = f"the average {item} of {sources}")
+        log.debug(f"Obtained average {item} = {value} on {sources}")
+        return value
+
+    def average_vpp(self, n, timeout = 1):
+        '''
+        Read the average peak-to-peak voltage on a channel,
+        waiting up to timeout seconds for it to be valid (see
+        average())
+        '''
+        return self.average("VPP", n, timeout = timeout)
+
+    def average_phase_difference(self, n1, n2, timeout = 1):
+        '''
+        Read the average phase difference in degrees between two
+        channels, waiting up to timeout seconds for it to be valid
+        (see average())
+        '''
+        return self.average("RPHASE", n1, n2, timeout = timeout)
+
+    def current_value(self, item, *channels):
+        '''
+        Read the value of a measurement item (for example, VPP
+        with one channel or RPHASE with two) from the most recent
+        acquisition. RuntimeError is raised if the measurement is
+        not valid (9.9E37 is returned by the oscilloscope).
+        '''
+        value = self.statistic("CURRENT", item, *channels)
+        if value is None:
+            sources = ",".join(f"CHANNEL{n}" for n in channels)
+            raise RuntimeError(f"Invalid {item} measurement on {sources}")
+        return value
+
+    def acquisition_period(self):
+        '''
+        Return the time between acquisitions, and so between new
+        values of the measurements: the time across the screen, or
+        MEASUREMENT_PERIOD if that is longer
+        '''
+        return max(MEASUREMENT_PERIOD, HORIZONTAL_DIVS * self.timebase())
 
     def set_timebase(self, seconds_per_div):
         '''
         Set the timebase of the oscilloscope. The timebase nearest to
         the specified seconds per division is picked.
         '''
-        print(f"Setting main timebase to {seconds_per_div} s/div")
-        self.dev.write(f":TIMEBASE:MAIN:SCALE {seconds_per_div}")
-        self.wait_for_completion()        
+        if self.write_setting("timebase", seconds_per_div,
+                              f":TIMEBASE:MAIN:SCALE {seconds_per_div}",
+                              rounded = True):
+            log.debug(f"Setting main timebase to {seconds_per_div} s/div")
+            self.wait_for_completion()
+
+    def timebase(self):
+        '''
+        Get the timebase of the oscilloscope in seconds per division
+        '''
+        return self.read_setting("timebase", ":TIMEBASE:MAIN:SCALE?")
 
     def set_vertical_scale(self, n, volts_per_div):
         '''
         Set the vertical scale of channel n to the specified volts
         per division (or the closest valid scale)
         '''
-        print(f"Setting vertical scale {volts_per_div}")
-        self.dev.write(f":CHANNEL{n}:SCALE {volts_per_div}")
-        self.wait_for_completion()                
+        if self.write_setting(("scale", n), volts_per_div,
+                              f":CHANNEL{n}:SCALE {volts_per_div}",
+                              rounded = True):
+            log.debug(f"Setting vertical scale {volts_per_div}")
+            self.wait_for_completion()
 
     def vertical_scale(self, n):
         '''
-        Set the vertical scale of channel n to the specified volts
-        per division (or the closest valid scale)
+        Get the vertical scale of channel n in volts per division
         '''
-        v_scale = float(self.dev.query(f":CHANNEL{n}:SCALE?"))
-        print(f"Obtained vertical scale {v_scale}")
+        v_scale = self.read_setting(("scale", n), f":CHANNEL{n}:SCALE?")
+        log.debug(f"Obtained vertical scale {v_scale}")
         return v_scale
         
     def set_trigger(self, n, level):
@@ -130,30 +414,315 @@ class DS1054Z:
         trigger level. The type of triggering is set to rising
         edge. The 
         '''
-        self.dev.write(f":TRIGGER:EDGE:SOURCE CHANNEL{n}")
-        self.dev.write(f":TRIGGER:EDGE:SLOPE POSITIVE")
-        self.dev.write(f":TRIGGER:EDGE:LEVEL {level}")        
-        self.wait_for_completion()
+        with self.batch():
+            self.write_setting("trigger_source", n,
+                               f":TRIGGER:EDGE:SOURCE CHANNEL{n}")
+            self.write_setting("trigger_slope", "POSITIVE",
+                               f":TRIGGER:EDGE:SLOPE POSITIVE")
+            self.write_setting("trigger_level", level,
+                               f":TRIGGER:EDGE:LEVEL {level}", rounded = True)
         
-    def wait_for_completion(self, max_timeouts = 10):
+    def single(self, timeout = 2):
+        '''
+        Make a single acquisition of all the channels, and wait
+        until it has finished (when the trigger status is STOP).
+        The oscilloscope signals when the acquisition is complete
+        (see wait_for_event()), and then the trigger status is
+        checked, and polled with backoff until it is STOP.
+        RuntimeError is raised if it is not STOP after timeout
+        seconds.
+        '''
+        deadline = monotonic() + timeout
+        self.write(":SINGLE")
+        self.wait_for_event(timeout)
+        wait_until(lambda: self.query(":TRIGGER:STATUS?").strip() == "STOP" or None,
+                   max(deadline - monotonic(), 0), what = "the acquisition")
+
+    def run(self):
+        '''
+        Start acquiring continuously again (after single())
+        '''
+        self.write(":RUN")
+        self.wait_for_completion()
+
+    def read_block(self):
+        '''
+        Read a binary block response (in the IEEE 488.2 format
+        #NXXXXXXXX followed by the data) and return the data bytes
+        '''
+        raw = self.dev.read_raw()
+        digits = int(raw[1:2])
+        length = int(raw[2:2 + digits])
+        return raw[2 + digits:2 + digits + length]
+
+    def read_block_into(self, out):
+        '''
+        Read a binary block response (see read_block()) and copy
+        the samples straight into the array out (such as a slice
+        of a preallocated or memory-mapped array). Returns the
+        number of samples read. RuntimeError is raised if there
+        are more than fit in out.
+        '''
+        raw = self.dev.read_raw()
+        digits = int(raw[1:2])
+        count = int(raw[2:2 + digits]) // out.itemsize
+        if count > len(out):
+            raise RuntimeError(f"Expected at most {len(out)} samples, got {count}")
+        out[:count] = np.frombuffer(raw, dtype = out.dtype, count = count,
+                                    offset = 2 + digits)
+        return count
+
+    def waveform_preamble(self):
+        '''
+        Read the waveform preamble, which describes the scaling of
+        the data returned by :WAVEFORM:DATA?. The result is a
+        dictionary of the preamble fields.
+        '''
+        fields = self.query(":WAVEFORM:PREAMBLE?").strip().split(",")
+        names = ["format", "type", "points", "count", "xincrement",
+                 "xorigin", "xreference", "yincrement", "yorigin",
+                 "yreference"]
+        preamble = dict(zip(names, map(float, fields)))
+        for name in ["format", "type", "points", "count"]:
+            preamble[name] = int(preamble[name])
+        return preamble
+
+    def read_waveform(self, n):
+        '''
+        Read the waveform on the screen for channel n, as one
+        binary transfer of 8-bit samples. Returns arrays of times
+        (relative to the trigger) and voltages. RuntimeError is
+        raised if the waveform is clipped (i.e. it does not fit on
+        the screen) or the channel returns no data.
+        '''
+        self.write_setting("waveform_source", n, f":WAVEFORM:SOURCE CHANNEL{n}")
+        self.write_setting("waveform_mode", "NORMAL", ":WAVEFORM:MODE NORMAL")
+        self.write_setting("waveform_format", "BYTE", ":WAVEFORM:FORMAT BYTE")
+        # The preamble only changes when the settings change
+        key = ("preamble", n, self.requested.get(("scale", n)),
+               self.requested.get(("offset", n)), self.requested.get("timebase"))
+        if key not in self.settings:
+            self.settings[key] = self.waveform_preamble()
+        preamble = self.settings[key]
+        self.flush()
+        self.dev.write(":WAVEFORM:DATA?")
+        codes = np.frombuffer(self.read_block(), dtype = np.uint8)
+        if len(codes) == 0:
+            raise RuntimeError(f"No waveform data for channel {n}")
+        if codes.min() == 0 or codes.max() == 255:
+            raise RuntimeError(f"Waveform on channel {n} is clipped")
+        v = (codes - preamble["yorigin"] - preamble["yreference"]) \
+            * preamble["yincrement"]
+        t = (np.arange(len(codes)) - preamble["xreference"]) \
+            * preamble["xincrement"] + preamble["xorigin"]
+        return t, v
+
+    def set_memory_depth(self, points):
+        '''
+        Set the memory depth (the number of points acquired on each
+        channel), or "AUTO". The valid depths depend on the number
+        of channels turned on (up to 24 Mpts with one channel, 12
+        Mpts with two); the oscilloscope must be running.
+        '''
+        self.write_setting("memory_depth", points, f":ACQUIRE:MDEPTH {points}")
+        self.wait_for_completion()
+
+    def read_memory(self, n, path = None, chunk_points = None, format = "BYTE"):
+        '''
+        Read the whole acquisition memory of channel n (after
+        single() or stop()) in RAW mode, in chunks of chunk_points
+        (by default, the most allowed for the format, BYTE or
+        WORD), each read by one :WAVEFORM:DATA? query. The samples
+        of each chunk are copied from the VISA read buffer into one
+        preallocated array, without decoding them: use decode() to
+        get the voltages, and sample_times() for the times. If path
+        is given, the array is a memory-mapped .npy file, so that
+        deep captures are streamed to disk, and the preamble is
+        saved next to it (with the suffix .json; see
+        load_capture()).
+
+        Returns the array of samples and the preamble. The transfer
+        rate is logged, and kept in transfer_stats (to compare
+        chunk sizes).
+        '''
+        if format not in MAX_RAW_POINTS:
+            raise ValueError(f"Unknown waveform format '{format}'")
+        chunk_points = chunk_points or MAX_RAW_POINTS[format]
+        if not 0 < chunk_points <= MAX_RAW_POINTS[format]:
+            raise ValueError(f"chunk_points must be from 1 to {MAX_RAW_POINTS[format]}"
+                             f" in {format} format")
+        with self.batch():
+            self.write_setting("waveform_source", n, f":WAVEFORM:SOURCE CHANNEL{n}")
+            self.write_setting("waveform_mode", "RAW", ":WAVEFORM:MODE RAW")
+            self.write_setting("waveform_format", format, f":WAVEFORM:FORMAT {format}")
+        preamble = self.waveform_preamble()
+        points = preamble["points"]
+        dtype = SAMPLE_TYPES[format]
+        if path is not None:
+            samples = np.lib.format.open_memmap(path, mode = "w+", dtype = dtype,
+                                                shape = (points,))
+            Path(path).with_suffix(".json").write_text(json.dumps(preamble))
+        else:
+            samples = np.empty(points, dtype = dtype)
+        # Read each chunk (with its header) in one VISA read
+        self.dev.chunk_size = chunk_points * dtype.itemsize + 1024
+
+        start_time = monotonic()
+        for start in range(0, points, chunk_points):
+            stop = min(start + chunk_points, points)
+            # The points are numbered from 1
+            self.flush()
+            self.dev.write(f":WAVEFORM:START {start + 1};"
+                           f":WAVEFORM:STOP {stop};:WAVEFORM:DATA?")
+            count = self.read_block_into(samples[start:stop])
+            if count != stop - start:
+                raise RuntimeError(f"Read {count} points from channel {n} at "
+                                   f"point {start + 1}, expected {stop - start}")
+        seconds = monotonic() - start_time
+        if path is not None:
+            samples.flush()
+
+        chunks = -(-points // chunk_points)
+        self.transfer_stats = {
+            "points": points, "bytes": points * dtype.itemsize, "chunks": chunks,
+            "chunk_points": chunk_points, "seconds": seconds,
+            "bytes_per_second": points * dtype.itemsize / seconds if seconds > 0 else np.inf,
+        }
+        log.info(f"Read {points} points from channel {n} in {seconds:.3g} s "
+                 f"({self.transfer_stats['bytes_per_second'] / 1e6:.3g} MB/s, "
+                 f"{chunks} chunks of {chunk_points} points)")
+        return samples, preamble
+
+    def acquire(self, channels):
+        '''
+        Make a single acquisition and read the waveforms of the
+        channels (see read_waveform()). Since the channels come
+        from the same acquisition, they are sampled at the same
+        times. Returns a dictionary mapping the channel to its
+        (times, voltages) arrays, or to None if the waveform was
+        clipped.
+        '''
+        self.single()
+        waveforms = {}
+        try:
+            for n in channels:
+                try:
+                    waveforms[n] = self.read_waveform(n)
+                except RuntimeError:
+                    waveforms[n] = None
+        finally:
+            self.run()
+        return waveforms
+
+    def tone_phasors(self, channels, f):
+        '''
+        Make a single acquisition, read the waveforms of the
+        channels, and measure the component of each at the
+        frequency f (see dsp.tone_phasors). Since the channels
+        come from the same acquisition, the phase difference
+        between them is valid. Returns a dictionary mapping the
+        channel to the complex peak-to-peak amplitude, which is
+        None if the waveform was clipped.
+        '''
+        return {n: None if waveform is None else tone_phasors(*waveform, f)
+                for n, waveform in self.acquire(channels).items()}
+
+    def enable_events(self):
+        '''
+        Clear the status registers, and enable the operation
+        complete event (set by *OPC) in the status byte and as a
+        service request (which is queued by the connection if
+        events is "srq")
+        '''
+        self.dev.write("*CLS;*ESE 1;*SRE 32")
+        if self.events == "srq":
+            self.dev.enable_event(SERVICE_REQUEST, EVENT_QUEUE)
+
+    def probe_events(self):
+        '''
+        Find the best way for wait_for_event() to wait that the
+        connection supports, and set events to it: "srq" (wait for
+        a service request, without sending anything), "stb" (poll
+        the status byte, which is read without a query), or "esr"
+        (poll *ESR?)
         '''
-        Wait for the completetion of a previous command, allowing
-        multiple timeouts to occur in the waiting command (*OPC?). 
-        By setting the number of timeouts, the maximum allowed time
-        can be controlled by the caller. If the maximum number of 
-        timeouts is reached, a runtime error is thrown.
+        self.events = "esr"
+        self.enable_events()
+        try:
+            self.dev.enable_event(SERVICE_REQUEST, EVENT_QUEUE)
+            self.dev.write("*OPC")
+            if not self.dev.wait_on_event(SERVICE_REQUEST, SRQ_PROBE_MS,
+                                          capture_timeout = True).timed_out:
+                self.events = "srq"
+            else:
+                self.dev.disable_event(SERVICE_REQUEST, EVENT_QUEUE)
+        except UNSUPPORTED:
+            pass
+        if self.events == "esr":
+            try:
+                self.dev.read_stb()
+                self.events = "stb"
+            except UNSUPPORTED:
+                pass
+        self.dev.write("*CLS")
+        log.debug(f"Waiting for events using {self.events}")
+
+    def wait_for_event(self, timeout = 10):
+        '''
+        Wait until the operations started by the commands written
+        so far (such as a single acquisition) have completed, or
+        timeout seconds have passed, without tying up the
+        connection with a blocking *OPC? query. *OPC sets the
+        operation complete bit in the event status register when
+        they have, which is waited for as a service request, or
+        by polling the status byte (or *ESR?) with backoff (see
+        probe_events()). Returns False if the wait timed out.
+        '''
+        # Clear any earlier events first (in the same message as
+        # any batched commands)
+        if self.events == "srq":
+            self.flush()
+            self.dev.discard_events(SERVICE_REQUEST, EVENT_QUEUE)
+        self.write("*CLS;*OPC")
+        self.flush()
+        if self.events == "srq":
+            return not self.dev.wait_on_event(SERVICE_REQUEST, int(timeout * 1e3),
+                                              capture_timeout = True).timed_out
+        if self.events == "stb":
+            ready = lambda: self.dev.read_stb() & EVENT_SUMMARY or None
+        else:
+            ready = lambda: int(self.dev.query("*ESR?")) & OPERATION_COMPLETE or None
+        try:
+            wait_until(ready, timeout, what = "the operation to complete")
+            return True
+        except RuntimeError:
+            return False
+
+    def wait_for_completion(self, timeout = 10):
+        '''
+        Wait for the completion of the previous commands, by
+        querying *OPC?, which the oscilloscope answers when they
+        have completed. If the query times out (see the timeout
+        of the constructor), it is repeated, until timeout seconds
+        have passed, when RuntimeError is raised. Inside a batch,
+        the wait is made once at the end of the batch.
         '''
-        for n in range(max_timeouts):
+        if self.queue is not None:
+            return
+        deadline = monotonic() + timeout
+        while True:
             try:
                 self.dev.query("*OPC?")
                 return
             except pyvisa.errors.VisaIOError as e:
-                if e.error_code == pyvisa.constants.VI_ERROR_TMO:
-                    print(f"Got timeout {n}; trying again")
-                else:
+                if e.error_code != pyvisa.constants.VI_ERROR_TMO:
                     raise e
-        raise RuntimeError("Reached maximum timeouts waiting for completion")
-                
+                if monotonic() > deadline:
+                    raise RuntimeError(f"Timed out after {timeout} s waiting "
+                                       "for completion") from e
+                log.warning("Timed out waiting for completion; trying again")
+
+
     def __del__(self):
         self.dev.close()        
         
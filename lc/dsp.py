@@ -0,0 +1,70 @@
+# Signal processing for waveforms captured by the oscilloscope
+#
+import numpy as np
+
+def tone_phasors(t, v, f):
+    '''
+    Measure the component of the waveform v (sampled at times t)
+    at the known frequency f. The function fits
+
+        v(t) = Re(A exp(j 2 pi f t)) + c
+
+    by least squares (the three-parameter sine fit of IEEE 1057,
+    equivalent to a lock-in amplifier with a DC term), so the
+    waveform does not need to contain a whole number of periods.
+    The complex amplitude A is returned, scaled to peak-to-peak
+    volts. If v is two-dimensional (one waveform per row, sampled
+    at the same times), an array of amplitudes is returned.
+    '''
+    wt = 2*np.pi*f*np.asarray(t)
+    basis = np.stack([np.cos(wt), np.sin(wt), np.ones_like(wt)], axis = 1)
+    coeffs = np.linalg.lstsq(basis, np.atleast_2d(v).T, rcond = None)[0]
+    a = 2 * (coeffs[0] - 1j*coeffs[1])
+    return a if np.ndim(v) > 1 else a[0]
+
+def crest_factor(x):
+    '''
+    Return the crest factor (peak divided by RMS value) of the
+    waveform x
+    '''
+    x = np.asarray(x)
+    return abs(x).max() / np.sqrt(np.mean(x**2))
+
+def multisine(harmonics, n_samples = 8192, iterations = 200):
+    '''
+    Synthesise one period (n_samples samples) of a multisine: a
+    sum of equal-amplitude cosines at the given harmonics of the
+    period. The phases start from Schroeder's phases, and are
+    improved by repeatedly clipping the peaks of the waveform and
+    restoring the amplitude spectrum (keeping the phases of the
+    clipped waveform), which lowers the crest factor, so that each
+    tone is as large as possible for a given peak amplitude. The
+    waveform with the lowest crest factor is returned, scaled to
+    a peak of 1.
+    '''
+    harmonics = np.asarray(harmonics)
+    k = np.arange(1, len(harmonics) + 1)
+    spectrum = np.zeros(n_samples // 2 + 1, dtype = complex)
+    spectrum[harmonics] = np.exp(-1j*np.pi*k*(k - 1)/len(k))
+    x = np.fft.irfft(spectrum, n_samples)
+    best = x
+    for n in range(iterations):
+        limit = 0.8 * abs(x).max()
+        clipped = np.fft.rfft(np.clip(x, -limit, limit))
+        spectrum[harmonics] = np.exp(1j*np.angle(clipped[harmonics]))
+        x = np.fft.irfft(spectrum, n_samples)
+        if crest_factor(x) < crest_factor(best):
+            best = x
+    return best / abs(best).max()
+
+def multitone_phasors(v, harmonics):
+    '''
+    Measure the components of the waveform v (sampled over exactly
+    one period, at equal intervals) at the given harmonics of the
+    period, using one FFT. The complex amplitudes are returned,
+    scaled to peak-to-peak volts as for tone_phasors(). If v is
+    two-dimensional, each row is a waveform, and an array of
+    amplitudes is returned for each row.
+    '''
+    v = np.asarray(v)
+    return 4 * np.fft.rfft(v)[..., harmonics] / v.shape[-1]
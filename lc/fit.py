@@ -0,0 +1,301 @@
+# Fit the LC circuit model to measured frequency responses
+#
+# The measured transfer function H = Vout/Vin (from the v_in, v_out
+# and phase columns of meas.csv) is compared with the model of
+# model.py, extended with optional parasitics:
+#
+# * Cp, the capacitance of the output probe (across Rs)
+# * Ls, the inductance of the leads in series with the circuit
+# * Rg, the source resistance of the generator (50 Ohms)
+#
+# H is unchanged if L, R, Rs and 1/C are all scaled by the same
+# factor, so the magnitude of Vin/Vgen = Z/(Z + Rg) (from the
+# v_gen column, the peak-to-peak generator voltage) is fitted as
+# well, which fixes the scale of the impedances relative to Rg.
+# Without v_gen (older measurement files have v_gen = 0), Rs must
+# be given, and is not fitted.
+#
+# The residuals are the differences in log(H) (the real part is the
+# error in the log magnitude, the imaginary part the phase error in
+# radians), so magnitude and phase are fitted together, and the
+# small outputs near resonance count as much as the large ones.
+# The logs of the parameters are fitted (keeping them positive) by
+# Levenberg-Marquardt, with an analytic Jacobian. Every array has
+# a leading batch dimension, so a batch of sweeps is fitted at
+# once:
+#
+#   df = read_results("meas.csv")[0]
+#   print(fit_sweep(df))
+#
+import numpy as np
+import pandas as pd
+from settling import Z_95
+
+# Parameters of the model, in the order of the columns of the
+# results of fit()
+PARAMETERS = ["L", "C", "R", "Rs", "Cp", "Ls", "Rg"]
+
+# Parameters fitted by default
+FREE = ("L", "C", "R", "Rs")
+
+# Values of the parasitics when they are not fitted, and the
+# initial guesses for them when they are
+PARASITICS = {"Cp": 0, "Ls": 0, "Rg": 50}
+INITIAL_PARASITICS = {"Cp": 10e-12, "Ls": 10e-9, "Rg": 50}
+
+def response(f, p, names = PARAMETERS):
+    '''
+    Return H = Vout/Vin and G = Vin/Vgen (complex, with Vgen the
+    open-circuit generator voltage) at frequencies f for the
+    parameters in the dictionary p, and the derivatives of log(H)
+    and log(G) with respect to the logs of the parameters in names
+    (as dictionaries of arrays keyed by parameter name).
+    '''
+    s = 2j*np.pi*f
+    L, C, R, Rs = p["L"], p["C"], p["R"], p["Rs"]
+    Cp, Ls, Rg = p["Cp"], p["Ls"], p["Rg"]
+    # Tank impedance Zt = N/M, probe-loaded sense resistor Zs, and
+    # the total impedance Z driven by the generator
+    N = R + s*L
+    M = 1 + s*R*C + s*s*L*C
+    Zt = N / M
+    P = 1 + s*Rs*Cp
+    Zs = Rs / P
+    Z = Zs + Zt + s*Ls
+    Zg = Z + Rg
+    # Derivatives of Zs and Z with respect to the parameters (using
+    # M - sCN = 1, so that dZt/dL = s/M^2, dZt/dR = 1/M^2 and
+    # dZt/dC = -s Zt^2)
+    dZs = {"Rs": 1 / (P*P), "Cp": -s*Rs*Rs / (P*P)}
+    dZ = {
+        "L": lambda: s / (M*M),
+        "C": lambda: -s*Zt*Zt,
+        "R": lambda: 1 / (M*M),
+        "Rs": lambda: dZs["Rs"],
+        "Cp": lambda: dZs["Cp"],
+        "Ls": lambda: s,
+        "Rg": lambda: 0,
+    }
+    d_log_h = {}
+    d_log_g = {}
+    for name in names:
+        dz = dZ[name]()
+        d_log_h[name] = p[name] * (dZs.get(name, 0) / Zs - dz / Z)
+        d_log_g[name] = p[name] * (dz / Z - (dz + (name == "Rg")) / Zg)
+    return Zs / Z, Z / Zg, d_log_h, d_log_g
+
+def weighted_lstsq(A, y, w):
+    '''
+    Solve the weighted least squares problems A x = y (weights w,
+    zero for missing data) for a batch, where A has shape (batch,
+    points, n) and y and w have shape (batch, points)
+    '''
+    A = A * w[:, :, None]
+    y = np.where(w > 0, y * w, 0)
+    A = np.where(w[:, :, None] > 0, A, 0)
+    lhs = np.einsum("bmi,bmj->bij", A, A)
+    rhs = np.einsum("bmi,bm->bi", A, y)
+    return np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+
+def initial_guess(f, h, g, Rs = None):
+    '''
+    Estimate L, C, R and Rs from the measured transfer functions
+    h and voltage ratios g (NaN where missing), ignoring the
+    parasitics. If Rs is given, it is used instead of estimating
+    it from g. Returns a dictionary of arrays of shape (batch, 1).
+    '''
+    valid = np.isfinite(h)
+    h = np.where(valid, h, 1)
+    if Rs is None:
+        # Where the tank impedance is small, |Z| = Rs/|h|, and
+        # |Z/(Z + Rg)| = g (taking Z to be real)
+        z = PARASITICS["Rg"] * g / (1 - g)
+        small = valid & np.isfinite(g) & (abs(h) > 0.9 * np.max(abs(h), axis = 1, keepdims = True))
+        Rs = np.nanmedian(np.where(small, abs(z * h), np.nan), axis = 1)
+    Rs = np.broadcast_to(np.reshape(Rs, (-1, 1)), (h.shape[0], 1))
+    # The tank impedance, and the weights of its real and imaginary
+    # parts (the inverse of their error, for a constant relative
+    # error of h)
+    zt = Rs * (1/h - 1)
+    weight = np.where(valid, abs(h) / Rs, 0)
+    # The reactance of the tank is X = wL/(1 - w^2 LC) (neglecting
+    # R), so 1/X = 1/(wL) - wC is linear in 1/L and C
+    w = 2*np.pi*f
+    x = zt.imag
+    x = np.where(x != 0, x, np.inf)
+    coeffs = weighted_lstsq(np.stack([1/w, -w], axis = 2), 1/x,
+                            weight * x**2)
+    L = 1 / abs(coeffs[:, :1])
+    C = abs(coeffs[:, 1:])
+    # The resistance of the tank is R/((1 - w^2 LC)^2 + (wRC)^2),
+    # so (neglecting wRC) it is proportional to R
+    u = 1 / (1 - w*w*L*C)**2
+    R = weighted_lstsq(u[:, :, None], zt.real, weight)
+    R = np.maximum(R, 1e-6 * np.sqrt(L/C))
+    return {"L": L, "C": C, "R": R, "Rs": Rs}
+
+def fit(f, h, g = None, free = FREE, max_iter = 100, tolerance = 1e-10,
+        **params):
+    '''
+    Fit the circuit model to a batch of measured frequency
+    responses. f, h (the complex transfer function Vout/Vin) and
+    g (Vin/Vgen, optional) are arrays of shape (batch, points), or
+    one-dimensional for a single sweep; NaN values are ignored.
+    free is the list of parameters to fit (from PARAMETERS). The
+    keyword arguments give the values of the fixed parameters, or
+    the initial guesses for the free ones (by default, estimated
+    from the data).
+
+    Returns a data frame with one row per sweep, containing the
+    values of all the parameters, the half-widths of the 95%
+    confidence intervals of the free parameters (in the columns
+    L_ci, C_ci, and so on), the rms residual and whether the fit
+    converged.
+    '''
+    f, h = np.atleast_2d(f), np.atleast_2d(h)
+    f = np.broadcast_to(f, h.shape)
+    if g is None:
+        g = np.full(h.shape, np.nan)
+    g = np.broadcast_to(np.atleast_2d(g), h.shape)
+    if "Rs" in free and not np.isfinite(g).any(axis = 1).all():
+        raise ValueError("Rs can only be fitted when v_gen was measured "
+                         "(pass Rs, and remove it from free)")
+    free = list(free)
+    for name in params:
+        if name not in PARAMETERS:
+            raise ValueError(f"Unknown parameter '{name}'")
+    for name in PARAMETERS:
+        if name not in free and name not in params and name not in PARASITICS:
+            raise ValueError(f"The value of fixed parameter '{name}' is needed")
+
+    # Initial values, as arrays of shape (batch, 1)
+    batch = h.shape[0]
+    guess = initial_guess(f, h, g, params.get("Rs"))
+    p = {}
+    for name in PARAMETERS:
+        if name in params:
+            value = params[name]
+        elif name in guess:
+            value = guess[name]
+        elif name in free:
+            value = INITIAL_PARASITICS[name]
+        else:
+            value = PARASITICS[name]
+        p[name] = np.broadcast_to(np.asarray(value, dtype = float),
+                                  (batch, 1)).copy()
+
+    # Weights are zero for missing data (which is replaced by 1)
+    w_h = (np.isfinite(h) & (h != 0)).astype(float)
+    w_g = (np.isfinite(g) & (g > 0)).astype(float)
+    h = np.where(w_h > 0, h, 1)
+    g = np.where(w_g > 0, g, 1)
+    weights = np.concatenate([w_h, w_h, w_g], axis = 1)
+
+    def residuals(p, rows):
+        '''
+        Return the residuals, the Jacobian and the cost (sum of
+        squared residuals) of the sweeps in rows
+        '''
+        p = {name: value[rows] for name, value in p.items()}
+        H, G, d_log_h, d_log_g = response(f[rows], p, free)
+        # log(H/h) gives the phase error wrapped to +/- pi
+        r_h = np.log(H / h[rows])
+        r = np.concatenate([r_h.real, r_h.imag,
+                            np.log(abs(G) / g[rows])], axis = 1)
+        J = np.stack([np.concatenate([d_log_h[name].real,
+                                      d_log_h[name].imag,
+                                      d_log_g[name].real], axis = 1)
+                      for name in free], axis = 2)
+        w = weights[rows]
+        r = np.where(w > 0, r, 0)
+        J = J * w[:, :, None]
+        cost = np.sum(r**2, axis = 1)
+        return r, J, np.where(np.isfinite(cost), cost, np.inf)
+
+    # Levenberg-Marquardt, with a damping factor per sweep. Only
+    # the sweeps that have not converged are updated.
+    everything = np.arange(batch)
+    r, J, cost = residuals(p, everything)
+    damping = np.full(batch, 1e-3)
+    converged = np.zeros(batch, dtype = bool)
+    for n in range(max_iter):
+        rows = everything[~converged]
+        Jt = J[rows].transpose(0, 2, 1)
+        A = Jt @ J[rows]
+        grad = (Jt @ r[rows][:, :, None])[:, :, 0]
+        # Scale the damping by the diagonal (with a floor, in case a
+        # parameter has no effect)
+        diag = np.einsum("bii->bi", A)
+        diag = np.maximum(diag, 1e-12 * diag.max(axis = 1, keepdims = True))
+        lhs = A + damping[rows, None, None] * diag[:, :, None] * np.eye(len(free))
+        step = -np.linalg.solve(lhs, grad[:, :, None])[:, :, 0]
+        trial = {name: value.copy() for name, value in p.items()}
+        for i, name in enumerate(free):
+            trial[name][rows] *= np.exp(step[:, i:i+1])
+        r_new, J_new, cost_new = residuals(trial, rows)
+        better = cost_new < cost[rows]
+        improvement = np.where(better, cost[rows] - cost_new, 0)
+        accept = rows[better]
+        for name in free:
+            p[name][accept] = trial[name][accept]
+        r[accept] = r_new[better]
+        J[accept] = J_new[better]
+        cost[accept] = cost_new[better]
+        damping[rows] = np.clip(np.where(better, damping[rows] / 3,
+                                         damping[rows] * 4), 1e-12, 1e12)
+        converged[rows] = (better & (improvement <= tolerance * cost[rows])) \
+            | (abs(step).max(axis = 1) < tolerance) | (damping[rows] >= 1e12)
+        if converged.all():
+            break
+
+    # Covariance of the log parameters, scaled by the residual variance
+    m = weights.sum(axis = 1)
+    dof = np.maximum(m - len(free), 1)
+    A = J.transpose(0, 2, 1) @ J
+    cov = np.linalg.pinv(A) * (cost / dof)[:, None, None]
+    sigma = np.sqrt(np.maximum(np.einsum("bii->bi", cov), 0))
+    columns = {name: p[name][:, 0] for name in PARAMETERS}
+    for i, name in enumerate(free):
+        columns[f"{name}_ci"] = Z_95 * p[name][:, 0] * sigma[:, i]
+    columns["rms"] = np.sqrt(cost / m)
+    columns["converged"] = converged
+    return pd.DataFrame(columns)
+
+def sweep_data(df):
+    '''
+    Return the frequencies, the transfer function Vout/Vin and the
+    ratio Vin/Vgen (NaN if v_gen was not recorded) from a data frame
+    (or dictionary of arrays) of results
+    '''
+    f, v_in, v_out, phase = (np.asarray(df[name], dtype = float)
+                             for name in ["f", "v_in", "v_out", "phase"])
+    h = v_out / v_in * np.exp(-1j*np.radians(phase))
+    # v_in is the amplitude, v_gen the peak-to-peak generator voltage
+    if "v_gen" in df:
+        v_gen = np.asarray(df["v_gen"], dtype = float)
+        g = 2 * v_in / np.where(v_gen > 0, v_gen, np.nan)
+    else:
+        g = np.full(len(f), np.nan)
+    return f, h, g
+
+def fit_sweep(df, free = None, **params):
+    '''
+    Fit the model to the results of a sweep (a data frame in the
+    format of FrequencyResponse.run(), or a dictionary of arrays,
+    as store.ResultStore.load()), returning a one-row data
+    frame (see fit()). By default, L, C, R and Rs are fitted, or
+    only L, C and R (with the value of Rs passed as a keyword
+    argument) if the file has no generator voltages.
+    '''
+    f, h, g = sweep_data(df)
+    if free is None:
+        free = FREE if np.isfinite(g).any() else ("L", "C", "R")
+    return fit(f, h, g, free, **params)
+
+def fit_sweeps(dfs, free = FREE, **params):
+    '''
+    Fit the model to a list of sweeps, which must all have the same
+    number of points, returning a data frame with a row for each
+    '''
+    f, h, g = (np.stack(x) for x in zip(*(sweep_data(df) for df in dfs)))
+    return fit(f, h, g, free, **params)
@@ -1,8 +1,48 @@
+import logging
 from ds1054z import DS1054Z
 from fy6600 import FY6600
-from time import sleep
+from time import sleep, monotonic
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
 import numpy as np
 import pandas as pd
+from results import ResultsWriter, read_results
+from settling import converge
+
+log = logging.getLogger(__name__)
+
+# Factor by which the vertical scale of a channel is increased when
+# its signal is off the screen (so that a few adjustments cover the
+# whole range of scales, from 1 mV/div to 10 V/div)
+SCALE_STEP = 10
+
+# Time for the statistics of the oscilloscope to become valid after
+# a change of settings (s), which each measurement is given for its
+# first readings even after the deadline of its point
+READY_TIME = 1
+
+def refine_frequencies(df, mag_tol, phase_tol, min_ratio = 1.001):
+    '''
+    Find the intervals between neighbouring measured frequencies
+    (in the frequency response data frame df) where the magnitude
+    response changes by more than mag_tol (in dB) or the phase
+    changes by more than phase_tol (in degrees). Intervals where
+    the ratio of the end frequencies is smaller than min_ratio
+    are not refined further. Returns the geometric midpoints of
+    these intervals, ordered so that the interval with the largest
+    change (relative to the tolerances) comes first.
+    '''
+    df = df.sort_values("f")
+    f = df["f"].to_numpy()
+    mag = 20*np.log10(df["v_out"].to_numpy() / df["v_in"].to_numpy())
+    phase = df["phase"].to_numpy()
+    d_mag = abs(np.diff(mag)) / mag_tol
+    d_phase = abs((np.diff(phase) + 180) % 360 - 180) / phase_tol
+    change = np.maximum(d_mag, d_phase)
+    refine = (change > 1) & (f[1:] / f[:-1] > min_ratio)
+    order = np.argsort(-change[refine])
+    return np.sqrt(f[:-1] * f[1:])[refine][order]
 
 class FrequencyResponse:
     '''
@@ -40,42 +80,147 @@ class FrequencyResponse:
 
     Creating the classes initialises the signal generator and
     oscilloscope in their starting states ready for the frequency
-    sweep. Call run() to begin the sweep.
+    sweep. Call run() to begin the sweep. By default, an FY6600
+    on /dev/ttyUSB0 and the attached DS1054Z are used; pass gen
+    and osc to use other (or simulated) instruments. If the
+    oscilloscope has already been set up by an earlier
+    FrequencyResponse (with the same channels), pass reset =
+    False to skip resetting it: the channel and trigger settings
+    are then cached, and no commands are sent.
+
+    There are two ways to make the measurements, selected using
+    measurement:
+
+    * "statistic": the amplitudes and phase are read from the
+      oscilloscope's measurements of successive acquisitions, and
+      averaged until the 95% confidence interval of the mean is
+      within amplitude_tolerance (relative to the amplitude) or
+      phase_tolerance (in degrees), or until point_timeout
+      seconds have passed since the start of the point (see
+      settling.converge()). The readings are taken once per
+      acquisition. The confidence intervals are stored in the
+      results.
+    * "waveform": the waveforms on both channels are read from a
+      single acquisition, and the amplitudes and phase at the
+      generator frequency are calculated from the samples (see
+      DS1054Z.tone_phasors()). No averaging delays are needed.
+
+    After each change of the generator settings, the circuit is
+    left to settle for settle_time seconds.
+
+    To record the commands sent to the instruments and the time
+    spent on each step of each point, pass a Tracer (see
+    tracing.py) as tracer.
+
+    To start each frequency from the generator voltage, vertical
+    scales, timebase and settle time found the last time the
+    circuit was swept on this bench, pass a CalibrationCache (see
+    calibration.py) as calibration, and a dictionary of the
+    component values of the circuit as circuit. The profile is
+    updated and saved at the end of each sweep.
     '''
     def __init__(self, freq_low, freq_high, freq_steps,
                  vin_amplitude, input_channel = 1,
-                 output_channel = 2):
-        self.gen = FY6600()
-        self.osc = DS1054Z()
-        self.input_channel = 1
-        self.output_channel = 2
+                 output_channel = 2, gen = None, osc = None,
+                 measurement = "statistic", settle_time = 0.05,
+                 amplitude_tolerance = 0.005, phase_tolerance = 0.5,
+                 point_timeout = 10, tracer = None, reset = True,
+                 calibration = None, circuit = None):
+        if measurement not in ("statistic", "waveform"):
+            raise ValueError(f"Unknown measurement type '{measurement}'")
+        self.gen = gen if gen is not None else FY6600()
+        self.osc = osc if osc is not None else DS1054Z()
+        self.tracer = tracer
+        if tracer is not None:
+            tracer.attach(self.gen, self.osc)
+        self.input_channel = input_channel
+        self.output_channel = output_channel
+        self.measurement = measurement
+        self.settle_time = settle_time
+        self.amplitude_tolerance = amplitude_tolerance
+        self.phase_tolerance = phase_tolerance
+        self.point_timeout = point_timeout
         self.target_input_amplitude = vin_amplitude
         self.gen_max_voltage = 5
         self.gen_min_voltage = 0
+        # Generator voltage (unknown until it is first set)
+        self.v_gen = None
+        # Time (from monotonic()) by which the averaging of the
+        # current point ends
+        self.deadline = None
         
-        self.osc.reset()
-        self.osc.enable_channel(self.input_channel)
-        self.osc.enable_channel(self.output_channel)
-        self.osc.set_trigger(self.input_channel, 0.0)
+        with self.osc.batch():
+            if reset:
+                self.osc.reset()
+            self.osc.enable_channel(self.input_channel)
+            self.osc.enable_channel(self.output_channel)
+            self.osc.set_trigger(self.input_channel, 0.0)
         
         self.freq = np.geomspace(freq_low, freq_high, freq_steps)
+        self.calibration = None
+        if calibration is not None:
+            bench = {"oscilloscope": getattr(self.osc, "idn", None),
+                     "generator": getattr(self.gen.ser, "port", None)}
+            self.calibration = calibration.profile(
+                bench, circuit, vin_amplitude = vin_amplitude,
+                input_channel = input_channel, output_channel = output_channel,
+                measurement = measurement)
         
+    def step(self, name):
+        '''
+        Return a context manager marking a step of the measurement
+        of a point, for the tracer (if there is one)
+        '''
+        return self.tracer.step(name) if self.tracer else nullcontext()
+
+    def point(self, f):
+        '''
+        Return a context manager marking the measurement of the
+        point at frequency f, for the tracer (if there is one). The
+        point_timeout of the point starts now.
+        '''
+        self.deadline = monotonic() + self.point_timeout
+        return self.tracer.point(f) if self.tracer else nullcontext()
+
     def set_frequency(self,f):
         '''
         Set the frequency of the signal generator 
         to f, and update the timebase of the oscilloscope
         to target one full period in 6 divisions. Next,
-        the system is left to settle for one second, and
-        then the statistic data is reset ready for 
-        measurements.
+        the system is left to settle, and then the
+        statistic data is reset ready for measurements.
+        If the calibration profile has an entry for f, the
+        generator voltage, vertical scales, timebase and settle
+        time are set from it (all before settling once). Returns
+        the settle time.
         '''
+        entry = self.calibration.lookup(f) if self.calibration else None
         self.gen.set_frequency(f)    
+        self.f = f
+        if entry is None:
+            self.osc.set_timebase(self.seconds_per_div(f))
+            settle_time = self.settle_time
+        else:
+            self.gen.set_amplitude(entry["v_gen"])
+            self.v_gen = entry["v_gen"]
+            with self.osc.batch():
+                self.osc.set_timebase(entry["timebase"])
+                for channel, volts_per_div in entry["scales"].items():
+                    self.osc.set_vertical_scale(int(channel), volts_per_div)
+            settle_time = max(entry["settle_time"], self.settle_time)
+        sleep(settle_time)
+        if self.measurement == "statistic":
+            self.osc.reset_statistic_data()
+        return settle_time
+
+    def seconds_per_div(self, f):
+        '''
+        Return the timebase which shows one full period of
+        frequency f in 6 divisions
+        '''
         period = 1/f
         num_divs = 6
-        seconds_per_div = period/num_divs
-        self.osc.set_timebase(seconds_per_div)
-        sleep(0.5)
-        self.osc.reset_statistic_data()
+        return period/num_divs
 
     def update_vertical_scale(self, channel, volts_per_div):
         '''
@@ -91,23 +236,72 @@ class FrequencyResponse:
     def auto_vertical_scale(self, channel, max_adjustments = 5):
         '''
         Adjust the channel vertical scale to fit the signal
-        on the middle four divisions. Raises a RuntimeError
-        if max_adjustments are made and the signal amplitude
-        cannot be read.
+        on the middle four divisions. If the signal is off the
+        screen, the scale is increased by SCALE_STEP and the signal
+        is measured again. Raises a RuntimeError if max_adjustments
+        are made and the signal amplitude cannot be read.
         '''
         for n in range(max_adjustments):
             try:
-                v_meas = self.osc.average_vpp(channel) / 2
+                v_meas = self.vpp(channel) / 2
                 num_divs = 2
                 volts_per_div = v_meas / num_divs
                 self.update_vertical_scale(channel, volts_per_div)
                 return
             except RuntimeError:
-                print(f"Performing vertical adjustment {n}")
+                log.debug(f"Performing vertical adjustment {n}")
                 volts_per_div = self.osc.vertical_scale(channel)
-                self.update_vertical_scale(channel, 2 * volts_per_div)
+                self.update_vertical_scale(channel, SCALE_STEP * volts_per_div)
         raise RuntimeError("Reached maximum vertical adjustments")
 
+    def vpp(self, channel):
+        '''
+        Measure the peak-to-peak voltage on a channel, using
+        the measurement type chosen in the constructor. Raises
+        RuntimeError if the waveform does not fit on the screen.
+        '''
+        if self.measurement == "waveform":
+            phasor = self.osc.tone_phasors([channel], self.f)[channel]
+            if phasor is None:
+                raise RuntimeError(f"Waveform on channel {channel} is clipped")
+            return abs(phasor)
+        return self.osc.average_vpp(channel)
+
+    def measurement_deadline(self):
+        '''
+        Return the time (from monotonic()) by which a measurement
+        ends its averaging: the deadline of the point, but at least
+        READY_TIME seconds from now, so that a measurement started
+        at the deadline still gets its first valid readings. Returns
+        None if no point has been started.
+        '''
+        if self.deadline is None:
+            return None
+        return max(self.deadline, monotonic() + READY_TIME)
+
+    def converged_amplitude(self, channel, tolerance = None):
+        '''
+        Make a measurement of the amplitude on a channel,
+        after adjusting the vertical scale to place the
+        signal across the middle four divisions. In statistic
+        mode, the amplitude is averaged until it converges to
+        within tolerance (relative to the amplitude; by default
+        amplitude_tolerance). Returns the amplitude and the
+        half-width of its 95% confidence interval (NaN in
+        waveform mode).
+        '''
+        if tolerance is None:
+            tolerance = self.amplitude_tolerance
+        self.auto_vertical_scale(channel)
+        if self.measurement == "waveform":
+            return self.vpp(channel) / 2, np.nan
+        vpp, ci = converge(lambda: self.osc.current_value("VPP", channel),
+                           tolerance, relative = True,
+                           timeout = self.point_timeout,
+                           interval = self.osc.acquisition_period(),
+                           deadline = self.measurement_deadline())
+        return vpp / 2, ci / 2
+
     def channel_amplitude(self, channel):
         '''
         Make a measurement of the amplitude on a channel.
@@ -115,8 +309,7 @@ class FrequencyResponse:
         attempt to place the signal across the middle
         four divisions.
         '''
-        self.auto_vertical_scale(channel)
-        return self.osc.average_vpp(channel) / 2
+        return self.converged_amplitude(channel)[0]
 
     def input_amplitude(self):
         '''
@@ -137,23 +330,87 @@ class FrequencyResponse:
         '''
         return self.channel_amplitude(self.output_channel)    
 
-    def phase_difference(self, num_samples = 10, delay = 0.75):
+    def converged_phase(self):
         '''
         Get the phase difference between the input and the
-        output channels. The result is in degrees. The
-        num_samples determines how many readings are taken
-        (separated by delay seconds) and averaged (the average
-        phase measurement appears highly variable).
-        '''
-        # Reset the statistics and wait for average to stabilise
-        self.osc.reset_statistic_data()
-        sleep(5)        
-        total = 0
-        for n in range(num_samples):
-            total += self.osc.average_phase_difference(self.input_channel,
-                                                       self.output_channel)        
-            sleep(0.75)
-        return total / num_samples
+        output channels, in degrees, and the half-width of its
+        95% confidence interval. The phase measurement is
+        highly variable, so readings are averaged until the
+        mean converges (see settling.converge()).
+        '''
+        read = lambda: self.osc.current_value("RPHASE", self.input_channel,
+                                              self.output_channel)
+        return converge(read, self.phase_tolerance,
+                        timeout = self.point_timeout,
+                        interval = self.osc.acquisition_period(),
+                        deadline = self.measurement_deadline())
+
+    def phase_difference(self):
+        '''
+        Get the phase difference between the input and the
+        output channels. The result is in degrees.
+        '''
+        return self.converged_phase()[0]
+
+    def waveform_measurement(self, max_adjustments = 5):
+        '''
+        Measure the input amplitude, output amplitude and phase
+        difference (in degrees) from a single acquisition of both
+        channels. If either waveform is clipped, or occupies fewer
+        than two vertical divisions, the vertical scale of that
+        channel is adjusted and the acquisition is repeated (up
+        to max_adjustments times, before RuntimeError is raised).
+        '''
+        channels = [self.input_channel, self.output_channel]
+        for n in range(max_adjustments):
+            # Send restarting the acquisition and the changes of
+            # scale together
+            with self.osc.batch():
+                phasors = self.osc.tone_phasors(channels, self.f)
+                adjusted = False
+                for channel in channels:
+                    volts_per_div = self.osc.vertical_scale(channel)
+                    if phasors[channel] is None:
+                        log.debug(f"Performing vertical adjustment {n}")
+                        self.osc.set_vertical_scale(channel,
+                                                    SCALE_STEP * volts_per_div)
+                    elif abs(phasors[channel]) < 2 * volts_per_div:
+                        # Place the signal across the middle four divisions
+                        self.update_vertical_scale(channel,
+                                                   abs(phasors[channel]) / 4)
+                    else:
+                        continue
+                    # The scale may already be at its limit
+                    if self.osc.vertical_scale(channel) != volts_per_div:
+                        adjusted = True
+            if not adjusted:
+                v_in = phasors[self.input_channel]
+                v_out = phasors[self.output_channel]
+                phase = -np.degrees(np.angle(v_out / v_in))
+                return abs(v_in) / 2, abs(v_out) / 2, phase
+        raise RuntimeError("Reached maximum vertical adjustments")
+
+    def measure_point(self):
+        '''
+        Measure the input amplitude, output amplitude and phase
+        difference (in degrees) at the current frequency. The
+        result is a dictionary, which also contains the
+        half-widths of the 95% confidence intervals (NaN if
+        they are not known).
+        '''
+        if self.measurement == "waveform":
+            with self.step("waveform"):
+                v_in, v_out, phase = self.waveform_measurement()
+            v_in_ci = v_out_ci = phase_ci = np.nan
+        else:
+            with self.step("amplitude"):
+                v_in, v_in_ci = self.converged_amplitude(self.input_channel)
+                v_out, v_out_ci = self.converged_amplitude(self.output_channel)
+            with self.step("phase"):
+                phase, phase_ci = self.converged_phase()
+        return {"v_in": v_in, "v_out": v_out, "phase": phase,
+                "v_in_ci": v_in_ci, "v_out_ci": v_out_ci,
+                "phase_ci": phase_ci}
 
     def set_gen_amplitude(self, v):
         '''
@@ -162,78 +419,234 @@ class FrequencyResponse:
         and the signal is scaled to fit on two vertical divisions.
         '''
         self.gen.set_amplitude(v)
+        self.v_gen = v
+        sleep(self.settle_time)
         self.auto_vertical_scale(self.input_channel)
-        sleep(0.5)
-        self.osc.reset_statistic_data()
-        sleep(0.5)
+        if self.measurement == "statistic":
+            self.osc.reset_statistic_data()
         return
 
-    def set_input_amplitude(self, target):
-        '''
-        Adjust the signal generator voltage
-        to obtain the target voltage on the oscilloscope
-        channel. This function uses interval bisection to
-        obtain the correct input voltage. The function 
-        returns the input voltage that was required to 
-        obtain the target output voltage
+    def set_input_amplitude(self, target, v_tol = 0.01, max_iter = 20):
         '''
-        v_tol = 0.01
-        max_iter = 20
+        Adjust the signal generator voltage to obtain the target
+        voltage on the input channel, and return the generator
+        voltage that was required.
 
-        # Make an amplitude measurement
-        # to test if any adjustment is needed
-        v_meas = self.input_amplitude()
-        if abs(v_meas - target) < v_tol:
-            print("No need for amplitude adjustment")
-            return 0
+        The circuit is linear, so the input amplitude is the
+        generator voltage multiplied by a ratio that depends on
+        the source impedance of the generator and the impedance of
+        the device under test. Adjustment starts from the generator
+        voltage used at the previous frequency (where the ratio is
+        usually similar). The first update is proportional (it
+        assumes the measured ratio), and subsequent updates use the
+        secant method, so most frequencies need only one or two
+        measurements. RuntimeError is raised if the input amplitude
+        is not within v_tol of the target after max_iter updates,
+        or if the target is out of reach of the generator. If the
+        10 mV resolution of the generator stops the adjustment
+        short of v_tol, or the point_timeout of the point runs
+        out, the generator is left at the closest voltage found,
+        with a warning. The input amplitude only
+        needs to be measured to within half of v_tol while
+        adjusting the generator.
+        '''
+        def measure():
+            tolerance = v_tol / (2 * target)
+            return self.converged_amplitude(self.input_channel, tolerance)[0]
 
-        print("Amplitude adjustment required")
+        def closest(reason):
+            _, v_gen, v_meas = best
+            log.warning(f"Input amplitude adjustment {reason} at {v_meas:.4g} V "
+                        f"(target {target} V); using v_gen = {v_gen} V")
+            if v_gen != self.v_gen:
+                self.set_gen_amplitude(v_gen)
+            return v_gen
 
-        # Initial state
-        v_low = self.gen_min_voltage
-        v_high = self.gen_max_voltage
+        if self.v_gen is None:
+            self.set_gen_amplitude((self.gen_min_voltage + self.gen_max_voltage) / 2)
+        v_gen = self.v_gen
+        v_meas = measure()
+        previous = None
+        best = (abs(v_meas - target), v_gen, v_meas)
 
         for n in range(max_iter):
-            v_mid = (v_low + v_high) / 2
-            self.set_gen_amplitude(v_mid)
-            v_meas = self.input_amplitude()
-            print(f"n={n}, v_low={v_low}, v_mid={v_mid}, v_high={v_high}: v_meas={v_meas}")
+            log.debug(f"n={n}, v_gen={v_gen}: v_meas={v_meas}")
             if abs(v_meas - target) < v_tol:
-                return v_mid
-            if v_meas > target:
-                v_high = v_mid
+                return v_gen
+            best = min(best, (abs(v_meas - target), v_gen, v_meas))
+            if self.deadline is not None and monotonic() > self.deadline:
+                return closest("ran out of time")
+            if previous is not None and previous[1] != v_meas:
+                # Secant update using the last two measurements
+                slope = (v_gen - previous[0]) / (v_meas - previous[1])
+                v_next = v_gen + (target - v_meas) * slope
+            elif v_meas > 0:
+                # Proportional update using the measured ratio
+                v_next = v_gen * target / v_meas
             else:
-                v_low = v_mid
+                v_next = 2 * v_gen
+            # The generator amplitude has a resolution of 10 mV
+            v_next = round(min(max(v_next, self.gen_min_voltage),
+                               self.gen_max_voltage), 2)
+            if v_next == v_gen:
+                if v_gen == self.gen_max_voltage and v_meas < target \
+                   or v_gen == self.gen_min_voltage and v_meas > target:
+                    raise RuntimeError(f"Input amplitude of {target} V is out of reach "
+                                       f"({v_meas:.3g} V with the generator at "
+                                       f"its limit of {v_gen} V)")
+                return closest("stalled")
+            previous = (v_gen, v_meas)
+            v_gen = v_next
+            self.set_gen_amplitude(v_gen)
+            v_meas = measure()
 
         raise RuntimeError(f"Voltage adjustment did not converge within {max_iter} iterations")
 
-    def run(self, savefile = "meas.csv"):
+    def measure_frequency(self, f):
+        '''
+        Measure the response at frequency f, after adjusting the
+        signal generator to obtain the target input amplitude.
+        Returns a dictionary of the generator voltage and the
+        measurements (see measure_point()).
+        '''
+        with self.point(f):
+            with self.step("settle"):
+                settle_time = self.set_frequency(f)
+            with self.step("level"):
+                v_gen = self.set_input_amplitude(self.target_input_amplitude)
+            point = {"v_gen": v_gen, **self.measure_point()}
+        self.record_calibration(f, v_gen, settle_time)
+        return point
+
+    def record_calibration(self, f, v_gen, settle_time):
+        '''
+        Record the generator voltage v_gen, the vertical scales,
+        timebase and settle time found at frequency f in the
+        calibration profile (if there is one)
+        '''
+        if self.calibration is not None:
+            channels = [self.input_channel, self.output_channel]
+            self.calibration.record(f, {
+                "v_gen": v_gen, "timebase": self.seconds_per_div(f),
+                "scales": {str(n): self.osc.vertical_scale(n) for n in channels},
+                "settle_time": settle_time})
+
+    def save_calibration(self):
+        '''
+        Save the calibration profile (if there is one), with the
+        calibration found at each frequency measured
+        '''
+        if self.calibration is not None:
+            self.calibration.save()
+
+    def metadata(self):
+        '''
+        Return a dictionary describing the sweep settings and the
+        instruments, which is saved in the results file
+        '''
+        return {
+            "started": datetime.now().isoformat(timespec = "seconds"),
+            "oscilloscope": getattr(self.osc, "idn", None),
+            "vin_amplitude": self.target_input_amplitude,
+            "input_channel": self.input_channel,
+            "output_channel": self.output_channel,
+            "measurement": self.measurement,
+            "freq_low": float(self.freq[0]),
+            "freq_high": float(self.freq[-1]),
+            "freq_steps": len(self.freq),
+        }
+
+    def open_results(self, savefile, resume):
+        '''
+        Open the results file for writing, and return the writer
+        and a data frame of the results already in the file (empty
+        unless resuming). When resuming, the file must have been
+        made with the same input amplitude, channels and
+        measurement type, otherwise ValueError is raised.
+        '''
+        metadata = self.metadata()
+        previous = pd.DataFrame(columns = ["f"])
+        if resume and Path(savefile).is_file():
+            previous, previous_metadata = read_results(savefile)
+            for key in ["vin_amplitude", "input_channel", "output_channel",
+                        "measurement"]:
+                if previous_metadata.get(key, metadata[key]) != metadata[key]:
+                    raise ValueError(f"Cannot resume '{savefile}': {key} was "
+                                     f"{previous_metadata[key]}, not {metadata[key]}")
+            log.info(f"Resuming sweep with {len(previous)} points from {savefile}")
+        return ResultsWriter(savefile, metadata, resume), previous
+
+    def run(self, savefile = "meas.csv", resume = False, on_point = None):
         '''
         Run the frequency sweep and return the frequency response 
         data as a dataframe. The function also saves the file as
-        meas
+        meas. The columns are the frequency f, the generator
+        voltage v_gen, the measurements v_in, v_out and phase,
+        and the confidence intervals v_in_ci, v_out_ci and
+        phase_ci (see measure_point()).
+
+        Each point is written to the file as soon as it has been
+        measured (see results.py). If resume is True, the points
+        are added to the existing file, skipping frequencies that
+        are already in it. If on_point is given, it is called with
+        the dictionary of results for each frequency after it has
+        been written.
         '''
-    
-        v_gen = []
-        v_in = []
-        v_out = []
-        phase_in_out = []
-
-        for n, f in enumerate(self.freq):
-            print(f"Measuring frequency {f} Hz ({n}/{len(self.freq)})")
-            self.set_frequency(f)
-            v_gen.append(self.set_input_amplitude(self.target_input_amplitude))
-            v_in.append(self.input_amplitude())
-            v_out.append(self.output_amplitude())
-            phase_in_out.append(self.phase_difference())
-
-        df = pd.DataFrame({
-            "f": self.freq,
-            "v_gen": v_gen,
-            "v_in": v_in,
-            "v_out": v_out,
-            "phase": phase_in_out
-        })
-
-        df.to_csv(savefile)
-        return df
+        writer, previous = self.open_results(savefile, resume)
+        with writer:
+            for n, f in enumerate(self.freq):
+                if np.isclose(previous["f"], f, rtol = 1e-9).any():
+                    log.info(f"Skipping frequency {f} Hz (already measured)")
+                    continue
+                log.info(f"Measuring frequency {f} Hz ({n}/{len(self.freq)})")
+                row = {"f": f, **self.measure_frequency(f)}
+                writer.write(row)
+                if on_point is not None:
+                    on_point(row)
+        self.save_calibration()
+        return read_results(savefile)[0]
+
+    def run_adaptive(self, savefile = "meas.csv", max_points = 100,
+                     mag_tol = 1.0, phase_tol = 10.0, points_per_pass = 4,
+                     resume = False, on_point = None):
+        '''
+        Run an adaptive frequency sweep, and return (and save) the
+        frequency response data as a dataframe in the same format
+        as run(). The frequencies passed to the constructor are
+        measured first, as a coarse sweep. Then, the sweep is
+        repeatedly refined by measuring the midpoints of intervals
+        where the magnitude response changes by more than mag_tol
+        (in dB) or the phase changes by more than phase_tol (in
+        degrees) between neighbouring points. Each refinement
+        pass measures at most points_per_pass points, choosing the
+        intervals with the largest changes first, so that the point
+        budget is spent where the response changes fastest (near
+        resonances). The sweep stops when no intervals need
+        refining, or when max_points frequencies have been
+        measured. As for run(), the points are written to the file
+        as they are measured (and passed to on_point), and the sweep
+        can be resumed.
+        '''
+        writer, previous = self.open_results(savefile, resume)
+        rows = previous.to_dict("records")
+        freq = [f for f in self.freq
+                if not np.isclose(previous["f"], f, rtol = 1e-9).any()]
+        freq = freq[:max(max_points - len(rows), 0)]
+        with writer:
+            while True:
+                # Measure in order of increasing frequency, which keeps
+                # changes of timebase and amplitude small
+                for f in np.sort(freq):
+                    log.info(f"Measuring frequency {f} Hz ({len(rows)}/{max_points})")
+                    rows.append({"f": f, **self.measure_frequency(f)})
+                    writer.write(rows[-1])
+                    if on_point is not None:
+                        on_point(rows[-1])
+                freq = refine_frequencies(pd.DataFrame(rows), mag_tol, phase_tol)
+                freq = freq[:max(min(points_per_pass, max_points - len(rows)), 0)]
+                if len(freq) == 0:
+                    break
+
+        self.save_calibration()
+        df = read_results(savefile)[0]
+        return df.sort_values("f", ignore_index = True)
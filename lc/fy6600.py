@@ -1,11 +1,88 @@
+import logging
+from pathlib import Path
+import numpy as np
 import serial
+from serial.tools import list_ports
+from discovery import Reconnecting, open_cached
+
+log = logging.getLogger(__name__)
+
+# USB vendor and product IDs of the USB-serial converter (CH340)
+# in the FY6600
+FY6600_VENDOR_ID = 0x1a86
+FY6600_PRODUCT_ID = 0x7523
+
+# Serial device used if no FY6600 is found by its USB IDs
+DEFAULT_DEVICE = "/dev/ttyUSB0"
+
+# Waveform codes (for WMW) of the sine wave and of the first
+# arbitrary waveform memory slot. The codes of the slots follow
+# on from the built-in waveforms, so check them against the
+# waveform list of the firmware in use.
+SINE_WAVEFORM = 0
+ARBITRARY_WAVEFORM = 36
+
+# Number of samples in an arbitrary waveform, and the largest
+# sample value (the DAC is 14 bits)
+ARBITRARY_SAMPLES = 8192
+ARBITRARY_MAX_CODE = 2**14 - 1
+
+# Timeout for reading replies from the generator, in seconds
+READ_TIMEOUT = 5
+
+def fy6600_ports():
+    '''
+    Return the serial devices of all the FY6600 signal generators
+    attached (sorted, so that the order does not change between
+    runs)
+    '''
+    return sorted(port.device for port in list_ports.comports()
+                  if port.vid == FY6600_VENDOR_ID
+                  and port.pid == FY6600_PRODUCT_ID)
+
+def find_fy6600():
+    '''
+    Return the serial device of the FY6600 signal generator (or
+    DEFAULT_DEVICE if there are no devices with its USB IDs).
+    RuntimeError is raised if there is more than one.
+    '''
+    ports = fy6600_ports()
+    if len(ports) == 0 and Path(DEFAULT_DEVICE).exists():
+        return DEFAULT_DEVICE
+    if len(ports) != 1:
+        raise RuntimeError("Unable to open connection to FY6600 "
+                           f"(found {len(ports)})")
+    return ports[0]
+
+def open_generator(device = None):
+    '''
+    Open the serial port of the FY6600 (the given device, or by
+    default, the last one opened, or the only one attached). The
+    port reopens itself if the generator is disconnected (see
+    discovery.py). Reads (which are only needed for replies to
+    waveform uploads) time out after READ_TIMEOUT seconds.
+    '''
+    open_address = lambda address: serial.Serial(address,
+                                                 timeout = READ_TIMEOUT)
+    if device is not None:
+        open_port = lambda: open_address(device)
+    else:
+        open_port = lambda: open_cached("generator", find_fy6600,
+                                        open_address)
+    return Reconnecting(open_port(), open_port)
 
 class FY6600:
-    def __init__(self, device = "/dev/ttyUSB0"):
+    def __init__(self, device = None, ser = None):
         '''
-        Create a new FY6600 signal generator object.
+        Create a new FY6600 signal generator object. By default,
+        the serial port device is opened (at its last known
+        address, or found by its USB IDs; see open_generator()).
+        Pass an already-open serial object as ser to use that
+        instead (for example, a simulated generator from sim.py).
         '''
-        self.ser = serial.Serial(device)
+        if ser is None:
+            ser = open_generator(device)
+        self.ser = ser
         self.ser.baudrate = 115200
         # self.ser.write(b"RMA\n")
         # print(self.ser.readline())
@@ -26,10 +103,48 @@ class FY6600:
         # The argument is passed in Volts, formatted
         # as xx.xx (note 5 characters required)
         val = f"{v:05.2f}"
-        print(f"Setting signal generator amplitude to {v} V")
+        log.debug(f"Setting signal generator amplitude to {v} V")
         self.ser.write(f"WMA{val}\n".encode())
 
-        
+    def set_waveform(self, code):
+        '''
+        Select the waveform of the main channel by its code (for
+        example, SINE_WAVEFORM, or ARBITRARY_WAVEFORM + slot - 1)
+        '''
+        self.ser.write(f"WMW{code:02d}\n".encode())
+
+    def expect(self, reply):
+        '''
+        Read a line from the generator, and raise RuntimeError if
+        it is not the expected reply
+        '''
+        line = self.ser.readline().decode(errors = "replace").strip()
+        if line != reply:
+            raise RuntimeError(f"Expected '{reply}' from FY6600, got '{line}'")
+
+    def upload_waveform(self, samples, slot = 1):
+        '''
+        Upload one period of an arbitrary waveform to memory slot
+        slot. samples is an array of ARBITRARY_SAMPLES values between
+        -1 and 1, which are the lowest and highest output voltages
+        (so that the peak-to-peak amplitude set by set_amplitude()
+        spans the full range of the samples). The waveform is
+        played when it is selected with set_waveform(); the
+        frequency set by set_frequency() is the frequency of the
+        whole period.
+        '''
+        samples = np.asarray(samples)
+        if samples.shape != (ARBITRARY_SAMPLES,):
+            raise ValueError(f"Arbitrary waveform must have {ARBITRARY_SAMPLES} samples")
+        codes = np.round((np.clip(samples, -1, 1) + 1) / 2 * ARBITRARY_MAX_CODE)
+        # Discard the replies to the previous commands
+        self.ser.reset_input_buffer()
+        self.ser.write(f"DDS_WAVE{slot}\n".encode())
+        self.expect("W")
+        self.ser.write(codes.astype("<u2").tobytes())
+        self.expect("HN")
+        log.debug(f"Uploaded arbitrary waveform to slot {slot}")
+
 
     def __del__(self):
         self.ser.close()
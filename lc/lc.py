@@ -32,131 +32,237 @@
 # from 0 to some finite level at resonance. For low values
 # of R, its effect is not visible above Vlim.
 #
-# 
+# The settings (the circuit values, the sweep and the AM channels
+# shown on the plot) are read from radios.toml (see config.py).
+# The results file is added to the result store (see store.py),
+# and the results are read back from there.
+# The plotting functions are also used by "radios.py plot" and
+# "radios.py model".
 #
-import matplotlib.pyplot as plt
-from matplotlib.ticker import StrMethodFormatter
+import logging
 import numpy as np
-import pandas as pd
-from frequency_response import FrequencyResponse
-from pathlib import Path
-from utils import query_yes_no
+from config import load_config
+from model import transfer
 
-# Inductor with series resistance R
-L = 30e-6
-R = 0.6
+def resonant_frequency(circuit):
+    '''
+    Return the resonant frequency (in Hz) of the LC circuit
+    '''
+    return 1/(2*np.pi*np.sqrt(circuit["L"]*circuit["C"]))
+
+def plot_response(config, data = None, fitted = None, simulated = None,
+                  tolerance = None):
+    '''
+    Plot the modelled frequency response of the circuit in config
+    (with and without R), the AM channels of interest, and (if
+    they are given) the measurements in data (a data frame, or a
+    dictionary of arrays, with the columns of the results file),
+    the response of the fitted parameters, and the simulated
+    responses of other circuits (a list of (label, f, transfer
+    function) tuples; see radios.py plot --netlist), and the bands
+    of the response of the circuit with component tolerances (a
+    ToleranceResult, see tolerance.py). Returns the figure.
+    '''
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import StrMethodFormatter
+    from plotting import DecimatedLine
 
-# Capacitor
-C = 303e-12
+    circuit, plot = config["circuit"], config["plot"]
+    L, C, R, Rs = (circuit[name] for name in ["L", "C", "R", "Rs"])
+    Vin = config["sweep"]["vin"]
+    Vlim = plot["vlim"]
+    bw_kHz = plot["bw_kHz"]
+    f_if_kHz = plot["f_if_kHz"]
 
-# Sense resistor
-Rs = 22
+    # Base frequency range (the model curves are drawn decimated,
+    # see plotting.py, so the fine grid needed to resolve the
+    # resonance does not slow down drawing)
+    fc = resonant_frequency(circuit)
+    f = np.geomspace(1e3, 1e8, 100000)
 
-# Input voltage, peak-to-peak
-Vin = 0.4
+    # Transfer function (Vout/Vin), where
+    # Vout is measured across Rs
+    Vout_with_R = transfer(f, L, C, R, Rs) * Vin
+    Vout_without_R = transfer(f, L, C, 0, Rs) * Vin
 
-# Set minimum measurement amplitude as 1mV
-Vlim = 0.5e-3
+    fig, axes = plt.subplots(2, 1, sharex = True)
+    axes[0].set_xscale("log")
+    axes[0].set_yscale("log")
 
-# AM channel bandwidth
-bw_kHz = 10
+    #axes[0].set_xlim([0.99*fc, 1.01*fc])
 
-# Particular AM channel
-fc_bbc_somerset_kHz = 1566
+    f_kHz = f/1e3
+    fc_kHz = fc/1e3
+    f_lo_kHz = fc_kHz - f_if_kHz
+    f_image_kHz = f_lo_kHz + 2*f_if_kHz
 
-# Intermediate frequency
-f_if_kHz = 455
+    #axes[0].axhline(y=Vin, color='black', linestyle='-', label = f"|Vin| = {Vin} V")
+    if data is not None:
+        axes[0].scatter(data["f"] / 1e3, data["v_in"], label = f"Measured |Vin|")
+    DecimatedLine(axes[0], f_kHz, abs(Vout_with_R), label = f"|Vout|, R = {R} Ohms")
+    if data is not None:
+        axes[0].scatter(data["f"] / 1e3, data["v_out"], label = "Measured |Vout|")
+    DecimatedLine(axes[0], f_kHz, abs(Vout_without_R), label = f"|Vout|, R = 0 Ohms")
+    if fitted is not None:
+        Vout_fitted = transfer(f, fitted["L"], fitted["C"], fitted["R"],
+                               fitted["Rs"]) * Vin
+        DecimatedLine(axes[0], f_kHz, abs(Vout_fitted), linestyle = "--",
+                      label = f"|Vout|, fitted R = {fitted['R']:.2f} Ohms")
+    for label, f_sim, h in simulated or []:
+        DecimatedLine(axes[0], f_sim / 1e3, abs(h) * Vin, linestyle = ":",
+                      label = f"|Vout|, {label}")
+    if tolerance is not None:
+        low, high = tolerance.magnitude[0.025], tolerance.magnitude[0.975]
+        axes[0].fill_between(tolerance.f / 1e3, low * Vin, high * Vin, alpha = 0.3,
+                             label = "|Vout|, 95% of component tolerances")
+    axes[0].set_ylabel("Peak-to-peak voltage / V")
+    axes[0].grid(which="both")
+    axes[0].xaxis.set_major_formatter(StrMethodFormatter("{x:.0f}"))
+    axes[0].yaxis.set_major_formatter(StrMethodFormatter("{x:.0g}"))
+    axes[0].axvspan(fc_kHz - bw_kHz/2, fc_kHz + bw_kHz/2,
+                    alpha=0.1, color="blue", label = f"Tuned AM Channel, fc={fc_kHz:.0f} kHz")
+    axes[0].axvline(x=f_if_kHz, color='black', linestyle='-',
+                    label = f"Intermediate Frequency = {f_if_kHz} kHz")
+    axes[0].axvline(x=f_lo_kHz, color='purple', linestyle='-',
+                    label = f"Local Oscillator = {f_lo_kHz:.0f} kHz")
+    axes[0].axvspan(plot["station_kHz"] - bw_kHz/2, plot["station_kHz"] + bw_kHz/2,
+                    alpha=0.1, color="green",
+                    label = f"{plot['station']}, fc = {plot['station_kHz']:.0f} kHz")
+    axes[0].fill_between(f_kHz[[0, -1]], Vlim, facecolor='red',
+                         alpha=0.1, label = "Oscilloscope Measurement Limit")
+    axes[0].axvspan(f_image_kHz - bw_kHz/2, f_image_kHz + bw_kHz/2,
+                    alpha=0.1, color="red", label = f"Image AM Channel, fc={fc_kHz:.0f} kHz")
+    axes[0].legend()
 
-# Frequency response measurement controls
-f_low = 1e3
-f_high = 6e7
-f_steps = 100
+    scale = 360/(2*np.pi)
+    DecimatedLine(axes[1], f_kHz, scale*np.angle(Vout_with_R),
+                  label = f"Phase(Vout), R = {R} Ohms")
+    DecimatedLine(axes[1], f_kHz, scale*np.angle(Vout_without_R),
+                  label = f"Phase(Vout), R = 0 Ohms")
+    if fitted is not None:
+        DecimatedLine(axes[1], f_kHz, scale*np.angle(Vout_fitted), linestyle = "--",
+                      label = "Phase(Vout), fitted")
+    for label, f_sim, h in simulated or []:
+        DecimatedLine(axes[1], f_sim / 1e3, scale*np.angle(h), linestyle = ":",
+                      label = f"Phase(Vout), {label}")
+    if tolerance is not None:
+        axes[1].fill_between(tolerance.f / 1e3, tolerance.phase[0.025],
+                             tolerance.phase[0.975], alpha = 0.3,
+                             label = "Phase(Vout), 95% of component tolerances")
+    if data is not None:
+        axes[1].scatter(data["f"] / 1e3, -data["phase"])
+    axes[1].set_xlabel("Frequency, kHz")
+    axes[1].set_ylabel("Angle / Degrees")
+    axes[1].grid(which="both")
+    axes[1].legend()
 
-# Check if measurements file exists
-savefile = Path("meas.csv")
-if savefile.is_file():
-    use_save_data = query_yes_no("Found 'meas.csv'. Do you want to use this data?")
-    if use_save_data:
-        df = pd.read_csv("meas.csv")
-    else:
-        fr = FrequencyResponse(f_low, f_high, f_steps, Vin)
-        df = fr.run(savefile = "meas.csv")
+    fig.suptitle(f"Frequency response of parallel LC circuit")
+    return fig
 
-f_meas_kHz = df["f"] / 1e3
-Vin_meas = df["v_in"]
-Vout_mag = df["v_out"]
-Vout_angle = df["phase"]
+def plot_probes(result, probes, title = ""):
+    '''
+    Plot the expressions in probes (such as "vdb(out)"; see
+    mna.ACResult.probe) of the AC analysis result of a netlist
+    against frequency. Returns the figure.
+    '''
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots()
+    for probe in probes:
+        ax.semilogx(result.f, result.probe(probe), label = probe)
+    ax.set_xlabel("Frequency, Hz")
+    ax.grid(which="both")
+    ax.legend()
+    fig.suptitle(title)
+    return fig
 
-print(f"L = {L} H, C = {C} F, Rs = {Rs} Ohms")
-fc = 1/(2*np.pi*np.sqrt(L*C))
-print(f"Resonant frequency fc = {fc} Hz")
+def plot_transient(result, probes, title = ""):
+    '''
+    Plot the expressions in probes (such as "v(4)"; see
+    transient.TransientResult.probe) of the transient analysis
+    result of a netlist against time. Returns the figure.
+    '''
+    import matplotlib.pyplot as plt
+    from plotting import DecimatedLine
+    fig, ax = plt.subplots()
+    for probe in probes:
+        DecimatedLine(ax, result.t * 1e3, result.probe(probe), label = probe)
+    ax.set_xlabel("Time, ms")
+    ax.set_ylabel("Voltage / V, or current / A")
+    ax.grid()
+    ax.legend()
+    fig.suptitle(title)
+    return fig
 
-def impedance(f, C, L, R, Rs):
+def show(fig, output = None):
     '''
-    Impedance of LC-Rs series combinatio
+    Show the figure, or save it to the file output (if given)
     '''
-    w = 2*np.pi*f
-    s = 1j*w
-    num = R + s*L
-    denom = 1 + s*R*C + s*s*L*C
-    return Rs + num / denom
-
-
-# Base frequency range
-f = np.geomspace(1e3, 1e8, 100000)
-
-# Impedance
-z_with_R = impedance(f, C, L, R, Rs)
-z_without_R = impedance(f, C, L, 0, Rs)
-
-# Transfer function (Vout/Vin), where
-# Vout is measured across Rs
-Vout_with_R = Rs/z_with_R * Vin
-Vout_without_R = Rs/z_without_R * Vin
-
-fig, axes = plt.subplots(2, 1, sharex = True)
-
-#axes[0].set_xlim([0.99*fc, 1.01*fc])
-
-f_kHz = f/1e3
-fc_kHz = fc/1e3
-f_lo_kHz = fc_kHz - f_if_kHz
-f_image_kHz = f_lo_kHz + 2*f_if_kHz
-
-#axes[0].axhline(y=Vin, color='black', linestyle='-', label = f"|Vin| = {Vin} V")
-axes[0].scatter(f_meas_kHz, Vin_meas, label = f"Measured |Vin|")
-axes[0].loglog(f_kHz, abs(Vout_with_R), label = f"|Vout|, R = {R} Ohms")
-axes[0].scatter(f_meas_kHz, Vout_mag, label = "Measured |Vout|")
-axes[0].loglog(f_kHz, abs(Vout_without_R), label = f"|Vout|, R = 0 Ohms")
-axes[0].set_ylabel("Peak-to-peak voltage / V")
-axes[0].grid(which="both")
-axes[0].xaxis.set_major_formatter(StrMethodFormatter("{x:.0f}"))
-axes[0].yaxis.set_major_formatter(StrMethodFormatter("{x:.0g}"))
-axes[0].axvspan(fc_kHz - bw_kHz/2, fc_kHz + bw_kHz/2,
-                alpha=0.1, color="blue", label = f"Tuned AM Channel, fc={fc_kHz:.0f} kHz")
-axes[0].axvline(x=f_if_kHz, color='black', linestyle='-',
-                label = f"Intermediate Frequency = {f_if_kHz} kHz")
-axes[0].axvline(x=f_lo_kHz, color='purple', linestyle='-',
-                label = f"Local Oscillator = {f_lo_kHz:.0f} kHz")
-axes[0].axvspan(fc_bbc_somerset_kHz - bw_kHz/2, fc_bbc_somerset_kHz + bw_kHz/2,
-                alpha=0.1, color="green",
-                label = f"BBC Radio Somerset, fc = {fc_bbc_somerset_kHz:.0f} kHz")
-axes[0].fill_between(f_kHz, Vlim, facecolor='red',
-                     alpha=0.1, label = "Oscilloscope Measurement Limit")
-axes[0].axvspan(f_image_kHz - bw_kHz/2, f_image_kHz + bw_kHz/2,
-                alpha=0.1, color="red", label = f"Image AM Channel, fc={fc_kHz:.0f} kHz")
-axes[0].legend()
-
-scale = 360/(2*np.pi)
-axes[1].plot(f_kHz, scale*np.angle(Vout_with_R), label = f"Phase(Vout), R = {R} Ohms")
-axes[1].plot(f_kHz, scale*np.angle(Vout_without_R), label = f"Phase(Vout), R = 0 Ohms")
-axes[1].scatter(f_meas_kHz, -Vout_angle)
-axes[1].set_xlabel("Frequency, kHz")
-axes[1].set_ylabel("Angle / Degrees")
-axes[1].grid(which="both")
-axes[1].legend()
-
-fig.suptitle(f"Frequency response of parallel LC circuit")
-
-plt.show()
-    
+    if output is not None:
+        fig.savefig(output)
+    else:
+        import matplotlib.pyplot as plt
+        plt.show()
+
+def print_fit(fitted):
+    '''
+    Print the fitted circuit parameters (a row returned by
+    fit.fit_sweep())
+    '''
+    for name in ["L", "C", "R", "Rs"]:
+        ci = fitted.get(f"{name}_ci", 0)
+        print(f"Fitted {name} = {fitted[name]:.4g} +/- {ci:.2g}")
+
+def main():
+    '''
+    Measure the frequency response (or use the measurements
+    already in the results file), fit the circuit model, and plot
+    the results. The user is asked whether to use the existing
+    results; see radios.py for the non-interactive version.
+    '''
+    from frequency_response import FrequencyResponse
+    from fit import fit_sweep
+    from plotting import LivePlot
+    from store import ResultStore
+    from utils import query_yes_no
+    from pathlib import Path
+
+    logging.basicConfig(level = logging.INFO, format = "%(message)s")
+    config = load_config()
+    circuit, sweep = config["circuit"], config["sweep"]
+
+    # Check if measurements file exists. The file may be from a sweep
+    # that is still running (or was interrupted), in which case the
+    # points measured so far are plotted, or the sweep can be resumed.
+    savefile = Path(sweep["savefile"])
+    use_save_data = False
+    if savefile.is_file():
+        use_save_data = query_yes_no(f"Found '{savefile}'. Do you want to use this data?")
+    if not use_save_data:
+        resume = savefile.is_file() and \
+            query_yes_no(f"Resume the sweep in '{savefile}'?", default = "no")
+        fr = FrequencyResponse(sweep["f_low"], sweep["f_high"], sweep["steps"],
+                               sweep["vin"], measurement = sweep["measurement"])
+        # Show the points as they are measured
+        live = LivePlot(plot_response(config))
+        fr.run(savefile = savefile, resume = resume, on_point = live.add)
+        live.finish()
+
+    # The results are added to the store (unless they are already
+    # there), and read back from it
+    store = ResultStore(sweep["store"])
+    data, metadata = store.load(store.import_csv(savefile, {"circuit": circuit}))
+    steps = metadata.get("freq_steps", len(data["f"]))
+    if len(data["f"]) < steps:
+        print(f"Plotting partial sweep ({len(data['f'])}/{steps} points)")
+
+    print(f"L = {circuit['L']} H, C = {circuit['C']} F, Rs = {circuit['Rs']} Ohms")
+    print(f"Resonant frequency fc = {resonant_frequency(circuit)} Hz")
+
+    # Fit the circuit model to the measurements (Rs is also fitted if
+    # the file contains the generator voltages)
+    fitted = fit_sweep(data, Rs = circuit["Rs"]).iloc[0]
+    print_fit(fitted)
+    show(plot_response(config, data, fitted))
+
+if __name__ == "__main__":
+    main()
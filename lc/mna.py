@@ -0,0 +1,444 @@
+# Modified nodal analysis (MNA) of netlists
+#
+# Simulates the netlists read by netlist.py without ngspice. The
+# circuit equations are assembled once, in the form
+#
+#   (G + s C) x = b
+#
+# where x contains the node voltages, followed by the currents of
+# the voltage sources, inductors and current-controlled sources.
+# Transistors are linearised about the DC operating point (found
+# by Newton's method), and their capacitances are added to C.
+#
+# For the AC analysis, all the frequencies are solved at once:
+# the equations are reduced (once) to an eigenvalue problem, after
+# which each frequency only costs a matrix-vector product, so 10^5
+# frequencies take a few tens of milliseconds. The solution is
+# checked against a direct solve at some of the frequencies, and
+# if the eigenvalue problem is badly conditioned, all the
+# frequencies are solved directly (in batches) instead.
+#
+#   circuit = Circuit(read_netlist("filters/lowpass_lc.net"))
+#   result = circuit.ac_analysis()      # frequencies of the .ac line
+#   result.probe("vdb(2)")
+#
+import logging
+import numpy as np
+from bjt import BJT, limit_junction
+from netlist import GROUND
+
+log = logging.getLogger(__name__)
+
+# Conductance added across each transistor junction, to help the
+# operating point converge (as SPICE's GMIN)
+GMIN = 1e-12
+
+# Largest number of matrix elements solved at once when the
+# frequencies are solved directly
+BATCH_ELEMENTS = 2**22
+
+def ac_frequencies(kind, points, f_start, f_stop):
+    '''
+    Return the frequencies of an AC analysis (as the arguments of
+    .ac): kind is "dec" or "oct" (points per decade or octave) or
+    "lin" (points in total)
+    '''
+    if kind == "lin":
+        return np.linspace(f_start, f_stop, points)
+    if kind not in ("dec", "oct"):
+        raise ValueError(f"Unknown AC sweep type '{kind}'")
+    ratio = 10 if kind == "dec" else 2
+    count = int(np.floor(points * np.log(f_stop / f_start) / np.log(ratio)
+                         + 1e-9)) + 1
+    return f_start * ratio ** (np.arange(count) / points)
+
+class ACResult:
+    '''
+    The result of an AC analysis: the frequencies f, and the
+    solution x (one row per frequency) of the circuit
+    '''
+    def __init__(self, circuit, f, x):
+        self.circuit = circuit
+        self.f = f
+        self.x = x
+
+    def voltage(self, node, reference = "0"):
+        '''
+        Return the complex voltage of a node (relative to the
+        reference node) at each frequency
+        '''
+        # Ground (index -1) is not in the solution
+        x = lambda name: self.x[:, self.circuit.node(name)] \
+            if self.circuit.node(name) >= 0 else 0
+        return x(node) - x(reference)
+
+    def current(self, name):
+        '''
+        Return the complex current through a voltage source or
+        inductor (flowing from its first node to its second) at
+        each frequency
+        '''
+        return self.x[:, self.circuit.branch(name)]
+
+    def probe(self, expression):
+        '''
+        Evaluate an expression of a SPICE plot command, such as
+        v(2), vdb(5), vp(4,3) or i(Vcc). The suffixes of v (and i)
+        are db (decibels), m (magnitude), p (phase, in radians, as
+        in ngspice), r and i (real and imaginary parts).
+        '''
+        function, arguments = expression.lower().rstrip(")").split("(")
+        arguments = arguments.split(",")
+        if function[0] == "i":
+            value = self.current(arguments[0])
+        else:
+            value = self.voltage(*arguments)
+        suffix = function[1:]
+        if suffix == "":
+            return value
+        if suffix == "db":
+            return 20 * np.log10(abs(value))
+        if suffix == "m":
+            return abs(value)
+        if suffix == "p":
+            return np.angle(value)
+        if suffix in ("r", "i"):
+            return value.real if suffix == "r" else value.imag
+        raise ValueError(f"Unknown function '{function}'")
+
+class Circuit:
+    '''
+    The MNA equations of a netlist (see netlist.py). The linear
+    elements are assembled when the circuit is created; the
+    transistors are linearised at the operating point the first
+    time an AC analysis is made.
+    '''
+    def __init__(self, netlist):
+        self.netlist = netlist
+        nodes = netlist.nodes()
+        self.transistors = []
+        # Transistors with series resistances have internal nodes
+        internal = []
+        for element in netlist.elements.values():
+            if element.kind == "Q":
+                if element.model not in netlist.models:
+                    raise ValueError(f"Unknown model '{element.model}' of {element.name}")
+                kind, params = netlist.models[element.model]
+                model = BJT(params, kind, element.value)
+                terminals = []
+                for node, resistance in zip(element.nodes, ["rc", "rb", "re"]):
+                    if model.p[resistance] > 0:
+                        terminals.append(f"{element.name}#{resistance[1]}")
+                        internal.append((node, terminals[-1], model.p[resistance]))
+                    else:
+                        terminals.append(node)
+                self.transistors.append((element, model, terminals))
+        self.nodes = nodes + [inner for _, inner, _ in internal]
+        self.index = {node: n for n, node in enumerate(self.nodes)}
+        self.branches = {}
+        for element in netlist.elements.values():
+            if element.kind in "VLEH" or (element.kind == "R" and element.value == 0):
+                self.branches[element.name.lower()] = len(self.nodes) + len(self.branches)
+        self.size = len(self.nodes) + len(self.branches)
+
+        # One extra row and column for the ground node, which are
+        # removed at the end
+        n = self.size + 1
+        G = np.zeros((n, n))
+        C = np.zeros((n, n))
+        self.b_dc = np.zeros(n)
+        self.b_ac = np.zeros(n, dtype = complex)
+        for node, inner, resistance in internal:
+            self.stamp(G, self.node(node), self.node(inner), 1 / resistance)
+        for element in netlist.elements.values():
+            self.add(element, G, C)
+        self.G = G[:-1, :-1]
+        self.C = C[:-1, :-1]
+        self.b_dc = self.b_dc[:-1]
+        self.b_ac = self.b_ac[:-1]
+        self.x_dc = None
+
+    def node(self, name):
+        '''
+        Return the index of a node in the solution (-1 for ground)
+        '''
+        if name.lower() in GROUND:
+            return -1
+        if name not in self.index:
+            raise ValueError(f"Unknown node '{name}'")
+        return self.index[name]
+
+    def branch(self, name):
+        '''
+        Return the index of the current of a voltage source,
+        inductor, current-controlled source or zero resistance in
+        the solution
+        '''
+        if name.lower() not in self.branches:
+            raise ValueError(f"No branch current for '{name}'")
+        return self.branches[name.lower()]
+
+    @staticmethod
+    def stamp(matrix, a, b, value):
+        '''
+        Add an admittance value between nodes a and b
+        '''
+        matrix[a, a] += value
+        matrix[b, b] += value
+        matrix[a, b] -= value
+        matrix[b, a] -= value
+
+    def add(self, element, G, C):
+        '''
+        Add the stamp of a linear element to G, C and the source
+        vectors (transistors are added separately, once the
+        operating point is known)
+        '''
+        kind = element.kind
+        a, b = (self.node(node) for node in element.nodes[:2])
+        if kind == "R" and element.value != 0:
+            self.stamp(G, a, b, 1 / element.value)
+        elif kind == "C":
+            self.stamp(C, a, b, element.value)
+        elif kind == "G":
+            cp, cn = (self.node(node) for node in element.nodes[2:])
+            G[a, cp] += element.value
+            G[a, cn] -= element.value
+            G[b, cp] -= element.value
+            G[b, cn] += element.value
+        elif kind == "F":
+            k = self.branch(element.control)
+            G[a, k] += element.value
+            G[b, k] -= element.value
+        elif kind == "I":
+            self.b_dc[a] -= element.params["dc"]
+            self.b_dc[b] += element.params["dc"]
+            ac = self.ac_value(element)
+            self.b_ac[a] -= ac
+            self.b_ac[b] += ac
+        elif kind in "VLEHR":
+            # The branch current flows from the first node, through
+            # the element, to the second node (a resistance of zero
+            # is a short circuit, like a source of 0 V)
+            k = self.branch(element.name)
+            G[a, k] += 1
+            G[b, k] -= 1
+            G[k, a] += 1
+            G[k, b] -= 1
+            if kind == "V":
+                self.b_dc[k] = element.params["dc"]
+                self.b_ac[k] = self.ac_value(element)
+            elif kind == "L":
+                C[k, k] -= element.value
+            elif kind == "E":
+                cp, cn = (self.node(node) for node in element.nodes[2:])
+                G[k, cp] -= element.value
+                G[k, cn] += element.value
+            elif kind == "H":
+                G[k, self.branch(element.control)] -= element.value
+
+    @staticmethod
+    def ac_value(element):
+        '''
+        Return the complex AC value of a source
+        '''
+        return element.params["ac"] * np.exp(1j * np.radians(element.params["ac_phase"]))
+
+    def junctions(self, x, model, terminals):
+        '''
+        Return the indices of the collector, base and emitter of a
+        transistor, and its junction voltages vbe and vbc in the
+        solution x
+        '''
+        c, b, e = (self.node(node) for node in terminals)
+        v = np.append(x, 0)
+        return (c, b, e), model.polarity * (v[b] - v[e]), model.polarity * (v[b] - v[c])
+
+    def stamp_transistor(self, G, rhs, model, nodes, vbe, vbc):
+        '''
+        Add the transistor, linearised at the junction voltages vbe
+        and vbc, to G (and, if rhs is not None, its current sources
+        to rhs)
+        '''
+        c, b, e = nodes
+        ic, ib, J, _ = model.currents(vbe, vbc)
+        # Derivatives of the currents into the collector, base and
+        # emitter with respect to the voltages of the three nodes
+        for row, (d_be, d_bc) in zip([c, b], J):
+            G[row, b] += d_be + d_bc
+            G[row, e] -= d_be
+            G[row, c] -= d_bc
+        G[e, b] -= J[0].sum() + J[1].sum()
+        G[e, e] += J[0, 0] + J[1, 0]
+        G[e, c] += J[0, 1] + J[1, 1]
+        self.stamp(G, b, e, GMIN)
+        self.stamp(G, b, c, GMIN)
+        if rhs is not None:
+            # Currents of the linearisation at vbe and vbc
+            i_c = model.polarity * (ic - J[0, 0]*vbe - J[0, 1]*vbc)
+            i_b = model.polarity * (ib - J[1, 0]*vbe - J[1, 1]*vbc)
+            rhs[c] -= i_c
+            rhs[b] -= i_b
+            rhs[e] += i_c + i_b
+
+    def newton(self, scale, x, b = None, max_iter = 100, reltol = 1e-6, vntol = 1e-6):
+        '''
+        Solve for the operating point with the DC sources (or the
+        source vector b, if given) scaled by scale, starting from x,
+        by Newton's method. Returns the solution, or None if it does
+        not converge.
+        '''
+        n = self.size
+        previous = [self.junctions(x, model, terminals)[1:]
+                    for _, model, terminals in self.transistors]
+        for iteration in range(max_iter):
+            G = np.zeros((n + 1, n + 1))
+            G[:-1, :-1] = self.G
+            rhs = np.append(scale * (self.b_dc if b is None else b), 0)
+            limited = False
+            for m, (_, model, terminals) in enumerate(self.transistors):
+                nodes, vbe, vbc = self.junctions(x, model, terminals)
+                vbe_limited = limit_junction(vbe, previous[m][0], model.p["nf"],
+                                             model.p["is"])
+                vbc_limited = limit_junction(vbc, previous[m][1], model.p["nr"],
+                                             model.p["is"])
+                limited |= vbe_limited != vbe or vbc_limited != vbc
+                previous[m] = (vbe_limited, vbc_limited)
+                self.stamp_transistor(G, rhs, model, nodes, vbe_limited, vbc_limited)
+            try:
+                x_new = np.linalg.solve(G[:-1, :-1], rhs[:-1])
+            except np.linalg.LinAlgError:
+                return None
+            converged = np.all(abs(x_new - x) <= reltol * np.maximum(abs(x_new), abs(x))
+                               + vntol)
+            x = x_new
+            if converged and not limited:
+                return x
+        return None
+
+    def operating_point(self, b = None):
+        '''
+        Return the DC operating point (the solution with the
+        capacitors open and the inductors shorted), with the DC
+        values of the sources or (for the start of a transient
+        analysis) the source vector b. If Newton's method does not
+        converge directly, the sources are ramped up from zero.
+        RuntimeError is raised if it still does not converge.
+        '''
+        if b is None and self.x_dc is not None:
+            return self.x_dc
+        x = self.newton(1, np.zeros(self.size), b)
+        if x is None:
+            log.debug("Operating point did not converge; stepping sources")
+            x = np.zeros(self.size)
+            for scale in np.linspace(0.1, 1, 10):
+                x = self.newton(scale, x, b)
+                if x is None:
+                    raise RuntimeError("Operating point did not converge")
+        if b is None:
+            self.x_dc = x
+        return x
+
+    def ac_matrices(self):
+        '''
+        Return the matrices G and C and the source vector b of the
+        small-signal equations (G + s C) x = b, with the transistors
+        linearised at the operating point
+        '''
+        G, C = self.G.copy(), self.C.copy()
+        if self.transistors:
+            x = self.operating_point()
+            n = self.size
+            G = np.pad(G, (0, 1))
+            C = np.pad(C, (0, 1))
+            for _, model, terminals in self.transistors:
+                nodes, vbe, vbc = self.junctions(x, model, terminals)
+                self.stamp_transistor(G, None, model, nodes, vbe, vbc)
+                c, b, e = nodes
+                cbe, cbc, cbe_bc = model.capacitances(vbe, vbc)
+                self.stamp(C, b, e, cbe)
+                self.stamp(C, b, c, cbc)
+                # The base-emitter charge also depends on vbc
+                C[b, b] += cbe_bc
+                C[b, c] -= cbe_bc
+                C[e, b] -= cbe_bc
+                C[e, c] += cbe_bc
+            G, C = G[:n, :n], C[:n, :n]
+        return G, C, self.b_ac
+
+    def ac(self, f):
+        '''
+        Solve the small-signal equations at the frequencies f, and
+        return an ACResult
+        '''
+        f = np.atleast_1d(np.asarray(f, dtype = float))
+        G, C, b = self.ac_matrices()
+        return ACResult(self, f, solve_frequencies(G, C, b, 2j*np.pi*f))
+
+    def ac_analysis(self):
+        '''
+        Make the AC analysis of the netlist (its first .ac line, or
+        ac command), and return an ACResult
+        '''
+        for analysis in self.netlist.analyses:
+            if analysis[0] == "ac":
+                return self.ac(ac_frequencies(*analysis[1:]))
+        raise ValueError("The netlist has no AC analysis")
+
+def solve_directly(G, C, b, s):
+    '''
+    Solve (G + s C) x = b at each complex frequency s, in batches
+    '''
+    n = len(b)
+    x = np.empty((len(s), n), dtype = complex)
+    batch = max(BATCH_ELEMENTS // (n * n), 1)
+    for start in range(0, len(s), batch):
+        s_batch = s[start:start + batch, None, None]
+        A = G + s_batch * C
+        x[start:start + batch] = np.linalg.solve(
+            A, np.broadcast_to(b, (len(A), n))[..., None])[..., 0]
+    return x
+
+def solve_frequencies(G, C, b, s, tolerance = 1e-6):
+    '''
+    Solve (G + s C) x = b at each complex frequency s, and return
+    the solutions (one row per frequency).
+
+    With K = G + s0 C for a real s0 in the range of the
+    frequencies, G + s C = K (I + (s - s0) M), where M = K^-1 C.
+    If M = V diag(l) V^-1, then
+
+        x = V diag(1 / (1 + (s - s0) l)) V^-1 K^-1 b
+
+    so after finding the eigenvalues of M once, the solution at
+    each frequency is a matrix-vector product. The result is
+    checked against direct solutions at some of the frequencies
+    (including those nearest the poles), and if the relative error
+    is larger than tolerance, all the frequencies are solved
+    directly.
+    '''
+    s = np.asarray(s)
+    if len(s) < 16:
+        return solve_directly(G, C, b, s)
+    magnitudes = abs(s[s != 0])
+    s0 = np.sqrt(magnitudes.min() * magnitudes.max()) if len(magnitudes) else 1.0
+    try:
+        K = G + s0 * C
+        M = np.linalg.solve(K, C)
+        l, V = np.linalg.eig(M)
+        c = np.linalg.solve(V, np.linalg.solve(K, b))
+    except np.linalg.LinAlgError:
+        return solve_directly(G, C, b, s)
+    denominator = 1 + (s[:, None] - s0) * l
+    x = (c / denominator) @ V.T
+    # Check the frequencies nearest the poles, and the ends
+    check = np.unique(np.concatenate([
+        np.argsort(abs(denominator).min(axis = 1))[:4],
+        np.linspace(0, len(s) - 1, 4).astype(int)]))
+    exact = solve_directly(G, C, b, s[check])
+    error = np.linalg.norm(x[check] - exact, axis = 1) \
+        / np.maximum(np.linalg.norm(exact, axis = 1), 1e-300)
+    if not np.all(error <= tolerance):
+        log.debug(f"Eigenvalue solution error {error.max():.2g}; solving directly")
+        return solve_directly(G, C, b, s)
+    return x
@@ -0,0 +1,40 @@
+# Model of the parallel LC circuit in series with a sense resistor
+#
+# See lc.py for a diagram of the circuit. The circuit is described
+# by the netlist lc.net, and simulated with mna.py, so the same
+# model can be checked with ngspice. The functions here have no
+# side effects, so they can be imported by the measurement,
+# simulation and analysis code without running the lc.py script.
+#
+from functools import lru_cache
+from pathlib import Path
+from mna import Circuit
+from netlist import read_netlist
+
+# Netlist of the circuit
+NETLIST = Path(__file__).parent / "lc.net"
+
+@lru_cache(maxsize = 16)
+def lc_circuit(L, C, R, Rs, Rg = 50):
+    '''
+    Return the Circuit (see mna.py) of the LC circuit with the given
+    component values and generator source resistance Rg
+    '''
+    return Circuit(read_netlist(NETLIST, L = L, C = C, R = R, Rs = Rs, Rg = Rg))
+
+def voltages(f, L, C, R, Rs, Rg = 50):
+    '''
+    Return the complex voltages across the LC-Rs combination and
+    across Rs at the frequencies f, for a generator with an
+    open-circuit voltage of 1 V and source resistance Rg
+    '''
+    result = lc_circuit(L, C, R, Rs, Rg).ac(f)
+    return result.voltage("in"), result.voltage("out")
+
+def transfer(f, L, C, R, Rs):
+    '''
+    Return the transfer function (the voltage across Rs divided by
+    the voltage across the LC-Rs combination) at the frequencies f
+    '''
+    v_in, v_out = voltages(f, L, C, R, Rs)
+    return v_out / v_in
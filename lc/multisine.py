@@ -0,0 +1,235 @@
+# Broadband frequency sweeps using multisine excitation
+#
+# Instead of stepping a sine wave through the frequencies one at a
+# time, the generator plays a multisine: a sum of tones at
+# harmonics of a base frequency f0, covering up to a decade of
+# frequencies, with phases chosen to keep the crest factor low
+# (see dsp.multisine()). The multisine is uploaded to an arbitrary
+# waveform slot of the FY6600, and repeats at f0. The oscilloscope
+# timebase is set so that the screen shows exactly one period, so
+# that every tone falls on a bin of the FFT of the screen waveform,
+# and one acquisition of both channels measures the response at
+# all the tones of the decade at once (see dsp.multitone_phasors()).
+#
+#   fr = FrequencyResponse(1e3, 6e7, 100, 0.4, measurement = "waveform")
+#   df = MultisineSweep(fr).run()
+#
+# The results have the same columns as FrequencyResponse.run(),
+# so they can be plotted and fitted in the same way. The tone
+# frequencies are the harmonics of f0 nearest to the frequencies of
+# the FrequencyResponse. Frequencies above max_frequency (where the
+# oscilloscope samples too slowly to resolve a decade of tones on
+# one screen) are measured with a sine wave, as by
+# FrequencyResponse.
+#
+import logging
+from time import sleep
+import numpy as np
+from ds1054z import HORIZONTAL_DIVS
+from dsp import multisine, multitone_phasors
+from frequency_response import SCALE_STEP
+from fy6600 import ARBITRARY_SAMPLES, ARBITRARY_WAVEFORM, SINE_WAVEFORM
+from results import ResultsWriter, read_results
+from settling import Z_95
+
+log = logging.getLogger(__name__)
+
+# Range of harmonics of f0 used for the tones. The lowest harmonic
+# is chosen so that neighbouring frequencies of the sweep fall on
+# different harmonics, and the highest is limited by the number of
+# points on the screen (1200, so at least four points per period).
+MIN_HARMONIC = 4
+MAX_HARMONIC = 300
+
+class MultisineSweep:
+    '''
+    Run the frequency sweep of a FrequencyResponse object using
+    multisine excitation. Each group of frequencies (up to a decade,
+    while it fits between MIN_HARMONIC and MAX_HARMONIC) is measured
+    with one multisine, uploaded to the arbitrary waveform memory
+    slot of the generator. The generator is levelled so that the
+    peak of the input waveform is the input amplitude of the
+    FrequencyResponse, and the response at each tone is averaged
+    over acquisitions acquisitions, which gives the confidence
+    intervals. Frequencies above max_frequency are measured with a
+    sine wave, using FrequencyResponse.measure_frequency().
+    '''
+    def __init__(self, fr, acquisitions = 4, max_frequency = 1e6, slot = 1):
+        self.fr = fr
+        self.acquisitions = acquisitions
+        self.max_frequency = max_frequency
+        self.slot = slot
+
+    def groups(self, freq):
+        '''
+        Split the (sorted) frequencies into groups, each of which
+        is measured with one multisine
+        '''
+        ratio = min(freq[1:] / freq[:-1], default = 2)
+        min_harmonic = max(MIN_HARMONIC, int(np.ceil(1 / (ratio - 1))))
+        span = min(10, MAX_HARMONIC / min_harmonic / 2)
+        groups = []
+        while len(freq) > 0:
+            n = np.searchsorted(freq, freq[0] * span, side = "right")
+            groups.append(freq[:n])
+            freq = freq[n:]
+        return groups, min_harmonic
+
+    def set_multisine(self, freq, min_harmonic):
+        '''
+        Set the oscilloscope timebase for a group of frequencies,
+        and upload and play a multisine with tones at the harmonics
+        of the screen period nearest to them. Returns the harmonics
+        and their complex peak-to-peak amplitudes in the multisine,
+        relative to the peak-to-peak amplitude of the generator.
+        '''
+        fr = self.fr
+        fr.osc.set_timebase(min_harmonic / (HORIZONTAL_DIVS * freq[0]))
+        # The timebase is rounded by the oscilloscope
+        f0 = 1 / (HORIZONTAL_DIVS * fr.osc.timebase())
+        harmonics = np.unique(np.clip(np.round(freq / f0).astype(int),
+                                      1, MAX_HARMONIC))
+        x = multisine(harmonics, ARBITRARY_SAMPLES)
+        fr.gen.upload_waveform(x, self.slot)
+        fr.gen.set_waveform(ARBITRARY_WAVEFORM + self.slot - 1)
+        fr.gen.set_frequency(f0)
+        self.f0 = f0
+        return harmonics, multitone_phasors(x, harmonics) / 2
+
+    def acquire(self, max_adjustments = 5):
+        '''
+        Make one acquisition of the input and output waveforms,
+        adjusting the vertical scales (as in
+        FrequencyResponse.waveform_measurement()) until neither is
+        clipped and each occupies at least two divisions. Returns
+        the voltages of the input and output waveforms.
+        '''
+        fr = self.fr
+        channels = [fr.input_channel, fr.output_channel]
+        for n in range(max_adjustments):
+            with fr.osc.batch():
+                waveforms = fr.osc.acquire(channels)
+                adjusted = False
+                for channel in channels:
+                    volts_per_div = fr.osc.vertical_scale(channel)
+                    if waveforms[channel] is None:
+                        log.debug(f"Performing vertical adjustment {n}")
+                        fr.osc.set_vertical_scale(channel, SCALE_STEP * volts_per_div)
+                    elif np.ptp(waveforms[channel][1]) < 2 * volts_per_div:
+                        # Place the signal across the middle four divisions
+                        fr.update_vertical_scale(channel,
+                                                 np.ptp(waveforms[channel][1]) / 4)
+                    else:
+                        continue
+                    if fr.osc.vertical_scale(channel) != volts_per_div:
+                        adjusted = True
+            if not adjusted:
+                return waveforms[fr.input_channel][1], waveforms[fr.output_channel][1]
+        raise RuntimeError("Reached maximum vertical adjustments")
+
+    def level(self, tolerance = 0.05, max_iter = 10):
+        '''
+        Adjust the generator amplitude until the peak of the input
+        waveform is within tolerance (relative) of the input
+        amplitude of the FrequencyResponse, and return the generator
+        amplitude
+        '''
+        fr = self.fr
+        target = fr.target_input_amplitude
+        v_gen = round(min(2 * target, fr.gen_max_voltage), 2)
+        for n in range(max_iter):
+            fr.gen.set_amplitude(v_gen)
+            sleep(fr.settle_time)
+            peak = abs(self.acquire()[0]).max()
+            log.debug(f"n={n}, v_gen={v_gen}: peak={peak}")
+            if abs(peak - target) < tolerance * target:
+                return v_gen
+            v_next = round(min(max(v_gen * target / peak, fr.gen_min_voltage),
+                               fr.gen_max_voltage), 2)
+            if v_next == v_gen:
+                return v_gen
+            v_gen = v_next
+        raise RuntimeError(f"Multisine levelling did not converge within {max_iter} iterations")
+
+    def measure_group(self, freq, min_harmonic):
+        '''
+        Measure the response at the tones of the multisine for a
+        group of frequencies. Returns a list of dictionaries of
+        results (with the same keys as FrequencyResponse.run()),
+        one for each tone.
+        '''
+        fr = self.fr
+        with fr.point(freq[0]):
+            with fr.step("upload"):
+                harmonics, tones = self.set_multisine(freq, min_harmonic)
+            with fr.step("level"):
+                v_gen = self.level()
+            with fr.step("waveform"):
+                acquisitions = [self.acquire() for n in range(self.acquisitions)]
+        # The screen shows exactly one period of the multisine
+        v_in, v_out = multitone_phasors(np.array(acquisitions), harmonics) \
+            .transpose(1, 0, 2)
+        h = v_out / v_in
+        # Phases relative to the mean response, so that they are
+        # averaged without wrapping
+        mean_h = h.mean(axis = 0)
+        phase = -np.degrees(np.angle(mean_h) + np.angle(h / mean_h))
+        ci = lambda x: Z_95 * x.std(axis = 0, ddof = 1) / np.sqrt(len(x)) \
+            if len(x) > 1 else np.full(x.shape[1], np.nan)
+        columns = {
+            "f": harmonics * self.f0,
+            "v_gen": abs(tones) * v_gen,
+            "v_in": abs(v_in).mean(axis = 0) / 2,
+            "v_out": abs(v_out).mean(axis = 0) / 2,
+            "phase": phase.mean(axis = 0),
+            "v_in_ci": ci(abs(v_in) / 2),
+            "v_out_ci": ci(abs(v_out) / 2),
+            "phase_ci": ci(phase),
+        }
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    def metadata(self):
+        '''
+        Return the metadata of the sweep (see
+        FrequencyResponse.metadata())
+        '''
+        return {**self.fr.metadata(), "excitation": "multisine",
+                "acquisitions": self.acquisitions,
+                "max_frequency": self.max_frequency}
+
+    def run(self, savefile = "meas.csv", on_point = None):
+        '''
+        Run the frequency sweep and return (and save) the frequency
+        response data as a dataframe, in the same format as
+        FrequencyResponse.run(). Each row is written to the file as
+        soon as it has been measured, and passed to on_point (if
+        it is given).
+        '''
+        fr = self.fr
+        freq = np.sort(fr.freq)
+        broadband = freq[freq <= self.max_frequency]
+        with ResultsWriter(savefile, self.metadata()) as writer:
+            def write(row):
+                writer.write(row)
+                if on_point is not None:
+                    on_point(row)
+
+            if len(broadband) > 0:
+                groups, min_harmonic = self.groups(broadband)
+                try:
+                    for n, group in enumerate(groups):
+                        log.info(f"Measuring {len(group)} frequencies from "
+                                 f"{group[0]} Hz to {group[-1]} Hz "
+                                 f"(group {n}/{len(groups)})")
+                        for row in self.measure_group(group, min_harmonic):
+                            write(row)
+                finally:
+                    fr.gen.set_waveform(SINE_WAVEFORM)
+                    # Leave the generator as the sine sweep expects
+                    if fr.v_gen is not None:
+                        fr.gen.set_amplitude(fr.v_gen)
+
+            for f in freq[freq > self.max_frequency]:
+                log.info(f"Measuring frequency {f} Hz (sine)")
+                write({"f": f, **fr.measure_frequency(f)})
+        return read_results(savefile)[0]
@@ -0,0 +1,311 @@
+# Reading SPICE netlists
+#
+# Reads the subset of the SPICE netlist format used by the
+# netlists in this repository (filters/, colpitts/), so that they
+# can be simulated by mna.py without ngspice:
+#
+# * the title line, comments (* at the start of a line, or ; and $
+#   after a statement), and continuation lines (starting with +)
+# * R, L, C, V and I elements, the controlled sources E, F, G and H,
+#   and Q (bipolar transistors, with a .model card)
+# * values with SPICE suffixes (10u, 4.7k, 1meg), or expressions in
+#   braces using the parameters of .param lines ({2*L})
+# * .model, .param, .include (relative to the netlist file), .ac,
+#   and the ac, tran, plot and print commands of a .control block
+#
+#   netlist = read_netlist("filters/lowpass_lc.net")
+#   netlist.elements["L1"].value       # 1e-05
+#   netlist.analyses                   # [("ac", "dec", 100, 1e6, 1e7)]
+#
+import math
+import re
+from pathlib import Path
+
+# Powers of ten of the SPICE value suffixes (longest first, so that
+# "meg" is not read as "m", which is milli, as in SPICE)
+SUFFIXES = [("meg", 6), ("f", -15), ("p", -12), ("n", -9), ("u", -6),
+            ("m", -3), ("k", 3), ("g", 9), ("t", 12)]
+
+# Number of nodes of each kind of element (Q may have an optional
+# substrate node, which is ignored)
+NODE_COUNTS = {"R": 2, "L": 2, "C": 2, "V": 2, "I": 2, "E": 4, "G": 4,
+               "F": 2, "H": 2, "Q": 3}
+
+# Names of the ground node
+GROUND = ("0", "gnd")
+
+# Functions that can be used in {} expressions
+FUNCTIONS = {name: getattr(math, name) for name in
+             ["sqrt", "exp", "log", "log10", "sin", "cos", "tan", "pi"]}
+
+def parse_value(text, params = None):
+    '''
+    Return the value of a number with an optional SPICE suffix
+    (such as 10u or 1.5meg; any letters after the suffix, such as
+    units, are ignored), or of an expression in braces using the
+    parameters in params. ValueError is raised if it is not a
+    valid value.
+    '''
+    if text.startswith("{") and text.endswith("}"):
+        names = {**FUNCTIONS, **(params or {})}
+        try:
+            return float(eval(text[1:-1], {"__builtins__": {}}, names))
+        except Exception as e:
+            raise ValueError(f"Invalid expression '{text}': {e}") from e
+    match = re.fullmatch(r"([-+]?(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?)([a-z]*)",
+                         text.lower())
+    if match is None:
+        if params is not None and text in params:
+            return float(params[text])
+        raise ValueError(f"Invalid value '{text}'")
+    number, suffix = match.groups()
+    if suffix.startswith("mil"):
+        return float(number) * 25.4e-6
+    for name, exponent in SUFFIXES:
+        if suffix.startswith(name):
+            # Dividing keeps values such as 10u exact (1e-05)
+            return float(number) * 10**exponent if exponent > 0 \
+                else float(number) / 10**-exponent
+    return float(number)
+
+def split_cards(text):
+    '''
+    Split the text of a netlist into cards, joining continuation
+    lines and removing comments. Each card is a list of tokens and
+    the text of the card. Parentheses, commas and = separate
+    tokens, except inside braces.
+    '''
+    cards = []
+    for line in text.splitlines():
+        if line.lstrip().startswith("*"):
+            continue
+        line = re.split(r"[;$]", line, maxsplit = 1)[0].strip()
+        if line.startswith("+") and cards:
+            line = line[1:]
+            cards[-1][0].extend(re.findall(r"\{[^}]*\}|[^\s(),=]+", line))
+            cards[-1][1] += " " + line
+        elif line:
+            cards.append([re.findall(r"\{[^}]*\}|[^\s(),=]+", line), line])
+    return cards
+
+class Element:
+    '''
+    An element of a netlist: its name (whose first letter is the
+    kind of element), nodes, value (None if it has none), and
+    other parameters. For V and I sources, params contains the
+    DC value ("dc"), and the AC magnitude and phase in degrees
+    ("ac", "ac_phase"), and any transient function is in tran
+    (the name and list of arguments, such as ("sin", [0, 1, 1e6])).
+    For F and H, control is the name of the controlling voltage
+    source, and for Q, model is the name of the model.
+    '''
+    def __init__(self, name, nodes, value = None, params = None,
+                 control = None, model = None, tran = None):
+        self.name = name
+        self.kind = name[0].upper()
+        self.nodes = nodes
+        self.value = value
+        self.params = params or {}
+        self.control = control
+        self.model = model
+        self.tran = tran
+
+    def __repr__(self):
+        return f"Element({self.name}, {self.nodes}, {self.value})"
+
+class Netlist:
+    '''
+    A parsed netlist: the title, the elements (a dictionary, by
+    name, in the order of the netlist), the models (a dictionary
+    mapping the lower-case name of each model to its type, such as
+    "npn", and a dictionary of its parameters, with lower-case
+    names), the parameters, the analyses (tuples such as
+    ("ac", "dec", 100, 1e6, 1e7) or ("tran", step, stop)) and the
+    expressions to plot or print (such as "vdb(2)").
+    '''
+    def __init__(self, title = ""):
+        self.title = title
+        self.elements = {}
+        self.models = {}
+        self.params = {}
+        self.analyses = []
+        self.probes = []
+
+    def nodes(self):
+        '''
+        Return the names of the nodes (other than ground), in order
+        of first appearance
+        '''
+        nodes = {}
+        for element in self.elements.values():
+            for node in element.nodes:
+                if node.lower() not in GROUND:
+                    nodes.setdefault(node, None)
+        return list(nodes)
+
+def read_netlist(path, **params):
+    '''
+    Read a netlist file, and return a Netlist. Keyword arguments
+    set parameters (overriding the values of .param lines), which
+    can be used in {} expressions.
+    '''
+    path = Path(path)
+    lines = path.read_text().splitlines()
+    netlist = Netlist(lines[0].strip() if lines else "")
+    parse_cards(netlist, split_cards("\n".join(lines[1:])), path.parent, params)
+    return netlist
+
+def parse_netlist(text, directory = ".", **params):
+    '''
+    Parse the text of a netlist (starting with the title line),
+    and return a Netlist. Files are included relative to
+    directory.
+    '''
+    lines = text.splitlines()
+    netlist = Netlist(lines[0].strip() if lines else "")
+    parse_cards(netlist, split_cards("\n".join(lines[1:])), Path(directory), params)
+    return netlist
+
+def parse_cards(netlist, cards, directory, overrides):
+    '''
+    Add the elements, models, parameters and analyses in the
+    cards (lines of tokens) to netlist
+    '''
+    control = False
+    for tokens, text in cards:
+        keyword = tokens[0].lower()
+        if control:
+            if keyword == ".endc":
+                control = False
+            elif keyword in ("ac", "tran"):
+                netlist.analyses.append(parse_analysis(tokens, netlist.params))
+            elif keyword in ("plot", "print"):
+                netlist.probes.extend(parse_probes(text))
+        elif keyword == ".control":
+            control = True
+        elif keyword == ".end":
+            break
+        elif keyword == ".include":
+            path = directory / tokens[1].strip("'\"")
+            parse_cards(netlist, split_cards(path.read_text()), path.parent,
+                        overrides)
+        elif keyword == ".model":
+            netlist.models[tokens[1].lower()] = parse_model(tokens, netlist.params)
+        elif keyword == ".param":
+            for name, value in zip(tokens[1::2], tokens[2::2]):
+                netlist.params[name] = overrides[name] if name in overrides \
+                    else parse_value(value, netlist.params)
+        elif keyword in (".ac", ".tran"):
+            netlist.analyses.append(parse_analysis(tokens, netlist.params))
+        elif keyword in (".print", ".plot"):
+            netlist.probes.extend(parse_probes(text))
+        elif keyword.startswith("."):
+            # Other dot commands (such as .options) are ignored
+            continue
+        else:
+            element = parse_element(tokens, {**netlist.params, **overrides})
+            netlist.elements[element.name] = element
+    # Parameters that are not in .param lines can also be set
+    for name, value in overrides.items():
+        netlist.params.setdefault(name, value)
+
+def parse_model(tokens, params):
+    '''
+    Parse a .model card, and return the model type and a
+    dictionary of its parameters
+    '''
+    kind = tokens[2].lower()
+    values = {name.lower(): parse_value(value, params)
+              for name, value in zip(tokens[3::2], tokens[4::2])}
+    return kind, values
+
+def parse_analysis(tokens, params):
+    '''
+    Parse an .ac or .tran card (or an ac or tran control command),
+    and return a tuple such as ("ac", "dec", 100, 1e6, 1e7) or
+    ("tran", step, stop)
+    '''
+    kind = tokens[0].lower().lstrip(".")
+    if kind == "ac":
+        return ("ac", tokens[1].lower(), int(parse_value(tokens[2], params)),
+                parse_value(tokens[3], params), parse_value(tokens[4], params))
+    return ("tran", *(parse_value(token, params) for token in tokens[1:3]))
+
+def parse_probes(text):
+    '''
+    Return the list of expressions (such as "vdb(2)" or "v(4,3)")
+    in the text of a plot or print command
+    '''
+    probes = []
+    for function, nodes in re.findall(r"\b([vi][a-z]*)\(([^)]*)\)", text,
+                                      flags = re.IGNORECASE):
+        nodes = ",".join(re.split(r"[\s,]+", nodes.strip()))
+        probes.append(f"{function.lower()}({nodes})")
+    return probes
+
+def parse_source(tokens, params):
+    '''
+    Parse the arguments of a V or I source (after the nodes), and
+    return the dictionary of DC and AC values and the transient
+    function (or None)
+    '''
+    values = {"dc": 0.0, "ac": 0.0, "ac_phase": 0.0}
+    tran = None
+    n = 0
+    while n < len(tokens):
+        keyword = tokens[n].lower()
+        if keyword == "dc":
+            values["dc"] = parse_value(tokens[n + 1], params)
+            n += 2
+        elif keyword == "ac":
+            values["ac"] = parse_value(tokens[n + 1], params)
+            n += 2
+            if n < len(tokens) and tokens[n].lower() not in ("dc", "ac") \
+                    and not tokens[n].isalpha():
+                values["ac_phase"] = parse_value(tokens[n], params)
+                n += 1
+        elif keyword in ("sin", "pulse", "pwl", "exp"):
+            arguments = []
+            n += 1
+            while n < len(tokens) and tokens[n].lower() not in ("dc", "ac"):
+                arguments.append(parse_value(tokens[n], params))
+                n += 1
+            tran = (keyword, arguments)
+        else:
+            values["dc"] = parse_value(tokens[n], params)
+            n += 1
+    return values, tran
+
+def parse_element(tokens, params):
+    '''
+    Parse an element card, and return an Element
+    '''
+    name = tokens[0]
+    kind = name[0].upper()
+    if kind not in NODE_COUNTS:
+        raise ValueError(f"Unsupported element '{name}'")
+    count = NODE_COUNTS[kind]
+    if len(tokens) < count + 1:
+        raise ValueError(f"Element '{name}' needs {count} nodes")
+    nodes = tokens[1:count + 1]
+    rest = tokens[count + 1:]
+    if kind in "VI":
+        values, tran = parse_source(rest, params)
+        return Element(name, nodes, values["dc"], values, tran = tran)
+    if kind in "FH":
+        return Element(name, nodes, parse_value(rest[1], params),
+                       control = rest[0])
+    if kind == "Q":
+        # The model name may follow an optional substrate node, and
+        # be followed by the area
+        values = []
+        for token in rest:
+            try:
+                values.append(parse_value(token, params))
+            except ValueError:
+                values.append(None)
+        if len(rest) > 1 and values[1] is None:
+            rest, values = rest[1:], values[1:]
+        area = values[1] if len(values) > 1 and values[1] is not None else 1.0
+        return Element(name, nodes, area, model = rest[0].lower())
+    return Element(name, nodes, parse_value(rest[0], params))
@@ -0,0 +1,173 @@
+# Fast plotting of long traces and of sweeps in progress
+#
+# Model curves are computed at many more frequencies than there
+# are pixels across the plot, which makes drawing (and so panning
+# and zooming) slow. DecimatedLine draws only the minimum and
+# maximum (and the first and last points) of the curve in each
+# pixel column, which looks the same as drawing every point, and
+# recomputes them whenever the axis limits or the size of the
+# figure change, so zooming in shows the full detail:
+#
+#   fig, ax = plt.subplots()
+#   ax.set_xscale("log")
+#   DecimatedLine(ax, f, abs(h), label = "|H|")
+#
+# LivePlot adds the measured points of a sweep to a figure made by
+# lc.plot_response() as they are measured (pass its add method as
+# the on_point argument of FrequencyResponse.run(), or any of the
+# other sweeps). The new points are drawn over a saved copy of the
+# rest of the figure (blitting), so the time taken does not grow
+# with the number of points already measured:
+#
+#   live = LivePlot(plot_response(config))
+#   fr.run(savefile, on_point = live.add)
+#   live.finish()
+#
+from time import monotonic
+import numpy as np
+
+def decimate(x, y, x_low, x_high, buckets):
+    '''
+    Return the indices of the points of the curve (x, y) (with x
+    increasing) to draw for the range x_low to x_high divided into
+    buckets columns: the first, last, lowest and highest point in
+    each column, and the points either side of the range (so that
+    the line continues to the edges). All the indices in the range
+    are returned if there are only a few points per column.
+    '''
+    start = max(np.searchsorted(x, x_low) - 1, 0)
+    stop = min(np.searchsorted(x, x_high, side = "right") + 1, len(x))
+    if stop - start <= 4 * buckets or x_high <= x_low:
+        return np.arange(start, stop)
+    column = np.floor((x[start:stop] - x_low) / (x_high - x_low) * buckets)
+    column = np.clip(column, -1, buckets).astype(int)
+    # Sort the points by column, and then by y, so that the lowest
+    # and highest points of each column are the first and last
+    # of its group
+    order = np.lexsort((y[start:stop], column))
+    first = np.flatnonzero(np.diff(column, prepend = -2))
+    last = np.r_[first[1:] - 1, stop - start - 1]
+    grouped = np.flatnonzero(np.diff(column[order], prepend = -2))
+    lowest = order[grouped]
+    highest = order[np.r_[grouped[1:] - 1, stop - start - 1]]
+    return start + np.unique(np.concatenate([first, last, lowest, highest]))
+
+class DecimatedLine:
+    '''
+    A line on the axes ax through the points (x, y), with x
+    increasing, drawn decimated (see decimate()) for the current
+    limits and size of the axes. The keyword arguments are passed
+    to ax.plot(). The curve is decimated in the coordinates of the
+    x axis scale (so it works for log and linear axes); set the
+    scale before making the line.
+    '''
+    def __init__(self, ax, x, y, **kwargs):
+        self.ax = ax
+        self.x = np.asarray(x, dtype = float)
+        self.y = np.asarray(y, dtype = float)
+        self.scaled = ax.xaxis.get_transform().transform(self.x)
+        indices = self.indices(self.scaled[0], self.scaled[-1])
+        self.line, = ax.plot(self.x[indices], self.y[indices], **kwargs)
+        ax.callbacks.connect("xlim_changed", lambda ax: self.update())
+        ax.figure.canvas.mpl_connect("resize_event", lambda event: self.update())
+
+    def indices(self, low, high):
+        '''
+        Return the indices of the points to draw between the
+        (scaled) x limits low and high, with one column per pixel
+        '''
+        buckets = max(int(self.ax.bbox.width), 1)
+        return decimate(self.scaled, self.y, low, high, buckets)
+
+    def update(self):
+        '''
+        Decimate the curve again for the current x limits
+        '''
+        low, high = self.ax.xaxis.get_transform().transform(sorted(self.ax.get_xlim()))
+        indices = self.indices(low, high)
+        self.line.set_data(self.x[indices], self.y[indices])
+
+class LivePlot:
+    '''
+    Add the measured points of a sweep to a figure made by
+    lc.plot_response() (without data) as they are measured, and
+    show the figure (without blocking). Redrawing is limited to
+    once every interval seconds. The figure is not put in
+    matplotlib's interactive mode, which would redraw all of it
+    for every point.
+    '''
+    def __init__(self, fig, interval = 0.1):
+        import matplotlib.pyplot as plt
+        self.fig = fig
+        self.interval = interval
+        axes = fig.axes[:2]
+        # Points that have been drawn (which are redrawn when the
+        # whole figure is), and the points since the last update
+        # (which are only drawn by blitting)
+        self.history = [axes[0].plot([], [], "o", label = "Measured |Vin|")[0],
+                        axes[0].plot([], [], "o", label = "Measured |Vout|")[0],
+                        axes[1].plot([], [], "o", label = "Measured phase")[0]]
+        self.new = [ax.plot([], [], "o", color = line.get_color(), animated = True)[0]
+                    for ax, line in zip([axes[0], axes[0], axes[1]], self.history)]
+        for ax in axes:
+            ax.legend()
+        self.points = [[], [], []]
+        self.pending = []
+        self.background = None
+        self.last_update = -np.inf
+        fig.canvas.mpl_connect("draw_event", lambda event: self.save_background())
+        plt.show(block = False)
+        fig.canvas.draw()
+        fig.canvas.flush_events()
+
+    def save_background(self):
+        '''
+        Save the figure (after it has been drawn in full) for
+        blitting
+        '''
+        canvas = self.fig.canvas
+        if getattr(canvas, "supports_blit", False):
+            self.background = canvas.copy_from_bbox(self.fig.bbox)
+
+    def add(self, row):
+        '''
+        Add a measured point (a row of results, as passed to the
+        on_point argument of the sweeps), redrawing if interval
+        seconds have passed since the last update
+        '''
+        self.pending.append(row)
+        if monotonic() - self.last_update >= self.interval:
+            self.update()
+
+    def update(self):
+        '''
+        Draw the points added since the last update
+        '''
+        rows, self.pending = self.pending, []
+        self.last_update = monotonic()
+        new = [[(row["f"] / 1e3, row[name]) for row in rows]
+               for name in ["v_in", "v_out"]]
+        new.append([(row["f"] / 1e3, -row["phase"]) for row in rows])
+        for history, artist, points, added in zip(self.history, self.new,
+                                                  self.points, new):
+            points.extend(added)
+            history.set_data(*np.reshape(points, (-1, 2)).T)
+            artist.set_data(*np.reshape(added, (-1, 2)).T)
+
+        canvas = self.fig.canvas
+        if self.background is not None:
+            canvas.restore_region(self.background)
+            for artist in self.new:
+                artist.axes.draw_artist(artist)
+            canvas.blit(self.fig.bbox)
+            self.background = canvas.copy_from_bbox(self.fig.bbox)
+        else:
+            canvas.draw_idle()
+        canvas.flush_events()
+
+    def finish(self):
+        '''
+        Draw any remaining points, and redraw the whole figure
+        '''
+        self.update()
+        self.fig.canvas.draw_idle()
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+# Command line interface for measuring, plotting and fitting the
+# frequency response of the LC circuit
+#
+#   python3 radios.py measure            # run the sweep
+#   python3 radios.py measure --resume   # carry on an interrupted sweep
+#   python3 radios.py measure --live     # plot the points as they are measured
+#   python3 radios.py server start       # keep the instruments open (see server.py)
+#   python3 radios.py measure --server   # run the sweep on the bench server
+#   python3 radios.py plot meas.csv      # plot the results
+#   python3 radios.py fit meas*.csv      # fit the circuit model
+#   python3 radios.py store import meas*.csv   # add results to the store
+#   python3 radios.py plot results.store --sweep 3   # plot a stored sweep
+#   python3 radios.py model              # plot the circuit model only
+#   python3 radios.py capture 2 -o osc.npy   # save a deep-memory capture
+#   python3 radios.py tolerance --tol C=0.1  # Monte Carlo component tolerances
+#   python3 radios.py model --netlist ../colpitts/colpitts.net
+#                                        # plot the AC analysis of a netlist
+#   python3 radios.py transient ../colpitts/colpitts.net --stop 4m --node 4
+#                                        # simulate the oscillator's start-up
+#
+# None of the commands ask questions, so they can be run from
+# scripts or over ssh on a lab PC (use plot --output to save the
+# plot instead of showing it). The settings come from radios.toml
+# (see config.py), and some can be overridden by options; use
+# --help with each command for the options.
+#
+# Heavy modules (matplotlib, pandas, pyvisa and pyserial) are only
+# imported by the commands that need them, so that plot and model
+# start quickly.
+#
+import argparse
+import logging
+import sys
+from pathlib import Path
+from config import load_config
+
+log = logging.getLogger(__name__)
+
+def measure(args, config):
+    '''
+    Run a frequency sweep on the instruments and save the results
+    '''
+    from server import BenchClient, run_job
+    sweep = config["sweep"]
+    savefile = Path(args.output or sweep["savefile"])
+    if savefile.exists() and not (args.resume or args.overwrite):
+        raise RuntimeError(f"'{savefile}' already exists (use --resume "
+                           "to carry on the sweep, or --overwrite)")
+    job = {key: sweep[key] for key in ["f_low", "f_high", "steps", "vin",
+                                       "measurement", "calibration"]}
+    if args.no_calibration:
+        job["calibration"] = ""
+    job.update(savefile = str(savefile), circuit = config["circuit"],
+               resume = args.resume,
+               adaptive = args.adaptive, repeat = args.repeat,
+               multisine = args.multisine)
+    live = on_point = None
+    if args.live:
+        from lc import plot_response
+        from plotting import LivePlot
+        live = LivePlot(plot_response(config))
+        on_point = live.add
+    if args.server:
+        df = BenchClient(config["server"]["socket"]).run(job, on_point)
+    else:
+        df = run_job(job, on_point = on_point)
+    log.info(f"Saved {len(df)} points to {savefile}")
+    if sweep["store"]:
+        from store import ResultStore
+        id = ResultStore(sweep["store"]).import_csv(
+            savefile, {"circuit": config["circuit"]})
+        log.info(f"Added the sweep to {sweep['store']} (id {id})")
+    if live is not None:
+        from lc import show
+        live.finish()
+        show(live.fig)
+
+def fit_file(path, config, sweep = -1):
+    '''
+    Fit the circuit model to a results file (or a sweep in a
+    store), and return the row of fitted parameters
+    '''
+    from fit import fit_sweep
+    from store import read_sweep
+    data, _ = read_sweep(path, sweep)
+    return fit_sweep(data, Rs = config["circuit"]["Rs"]).iloc[0]
+
+def simulate(path, nodes, f):
+    '''
+    Simulate a netlist (see mna.py), and return the transfer
+    function between the two nodes, at the frequencies of its AC
+    analysis (or at the frequencies f, if it has none)
+    '''
+    import numpy as np
+    from mna import Circuit
+    from netlist import read_netlist
+    circuit = Circuit(read_netlist(path))
+    if any(analysis[0] == "ac" for analysis in circuit.netlist.analyses):
+        result = circuit.ac_analysis()
+    else:
+        result = circuit.ac(np.sort(f))
+    return result.f, result.voltage(nodes[1]) / result.voltage(nodes[0])
+
+def plot(args, config):
+    '''
+    Plot the results in a file, with the modelled response (and
+    the simulated responses of any netlists)
+    '''
+    from lc import plot_response, print_fit, show
+    from store import read_sweep
+    path = args.file or config["sweep"]["savefile"]
+    data, metadata = read_sweep(path, args.sweep)
+    steps = metadata.get("freq_steps", len(data["f"]))
+    if len(data["f"]) < steps:
+        print(f"Plotting partial sweep ({len(data['f'])}/{steps} points)")
+    fitted = None
+    if args.fit:
+        fitted = fit_file(path, config, args.sweep)
+        print_fit(fitted)
+    simulated = [(Path(path).name, *simulate(path, args.nodes, data["f"]))
+                 for path in args.netlist]
+    show(plot_response(config, data, fitted, simulated), args.output)
+
+def fit(args, config):
+    '''
+    Fit the circuit model to each results file, and print a table
+    of the fitted parameters
+    '''
+    names = ["L", "C", "R", "Rs"]
+    files = args.files or [config["sweep"]["savefile"]]
+    print(f"{'file':20s}" + "".join(f"{name:>22s}" for name in names))
+    for path in files:
+        fitted = fit_file(path, config)
+        values = "".join(f"{fitted[name]:>12.5g} +/- {fitted.get(name + '_ci', 0):<6.2g}"
+                         for name in names)
+        status = "" if fitted["converged"] else "  (not converged)"
+        print(f"{str(path):20s}{values}{status}")
+
+def store(args, config):
+    '''
+    Import results files into the store, export a sweep from it,
+    or list its sweeps
+    '''
+    from store import ResultStore
+    results = ResultStore(args.store or config["sweep"]["store"])
+    if args.action == "import":
+        ids = results.import_files(args.files, {"circuit": config["circuit"]})
+        print(f"Imported {len(args.files)} files (ids {', '.join(map(str, ids))})")
+    elif args.action == "export":
+        if len(args.files) != 2:
+            raise ValueError("export needs a sweep and a file name")
+        results.export_csv(args.files[0], args.files[1])
+    else:
+        print(f"{'id':>6s}  {'name':24s}{'points':>8s}  measurement")
+        for sweep in results.sweeps():
+            print(f"{sweep['id']:6d}  {sweep['name']:24s}{sweep['rows']:8d}  "
+                  f"{sweep['metadata'].get('measurement', '')}")
+
+def server(args, config):
+    '''
+    Start the bench server, or show its status, or stop it
+    '''
+    from server import BenchClient, BenchServer
+    path = args.socket or config["server"]["socket"]
+    if args.action == "status":
+        status = BenchClient(path).status()
+        running = status["running"]
+        print(f"{status['oscilloscope']}: {status['completed']} jobs completed, "
+              f"{len(status['queued'])} queued")
+        if running is not None:
+            print(f"Running job {running['job']}: {running['steps']} points from "
+                  f"{running['f_low']:g} to {running['f_high']:g} Hz "
+                  f"to {running['savefile']}")
+    elif args.action == "stop":
+        BenchClient(path).stop()
+    else:
+        gen = osc = None
+        if args.simulate:
+            from sim import SimBench
+            bench = SimBench()
+            gen, osc = bench.generator(), bench.scope()
+        try:
+            BenchServer(path, gen, osc).serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+def capture(args, config):
+    '''
+    Make a single acquisition, and save the acquisition memory of a
+    channel to a .npy file (see DS1054Z.read_memory())
+    '''
+    from ds1054z import DS1054Z
+    osc = DS1054Z()
+    if args.memory_depth is not None:
+        osc.set_memory_depth(args.memory_depth)
+    osc.single()
+    try:
+        samples, preamble = osc.read_memory(args.channel, args.output,
+                                            args.chunk_points, args.format)
+    finally:
+        osc.run()
+    stats = osc.transfer_stats
+    print(f"Saved {len(samples)} samples ({preamble['xincrement']:.3g} s apart) "
+          f"to {args.output}: {stats['bytes_per_second'] / 1e6:.3g} MB/s "
+          f"in {stats['chunks']} chunks")
+
+def model(args, config):
+    '''
+    Plot the modelled response of the circuit, or the AC analysis
+    of a netlist (the expressions of its plot or print commands,
+    or those given)
+    '''
+    from lc import plot_response, resonant_frequency, show
+    if args.netlist is not None:
+        from lc import plot_probes
+        from mna import Circuit
+        from netlist import read_netlist
+        netlist = read_netlist(args.netlist)
+        probes = args.probe or netlist.probes
+        if not probes:
+            raise ValueError(f"'{args.netlist}' has nothing to plot (use --probe)")
+        result = Circuit(netlist).ac_analysis()
+        show(plot_probes(result, probes, netlist.title), args.output)
+        return
+    circuit = config["circuit"]
+    print(f"L = {circuit['L']} H, C = {circuit['C']} F, Rs = {circuit['Rs']} Ohms")
+    print(f"Resonant frequency fc = {resonant_frequency(circuit)} Hz")
+    show(plot_response(config), args.output)
+
+def tolerance(args, config):
+    '''
+    Run a Monte Carlo analysis of the circuit with component
+    tolerances, print the spread of the resonant frequency and the
+    sensitivities, and plot the bands of the response
+    '''
+    from lc import plot_response, show
+    from tolerance import monte_carlo
+    settings = config["tolerance"]
+    tolerances = {name: settings[name] for name in ["L", "C", "R", "Rs"]}
+    for setting in args.tol:
+        name, _, value = setting.partition("=")
+        if name not in tolerances or not value:
+            raise ValueError(f"Invalid tolerance '{setting}' (use NAME=VALUE, "
+                             "with NAME one of L, C, R and Rs)")
+        tolerances[name] = float(value.rstrip("%")) / (100 if value.endswith("%") else 1)
+    result = monte_carlo(config["circuit"], tolerances,
+                         n = args.samples or settings["samples"],
+                         distribution = args.distribution or settings["distribution"],
+                         seed = args.seed)
+    plot = config["plot"]
+    print(result.summary(channel = (plot["station_kHz"] * 1e3, plot["bw_kHz"] * 1e3)))
+    if not args.no_plot:
+        show(plot_response(config, tolerance = result), args.output)
+
+def assignments(settings):
+    '''
+    Return a dictionary of the values of NAME=VALUE settings (with
+    SPICE values, such as L1=22u)
+    '''
+    from netlist import parse_value
+    values = {}
+    for setting in settings:
+        name, _, value = setting.partition("=")
+        if not name or not value:
+            raise ValueError(f"Invalid setting '{setting}' (use NAME=VALUE)")
+        values[name] = [parse_value(v) for v in value.split(",")]
+    return values
+
+def transient(args, config):
+    '''
+    Simulate a netlist in time (see transient.py), print the
+    frequency, amplitude and start-up time of the oscillation of a
+    node, and plot it; or with --sweep, simulate each combination of
+    the values given, in parallel, and print their measurements
+    '''
+    import itertools
+    from netlist import parse_value, read_netlist
+    from transient import oscillation, probe_node, read_variant, sweep, transient
+    netlist = read_netlist(args.netlist)
+    tran = [analysis for analysis in netlist.analyses if analysis[0] == "tran"]
+    if args.stop is None and not tran:
+        raise ValueError(f"'{args.netlist}' has no transient analysis (use --stop)")
+    stop = parse_value(args.stop) if args.stop is not None else tran[0][2]
+    max_step = parse_value(args.step) if args.step is not None \
+        else tran[0][1] if tran else None
+    node = args.node or probe_node(netlist.probes)
+    if node is None:
+        raise ValueError(f"'{args.netlist}' has no voltage to measure (use --node)")
+    values = {name: value[0] for name, value in assignments(args.set).items()}
+    options = {"method": args.method, "uic": args.uic}
+    if not args.uic:
+        options["kick"] = {node: parse_value(args.kick)}
+    if args.sweep:
+        swept = assignments(args.sweep)
+        variants = [{**values, **dict(zip(swept, combination))}
+                    for combination in itertools.product(*swept.values())]
+        options["kick"] = parse_value(args.kick)
+        rows = sweep(args.netlist, variants, stop, node, max_step,
+                     processes = args.processes, **options)
+        for row in rows:
+            print("  ".join(f"{name} = {row[name]:g}" for name in swept),
+                  f"  {row['frequency'] / 1e3:.2f} kHz  {row['amplitude']:.3g} V"
+                  f"  start-up {row['startup_time'] * 1e3:.3g} ms",
+                  row.get("error", ""))
+        return
+    from lc import plot_transient, show
+    result = transient(read_variant(args.netlist, values), stop, max_step, **options)
+    measured = oscillation(result, node)
+    print(f"v({node}): frequency {measured['frequency'] / 1e3:.3f} kHz, amplitude "
+          f"{measured['amplitude']:.3g} V, start-up time "
+          f"{measured['startup_time'] * 1e3:.3g} ms")
+    show(plot_transient(result, args.probe or [f"v({node})"], netlist.title),
+         args.output)
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(
+        description = "Measure and model the frequency response of the LC circuit")
+    parser.add_argument("--config", help = "settings file (default radios.toml, "
+                        "if it exists)")
+    parser.add_argument("-v", "--verbose", action = "store_true",
+                        help = "log debugging messages")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    p = commands.add_parser("measure", help = "run a frequency sweep")
+    p.set_defaults(func = measure)
+    p.add_argument("-o", "--output", help = "results file (default from the settings)")
+    p.add_argument("--resume", action = "store_true",
+                   help = "add the missing points to an existing results file")
+    p.add_argument("--overwrite", action = "store_true",
+                   help = "replace an existing results file")
+    p.add_argument("--measurement", choices = ["statistic", "waveform"])
+    p.add_argument("--f-low", type = float)
+    p.add_argument("--f-high", type = float)
+    p.add_argument("--steps", type = int)
+    p.add_argument("--vin", type = float, help = "input amplitude (V)")
+    p.add_argument("--live", action = "store_true",
+                   help = "plot the points as they are measured")
+    method = p.add_mutually_exclusive_group()
+    method.add_argument("--adaptive", type = int, metavar = "MAX_POINTS",
+                        help = "refine the sweep adaptively, up to MAX_POINTS")
+    method.add_argument("--repeat", type = int, metavar = "MAX_PASSES",
+                        help = "repeat the sweep, averaging each frequency until "
+                        "it converges, up to MAX_PASSES times (see campaign.py)")
+    method.add_argument("--multisine", action = "store_true",
+                        help = "use multisine excitation (see multisine.py)")
+    p.add_argument("--server", action = "store_true",
+                   help = "run the sweep on the bench server (see server.py)")
+    p.add_argument("--no-calibration", action = "store_true",
+                   help = "find the generator voltage and scales at each "
+                   "frequency from scratch (see calibration.py)")
+
+    p = commands.add_parser("server", help = "run a bench server, which keeps "
+                            "the instruments open and runs sweeps for clients")
+    p.set_defaults(func = server)
+    p.add_argument("action", choices = ["start", "status", "stop"])
+    p.add_argument("--socket", help = "Unix socket of the server (default "
+                   "from the settings)")
+    p.add_argument("--simulate", action = "store_true",
+                   help = "use simulated instruments (see sim.py)")
+
+    p = commands.add_parser("plot", help = "plot results")
+    p.set_defaults(func = plot)
+    p.add_argument("file", nargs = "?", help = "results file or store (default "
+                   "from the settings)")
+    p.add_argument("--sweep", default = -1, help = "id or name of the sweep to "
+                   "plot from a store (default the last)")
+    p.add_argument("--fit", action = "store_true",
+                   help = "fit the circuit model and plot the fitted response")
+    p.add_argument("--netlist", action = "append", default = [],
+                   help = "also plot the simulated response of this netlist "
+                   "(may be repeated)")
+    p.add_argument("--nodes", nargs = 2, default = ["in", "out"],
+                   metavar = ("IN", "OUT"), help = "input and output nodes of "
+                   "the netlists (default in out)")
+    p.add_argument("-o", "--output", help = "save the plot to this file instead "
+                   "of showing it")
+
+    p = commands.add_parser("fit", help = "fit the circuit model to results")
+    p.set_defaults(func = fit)
+    p.add_argument("files", nargs = "*", help = "results files (default from "
+                   "the settings)")
+
+    p = commands.add_parser("store", help = "import results into the store, "
+                            "export or list sweeps")
+    p.set_defaults(func = store)
+    p.add_argument("action", choices = ["import", "export", "list"])
+    p.add_argument("files", nargs = "*", help = "results files to import, or "
+                   "the sweep and file to export")
+    p.add_argument("--store", help = "store directory (default from the settings)")
+
+    p = commands.add_parser("capture", help = "save the acquisition memory "
+                            "of a channel")
+    p.set_defaults(func = capture)
+    p.add_argument("channel", type = int, choices = [1, 2, 3, 4])
+    p.add_argument("-o", "--output", default = "capture.npy",
+                   help = "file to save the samples to (and the preamble, "
+                   "with the suffix .json)")
+    p.add_argument("--memory-depth", help = "points to acquire (or AUTO)")
+    p.add_argument("--chunk-points", type = int, help = "points per read "
+                   "(default the most allowed)")
+    p.add_argument("--format", choices = ["BYTE", "WORD"], default = "BYTE")
+
+    p = commands.add_parser("tolerance", help = "Monte Carlo analysis of the "
+                            "component tolerances")
+    p.set_defaults(func = tolerance)
+    p.add_argument("--tol", action = "append", default = [], metavar = "NAME=VALUE",
+                   help = "relative tolerance of a component, such as C=0.1 or "
+                   "C=10%% (may be repeated; default from the settings)")
+    p.add_argument("-n", "--samples", type = int, help = "sets of components to draw")
+    p.add_argument("--distribution", choices = ["uniform", "normal"])
+    p.add_argument("--seed", type = int, help = "seed of the random numbers, to "
+                   "repeat an analysis")
+    p.add_argument("--no-plot", action = "store_true", help = "only print the summary")
+    p.add_argument("-o", "--output", help = "save the plot to this file instead "
+                   "of showing it")
+
+    p = commands.add_parser("transient", help = "simulate a netlist in time, and "
+                            "measure its oscillation")
+    p.set_defaults(func = transient)
+    p.add_argument("netlist")
+    p.add_argument("--stop", help = "end time, such as 4m (default from the "
+                   "netlist's tran command)")
+    p.add_argument("--step", help = "largest time step (default from the "
+                   "netlist's tran command, or a fiftieth of the end time)")
+    p.add_argument("--node", help = "node whose oscillation is measured (default "
+                   "the node of the netlist's first plot expression)")
+    p.add_argument("--kick", default = "10m", help = "volts added to the node at "
+                   "the operating point, to start the oscillation (default 10m)")
+    p.add_argument("--uic", action = "store_true", help = "start from zero "
+                   "(switching the supplies on) instead of the operating point")
+    p.add_argument("--method", choices = ["trap", "bdf2"], default = "trap")
+    p.add_argument("--set", action = "append", default = [], metavar = "NAME=VALUE",
+                   help = "value of an element or parameter, such as L1=22u "
+                   "(may be repeated)")
+    p.add_argument("--sweep", action = "append", default = [],
+                   metavar = "NAME=VALUE,...", help = "simulate every combination "
+                   "of these values in parallel, and print the measurements "
+                   "(may be repeated)")
+    p.add_argument("--processes", type = int, help = "processes for --sweep "
+                   "(default one per CPU)")
+    p.add_argument("--probe", action = "append",
+                   help = "expression to plot, such as v(4) or i(L1) (may be repeated)")
+    p.add_argument("-o", "--output", help = "save the plot to this file instead "
+                   "of showing it")
+
+    p = commands.add_parser("model", help = "plot the circuit model")
+    p.set_defaults(func = model)
+    p.add_argument("--netlist", help = "plot the AC analysis of this netlist")
+    p.add_argument("--probe", action = "append",
+                   help = "expression to plot, such as vdb(out) (may be repeated)")
+    p.add_argument("-o", "--output", help = "save the plot to this file instead "
+                   "of showing it")
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    args = parse_args(argv)
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.INFO,
+                        format = "%(message)s")
+    try:
+        config = load_config(args.config)
+        # Sweep settings given as options override the settings file
+        for key in ["measurement", "f_low", "f_high", "steps", "vin"]:
+            if getattr(args, key, None) is not None:
+                config["sweep"][key] = getattr(args, key)
+        args.func(args, config)
+    except (RuntimeError, ValueError, OSError) as e:
+        sys.exit(f"radios: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# Waiting for instruments to become ready
+#
+# Some readings are not available straight away: the statistics of
+# the oscilloscope are invalid until it has made an acquisition
+# since they were reset, and a single acquisition takes as long as
+# the trigger does. Asking again in a tight loop floods the USB
+# link with queries (which slows the instrument down), and asking
+# at a fixed interval makes every reading wait for at least that
+# interval. wait_until() asks again after a delay which starts
+# short and doubles each time (up to a limit), so a reading that
+# is ready quickly is read quickly, and one that takes longer only
+# costs a few more queries. Every wait has a deadline:
+#
+#   vpp = wait_until(read_vpp, timeout = 1, what = "the Vpp")
+#
+from time import sleep, monotonic
+
+def backoff(initial = 0.01, maximum = 0.2, factor = 2):
+    '''
+    Generate the delays between attempts: initial seconds, then
+    multiplied by factor after each attempt, up to maximum
+    '''
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * factor, maximum)
+
+def wait_until(ready, timeout, initial = 0.01, maximum = 0.2, factor = 2,
+               what = "the instrument"):
+    '''
+    Call ready() until it returns a value other than None, and
+    return that value. The delays between the calls back off
+    exponentially (see backoff()). ready() is called a last time at
+    the deadline (timeout seconds after the first call), and if it
+    still returns None, RuntimeError is raised.
+    '''
+    deadline = monotonic() + timeout
+    for delay in backoff(initial, maximum, factor):
+        value = ready()
+        if value is not None:
+            return value
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise RuntimeError(f"Timed out after {timeout} s waiting for {what}")
+        sleep(min(delay, remaining))
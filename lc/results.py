@@ -0,0 +1,117 @@
+# Streaming, crash-safe frequency response results files
+#
+# Results are written in the same CSV format as meas.csv (with an
+# index column), one row at a time, and each row is flushed to
+# disk as soon as it is measured. If the sweep is interrupted,
+# all the completed rows are kept, and the sweep can be resumed.
+# The file starts with comment lines containing the metadata of
+# the sweep (settings and instrument IDs), in the form
+#
+#   # key: value
+#
+# where value is JSON. Use read_results() to read the file; it
+# can read a file that is still being written.
+#
+import io
+import json
+import os
+from pathlib import Path
+import numpy as np
+
+# Columns written by FrequencyResponse
+COLUMNS = ["f", "v_gen", "v_in", "v_out", "phase",
+           "v_in_ci", "v_out_ci", "phase_ci"]
+
+def read_text(path):
+    '''
+    Read a results file, and return its text (without any
+    partially written last row) and a dictionary of the metadata
+    '''
+    text = Path(path).read_text()
+    if not text.endswith("\n"):
+        text = text[:text.rfind("\n") + 1]
+    metadata = {}
+    for line in text.splitlines():
+        if not line.startswith("# "):
+            break
+        key, value = line[2:].split(": ", 1)
+        metadata[key] = json.loads(value)
+    return text, metadata
+
+def read_results(path):
+    '''
+    Read a results file (or an old-style file without metadata),
+    and return the data frame and a dictionary of the metadata.
+    A partially written last row is ignored.
+    '''
+    import pandas as pd
+    text, metadata = read_text(path)
+    df = pd.read_csv(io.StringIO(text), comment = "#", index_col = 0)
+    return df, metadata
+
+def read_arrays(path):
+    '''
+    Read a results file as read_results() does, but without
+    pandas (which is slow to import), and return a dictionary
+    mapping each column to an array of its values, and the
+    metadata
+    '''
+    text, metadata = read_text(path)
+    lines = [line for line in text.splitlines() if not line.startswith("#")]
+    columns = lines[0].split(",")[1:]
+    data = np.loadtxt(lines[1:], delimiter = ",", ndmin = 2) \
+        if len(lines) > 1 else np.empty((0, len(columns) + 1))
+    return dict(zip(columns, data[:, 1:].T)), metadata
+
+class ResultsWriter:
+    '''
+    Append rows of results to a file, flushing each row to disk
+    as it is written. If resume is True and the file exists, rows
+    are appended to it (using its columns); otherwise, a new file
+    is started with the metadata and the header. Use as a context
+    manager, or call close() when finished.
+    '''
+    def __init__(self, path, metadata = None, resume = False,
+                 columns = COLUMNS):
+        path = Path(path)
+        if resume and path.is_file():
+            df, _ = read_results(path)
+            self.columns = list(df.columns)
+            self.count = len(df)
+            # Remove any partially written row
+            with open(path, "rb+") as f:
+                data = f.read()
+                f.truncate(data.rfind(b"\n") + 1)
+            self.file = open(path, "a")
+        else:
+            self.columns = columns
+            self.count = 0
+            self.file = open(path, "w")
+            for key, value in (metadata or {}).items():
+                self.file.write(f"# {key}: {json.dumps(value)}\n")
+            self.file.write("," + ",".join(self.columns) + "\n")
+            self.flush()
+
+    def write(self, row):
+        '''
+        Append a row (a dictionary of column values) to the file.
+        Missing columns are written as NaN.
+        '''
+        values = [repr(float(row.get(column, np.nan)))
+                  for column in self.columns]
+        self.file.write(",".join([str(self.count), *values]) + "\n")
+        self.flush()
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
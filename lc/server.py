@@ -0,0 +1,376 @@
+# Bench server: one long-lived process that owns the instruments
+#
+# Opening the instruments and resetting and setting up the
+# oscilloscope takes seconds, which every run of a script pays
+# again. The bench server opens the FY6600 and DS1054Z once, sets
+# them up for the first sweep and keeps them set up, and runs the
+# sweeps that clients send it, one at a time, in the order they
+# arrive. Several scripts and notebooks can then share one bench:
+#
+#   python3 radios.py server start      # or BenchServer(path).serve_forever()
+#
+#   client = BenchClient()
+#   df = client.run({"f_low": 1e5, "f_high": 2e6, "steps": 20,
+#                    "savefile": "meas.csv"}, on_point = print)
+#
+# The server listens on a Unix socket (only processes on the same
+# computer, with permission to open the socket file, can use it).
+# Each request and reply is a JSON object on one line. A sweep
+# request sends a job (the settings of the sweep, as JOB), and the
+# server replies with the events of the job as they happen:
+#
+#   {"event": "queued", "job": 3, "position": 1}
+#   {"event": "started", "job": 3}
+#   {"event": "point", "job": 3, "row": {"f": 100000.0, ...}}
+#   ...
+#   {"event": "done", "job": 3, "savefile": "/home/.../meas.csv", "points": 20}
+#
+# or {"event": "failed", "job": 3, "error": "..."}. The results are
+# saved by the server to the job's savefile (so use absolute paths,
+# as the client does), and the client reads them from there. If a
+# client disconnects, its job still runs to the end.
+#
+# The server can run with simulated instruments (see sim.py), for
+# trying it out without any hardware:
+#
+#   python3 radios.py server start --simulate
+#
+import json
+import logging
+import queue
+import socket
+import socketserver
+import threading
+from pathlib import Path
+from config import DEFAULTS
+from results import read_results
+
+log = logging.getLogger(__name__)
+
+# Settings of a sweep job (see run_job()), and their defaults
+JOB = {
+    **{key: DEFAULTS["sweep"][key]
+       for key in ["f_low", "f_high", "steps", "vin", "measurement", "savefile",
+                   "calibration"]},
+    # Component values of the circuit (which select the calibration
+    # profile)
+    "circuit": None,
+    "resume": False,
+    # Run an adaptive sweep of up to this many points, a campaign
+    # of up to this many passes, or a multisine sweep instead
+    "adaptive": None,
+    "repeat": None,
+    "multisine": False,
+}
+
+def check_job(job):
+    '''
+    Return the settings of a job (a dictionary of some of the
+    settings in JOB) with the defaults filled in. ValueError is
+    raised if the settings are not valid.
+    '''
+    unknown = set(job) - set(JOB)
+    if unknown:
+        raise ValueError(f"Unknown job settings: {', '.join(sorted(unknown))}")
+    job = {**JOB, **job}
+    if job["resume"] and (job["repeat"] is not None or job["multisine"]):
+        raise ValueError("Repeated and multisine sweeps cannot be resumed")
+    return job
+
+def run_job(job, gen = None, osc = None, on_point = None, reset = True):
+    '''
+    Run the sweep described by job (a dictionary of the settings
+    in JOB; the others keep their defaults) with the instruments gen
+    and osc (by default, the attached FY6600 and DS1054Z), passing
+    each point to on_point as it is measured. Returns the results
+    as a data frame. If reset is False, the oscilloscope is not
+    reset first (see FrequencyResponse).
+    '''
+    from calibration import CalibrationCache
+    from frequency_response import FrequencyResponse
+    job = check_job(job)
+    calibration = CalibrationCache(job["calibration"]) if job["calibration"] else None
+    fr = FrequencyResponse(job["f_low"], job["f_high"], job["steps"], job["vin"],
+                           measurement = job["measurement"], gen = gen,
+                           osc = osc, reset = reset, calibration = calibration,
+                           circuit = job["circuit"])
+    savefile = job["savefile"]
+    if job["multisine"]:
+        from multisine import MultisineSweep
+        return MultisineSweep(fr).run(savefile, on_point = on_point)
+    if job["repeat"] is not None:
+        from campaign import Campaign
+        return Campaign(fr, max_passes = job["repeat"]).run(savefile,
+                                                            on_point = on_point)
+    if job["adaptive"] is not None:
+        return fr.run_adaptive(savefile, max_points = job["adaptive"],
+                               resume = job["resume"], on_point = on_point)
+    return fr.run(savefile, resume = job["resume"], on_point = on_point)
+
+def encode(message):
+    '''
+    Return a message as a line of JSON (numpy numbers are sent as
+    floats)
+    '''
+    return (json.dumps(message, default = float) + "\n").encode()
+
+class Job:
+    '''
+    A sweep job waiting to run (or running) on the server. The
+    events of the job are put on the events queue, to be sent to
+    the client.
+    '''
+    def __init__(self, id, settings):
+        self.id = id
+        self.settings = settings
+        self.events = queue.Queue()
+
+    def send(self, event, **fields):
+        self.events.put({"event": event, "job": self.id, **fields})
+
+class Handler(socketserver.StreamRequestHandler):
+    '''
+    Handles the requests of one client connection
+    '''
+    def handle(self):
+        bench = self.server.bench
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                kind = request.get("request")
+                if kind == "sweep":
+                    self.stream(bench.submit(request.get("job", {})))
+                elif kind == "status":
+                    self.reply({"event": "status", **bench.status()})
+                elif kind == "stop":
+                    self.reply({"event": "stopping"})
+                    bench.stop()
+                else:
+                    self.reply({"event": "error", "error": f"Unknown request '{kind}'"})
+            except (ValueError, AttributeError) as e:
+                self.reply({"event": "error", "error": f"Invalid request: {e}"})
+            except OSError:
+                # The client has gone
+                return
+
+    def reply(self, message):
+        self.wfile.write(encode(message))
+        self.wfile.flush()
+
+    def stream(self, job):
+        '''
+        Send the events of a job to the client until it finishes
+        '''
+        while True:
+            event = job.events.get()
+            self.reply(event)
+            if event["event"] in ("done", "failed"):
+                return
+
+class BenchServer:
+    '''
+    Server owning a signal generator and oscilloscope (by default,
+    the attached FY6600 and DS1054Z), which runs the sweep jobs
+    sent to the Unix socket path, one at a time (see above). The
+    oscilloscope is reset and set up by the first job, and after
+    any job that fails; the other jobs use the settings as they
+    are.
+    '''
+    def __init__(self, path, gen = None, osc = None):
+        if gen is None:
+            from fy6600 import FY6600
+            gen = FY6600()
+        if osc is None:
+            from ds1054z import DS1054Z
+            osc = DS1054Z()
+        self.path = Path(path).expanduser()
+        self.gen = gen
+        self.osc = osc
+        self.configured = False
+        self.jobs = queue.Queue()
+        self.queued = []
+        self.running = None
+        self.completed = 0
+        self.next_id = 1
+        self.lock = threading.Lock()
+        self.server = None
+
+    def submit(self, settings):
+        '''
+        Add a sweep job (a dictionary of settings, see JOB) to the
+        queue, and return the Job (with the defaults of the settings
+        filled in). ValueError is raised if the settings are not
+        valid.
+        '''
+        settings = check_job(settings)
+        with self.lock:
+            job = Job(self.next_id, settings)
+            self.next_id += 1
+            self.queued.append(job)
+            position = len(self.queued) + (self.running is not None)
+        job.send("queued", position = position)
+        log.info(f"Job {job.id} queued (position {position})")
+        self.jobs.put(job)
+        return job
+
+    def status(self):
+        '''
+        Return a dictionary of the state of the server: the job
+        running, the jobs queued (with their settings), and the
+        number of jobs completed
+        '''
+        with self.lock:
+            running = self.running
+            return {"running": None if running is None else
+                    {"job": running.id, **running.settings},
+                    "queued": [{"job": job.id, **job.settings}
+                               for job in self.queued],
+                    "completed": self.completed, "oscilloscope": self.osc.idn}
+
+    def work(self):
+        '''
+        Run the jobs in the queue, one at a time, until stop()
+        '''
+        while (job := self.jobs.get()) is not None:
+            with self.lock:
+                self.queued.remove(job)
+                self.running = job
+            job.send("started")
+            log.info(f"Running job {job.id}: {job.settings}")
+            try:
+                df = run_job(job.settings, self.gen, self.osc, reset = not self.configured,
+                             on_point = lambda row: job.send("point", row = row))
+                self.configured = True
+                savefile = Path(job.settings.get("savefile", JOB["savefile"])).resolve()
+                job.send("done", savefile = str(savefile), points = len(df))
+                log.info(f"Job {job.id} done ({len(df)} points)")
+            except Exception as e:
+                # Set the instruments up again for the next job
+                self.configured = False
+                log.exception(f"Job {job.id} failed")
+                job.send("failed", error = str(e))
+            with self.lock:
+                self.running = None
+                self.completed += 1
+
+    def serve_forever(self):
+        '''
+        Listen on the socket and run the jobs sent to it, until
+        stop() (or a stop request)
+        '''
+        self.path.parent.mkdir(parents = True, exist_ok = True)
+        if self.path.exists():
+            if connectable(self.path):
+                raise RuntimeError(f"A bench server is already running on {self.path}")
+            # Left over from a server that did not stop cleanly
+            self.path.unlink()
+        self.server = socketserver.ThreadingUnixStreamServer(str(self.path), Handler)
+        self.server.daemon_threads = True
+        self.server.bench = self
+        worker = threading.Thread(target = self.work, daemon = True)
+        worker.start()
+        log.info(f"Bench server listening on {self.path}")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.path.unlink(missing_ok = True)
+            self.fail_queued("the server stopped")
+            self.jobs.put(None)
+            worker.join()
+            log.info("Bench server stopped")
+
+    def stop(self):
+        '''
+        Stop the server (from another thread): the job running is
+        finished, and the jobs queued fail
+        '''
+        self.fail_queued("the server is stopping")
+        threading.Thread(target = self.server.shutdown).start()
+
+    def fail_queued(self, reason):
+        '''
+        Remove the jobs waiting in the queue, and tell their clients
+        '''
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                return
+            if job is not None:
+                with self.lock:
+                    self.queued.remove(job)
+                job.send("failed", error = reason)
+
+def connectable(path):
+    '''
+    Return True if a server is listening on the Unix socket path
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(str(path))
+            return True
+        except OSError:
+            return False
+
+class BenchClient:
+    '''
+    Client of a BenchServer listening on the Unix socket path
+    '''
+    def __init__(self, path = DEFAULTS["server"]["socket"]):
+        self.path = Path(path).expanduser()
+
+    def request(self, message):
+        '''
+        Send a request to the server, and yield its replies
+        '''
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            try:
+                s.connect(str(self.path))
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                raise RuntimeError(f"No bench server on {self.path} (start one "
+                                   "with radios.py server start)") from e
+            s.sendall(encode(message))
+            with s.makefile("rb") as f:
+                for line in f:
+                    reply = json.loads(line)
+                    if reply["event"] == "error":
+                        raise RuntimeError(f"Bench server: {reply['error']}")
+                    yield reply
+
+    def run(self, job, on_point = None):
+        '''
+        Run a sweep job (a dictionary of settings, see JOB) on the
+        server, waiting for the jobs ahead of it, and return the
+        results as a data frame (as FrequencyResponse.run()). Each
+        point is passed to on_point (if given) as it is measured.
+        The savefile is relative to the current directory of the
+        client. RuntimeError is raised if the job fails.
+        '''
+        savefile = Path(job.get("savefile", JOB["savefile"])).resolve()
+        for event in self.request({"request": "sweep",
+                                   "job": {**job, "savefile": str(savefile)}}):
+            if event["event"] == "queued":
+                log.info(f"Job {event['job']} queued (position {event['position']})")
+            elif event["event"] == "started":
+                log.info(f"Job {event['job']} started")
+            elif event["event"] == "point":
+                if on_point is not None:
+                    on_point(event["row"])
+            elif event["event"] == "failed":
+                raise RuntimeError(f"Job {event['job']} failed: {event['error']}")
+            elif event["event"] == "done":
+                return read_results(event["savefile"])[0]
+        raise RuntimeError("The bench server closed the connection")
+
+    def status(self):
+        '''
+        Return the state of the server (see BenchServer.status())
+        '''
+        return next(self.request({"request": "status"}))
+
+    def stop(self):
+        '''
+        Stop the server, once the job running has finished
+        '''
+        next(self.request({"request": "stop"}))
@@ -0,0 +1,73 @@
+# Convergence-based settling and averaging of noisy readings
+#
+# Instead of waiting for a fixed time and then averaging a fixed
+# number of readings, take readings until their mean is known to
+# within a tolerance. Quiet readings then finish after a few
+# samples, and noisy readings get as many samples as they need
+# (up to a timeout).
+#
+import numpy as np
+from time import sleep, monotonic
+
+# Number of standard errors in the confidence interval (95%)
+Z_95 = 1.96
+
+# Number of standard errors by which the older and newer readings
+# must differ to decide that the readings are still settling
+Z_DRIFT = 3
+
+def converge(read, tolerance, relative = False, timeout = 10,
+             interval = 0.05, min_samples = 4, deadline = None):
+    '''
+    Call read() repeatedly (every interval seconds) until the 95%
+    confidence interval of the mean of the readings is within
+    +/- tolerance, and return the mean and the half-width of the
+    confidence interval. If relative is True, the tolerance is a
+    fraction of the mean. Each reading is counted as a separate
+    sample, so interval should be no shorter than the time
+    between new values of the reading (for example, between
+    acquisitions of the oscilloscope).
+
+    If read() raises RuntimeError, the reading is not ready yet,
+    and is skipped. While the circuit is still settling, the older
+    readings will disagree with the newer ones. This is checked
+    when the confidence interval is narrow enough; if they
+    disagree, the older half of the readings is discarded.
+
+    If the confidence interval is still too wide after timeout
+    seconds, or at deadline (a time from monotonic(), shared by
+    several calls), the mean and confidence interval so far are
+    returned, once there are min_samples readings (or with an
+    infinite confidence interval, if there are fewer). RuntimeError
+    is raised if there are no valid readings by then.
+    '''
+    samples = []
+    start = monotonic()
+    stop = start + timeout if deadline is None else min(start + timeout, deadline)
+    while True:
+        try:
+            samples.append(read())
+        except RuntimeError:
+            pass
+        n = len(samples)
+        if n >= max(min_samples, 4):
+            x = np.array(samples)
+            mean = x.mean()
+            limit = tolerance * abs(mean) if relative else tolerance
+            ci = Z_95 * x.std(ddof = 1) / np.sqrt(n)
+            timed_out = monotonic() > stop
+            if ci <= limit or timed_out:
+                # Check the older half of the readings agrees with
+                # the newer half (otherwise, it is still settling)
+                old, new = x[:n // 2], x[n // 2:]
+                drift = abs(old.mean() - new.mean())
+                spread = np.sqrt(old.var(ddof = 1) / len(old)
+                                 + new.var(ddof = 1) / len(new))
+                if drift <= Z_DRIFT * spread + limit or timed_out:
+                    return mean, ci
+                samples = samples[n // 2:]
+        elif monotonic() > stop:
+            if n == 0:
+                raise RuntimeError("No valid readings before timeout")
+            return np.mean(samples), np.inf
+        sleep(interval)
@@ -0,0 +1,785 @@
+# Simulated FY6600 signal generator and DS1054Z oscilloscope
+#
+# The simulated instruments answer the same serial and SCPI
+# commands as the real ones, with the parallel LC circuit of
+# model.py (lc.net) as the device under test. This makes it
+# possible to run (and time) FrequencyResponse without any
+# hardware:
+#
+#   bench = SimBench()
+#   fr = FrequencyResponse(1e3, 6e7, 100, 0.4,
+#                          gen = bench.generator(),
+#                          osc = bench.scope())
+#   df = fr.run()
+#
+# The circuit is connected as shown in frequency_response.py.
+# The generator (with source resistance r_source) drives the
+# LC-Rs combination, channel 1 measures the voltage across the
+# combination and channel 2 measures the voltage across Rs.
+#
+# Like the real oscilloscope, the statistics return 9.9E37
+# until enough acquisitions have been made after a reset, or
+# if the waveform does not fit on the screen. The averaged
+# statistics become less noisy as more acquisitions are made.
+# The waveforms on the screen (1200 points, triggered on the
+# rising edge of channel 1) can also be read in BYTE format, and
+# the whole acquisition memory (up to 24 Mpts) in RAW mode, in
+# BYTE or WORD format.
+# The generator can also play an uploaded arbitrary waveform (a
+# multisine, for example), whose harmonics all pass through the
+# circuit.
+#
+import re
+import time
+from collections import Counter
+from types import SimpleNamespace
+import numpy as np
+import pyvisa
+import serial
+from model import voltages
+from discovery import Reconnecting
+from ds1054z import DS1054Z
+from fy6600 import FY6600, SINE_WAVEFORM, ARBITRARY_WAVEFORM, \
+    ARBITRARY_SAMPLES, ARBITRARY_MAX_CODE
+
+# Value returned by the DS1054Z for an invalid measurement
+INVALID = 9.9e37
+
+# Number of vertical divisions on the DS1054Z screen
+VERTICAL_DIVS = 8
+
+# Resolution of the 8-bit ADC, as a fraction of a division
+ADC_LSB_DIVS = 1 / 25
+
+# Number of horizontal divisions, and the number of points
+# returned by :WAVEFORM:DATA? in NORMAL mode
+HORIZONTAL_DIVS = 12
+SCREEN_POINTS = 1200
+
+# Largest memory depth, and the highest sample rate, which are
+# shared between the channels that are turned on
+MAX_MEMORY_DEPTH = 24000000
+MAX_SAMPLE_RATE = 1e9
+
+# Memory depth used by AUTO
+AUTO_MEMORY_DEPTH = 12000
+
+def nearest_125(value, lowest, highest):
+    '''
+    Round value to the nearest (logarithmically) number in the
+    1-2-5 sequence, limited to the range [lowest, highest]. This
+    is how the DS1054Z coerces vertical and horizontal scales.
+    '''
+    value = min(max(value, lowest), highest)
+    decade = 10 ** np.floor(np.log10(value))
+    steps = decade * np.array([1, 2, 5, 10])
+    nearest = steps[np.argmin(abs(np.log(steps / value)))]
+    return float(min(max(nearest, lowest), highest))
+
+class SimClock:
+    '''
+    Clock shared by the simulated instruments. Simulated time
+    runs speedup times faster than wall-clock time, so sleep(1)
+    only takes 1/speedup seconds. This allows sweeps containing
+    long settling delays to be timed quickly. All times used by
+    the simulated instruments are in simulated seconds.
+    '''
+    def __init__(self, speedup = 1):
+        self.speedup = speedup
+        self.start = time.monotonic()
+
+    def time(self):
+        '''
+        Return the simulated time in seconds since the clock was
+        created
+        '''
+        return (time.monotonic() - self.start) * self.speedup
+
+    def sleep(self, seconds):
+        '''
+        Wait for a number of simulated seconds
+        '''
+        if seconds > 0:
+            time.sleep(seconds / self.speedup)
+
+class SimCircuit:
+    '''
+    The device under test (the LC circuit in series with the
+    sense resistor Rs) and the generator output driving it.
+    The generator amplitude is the open-circuit peak-to-peak
+    voltage, and the generator has source resistance r_source.
+    The generator outputs a sine wave, or the arbitrary waveform
+    in waveform (one period of samples between -1 and 1, which
+    repeats at the generator frequency) if it is not None.
+    '''
+    def __init__(self, L = 30e-6, C = 303e-12, R = 0.6, Rs = 22,
+                 r_source = 50):
+        self.L = L
+        self.C = C
+        self.R = R
+        self.Rs = Rs
+        self.r_source = r_source
+        self.frequency = 1e3
+        self.amplitude = 1.0
+        self.waveform = None
+
+    def response(self, f, v_gen):
+        '''
+        Return the complex peak-to-peak voltages on channel 1
+        (across the LC-Rs combination) and channel 2 (across Rs)
+        at frequency f, for the open-circuit generator voltage
+        v_gen
+        '''
+        v_in, v_out = voltages(f, self.L, self.C, self.R, self.Rs, self.r_source)
+        return v_gen * v_in, v_gen * v_out
+
+    def voltages(self):
+        '''
+        Return the complex peak-to-peak voltages on channel 1
+        and channel 2 at the generator frequency
+        '''
+        v_in, v_out = self.response(self.frequency, self.amplitude)
+        return v_in[0], v_out[0]
+
+    def components(self):
+        '''
+        Return arrays of the frequencies of the components of the
+        generator output, and the complex peak-to-peak voltages of
+        each component on channel 1 and channel 2
+        '''
+        if self.waveform is None:
+            f = np.array([self.frequency])
+            return (f, *self.response(f, self.amplitude))
+        spectrum = np.fft.rfft(self.waveform)[1:]
+        # Ignore the quantisation noise of the samples
+        harmonics = np.flatnonzero(abs(spectrum) > 1e-3 * abs(spectrum).max())
+        f = (harmonics + 1) * self.frequency
+        # The samples span the peak-to-peak amplitude
+        v_gen = 2 * spectrum[harmonics] / len(self.waveform) * self.amplitude
+        return (f, *self.response(f, v_gen))
+
+class SimSerial:
+    '''
+    Simulated FY6600 serial port. Supports setting (WMF, WMA) and
+    reading back (RMF, RMA) the frequency and amplitude of the main
+    channel, uploading arbitrary waveforms (DDS_WAVE) and selecting
+    the sine or an arbitrary waveform (WMW). Each write takes the
+    time needed to send the bytes at the configured baud rate, plus
+    latency seconds.
+    '''
+    def __init__(self, bench, latency = 1e-3):
+        self.bench = bench
+        self.latency = latency
+        self.baudrate = 9600
+        self.timeout = None
+        self.is_open = True
+        self.replies = []
+        # Arbitrary waveforms uploaded to each slot, and the slot
+        # and data of an upload in progress
+        self.arbitrary = {}
+        self.upload = None
+
+    def write(self, data):
+        if not self.bench.connected():
+            raise serial.SerialException("Simulated generator disconnected")
+        self.bench.clock.sleep(self.latency + 10 * len(data) / self.baudrate)
+        self.bench.messages["gen"] += 1
+        if self.upload is not None:
+            self.receive(data)
+            return len(data)
+        for line in data.decode().splitlines():
+            self.command(line.strip())
+        return len(data)
+
+    def receive(self, data):
+        '''
+        Receive the data of an arbitrary waveform upload
+        '''
+        slot, received = self.upload
+        received += data
+        if len(received) >= 2 * ARBITRARY_SAMPLES:
+            codes = np.frombuffer(received[:2 * ARBITRARY_SAMPLES], dtype = "<u2")
+            self.arbitrary[slot] = codes / ARBITRARY_MAX_CODE * 2 - 1
+            self.upload = None
+            self.replies.append("HN")
+
+    def command(self, line):
+        circuit = self.bench.circuit
+        self.bench.count("gen", line[:3])
+        if line.startswith("WMF"):
+            circuit.frequency = int(line[3:]) * 1e-6
+        elif line.startswith("WMA"):
+            circuit.amplitude = float(line[3:])
+        elif line.startswith("WMW"):
+            code = int(line[3:])
+            if code == SINE_WAVEFORM:
+                circuit.waveform = None
+            elif code - ARBITRARY_WAVEFORM + 1 in self.arbitrary:
+                circuit.waveform = self.arbitrary[code - ARBITRARY_WAVEFORM + 1]
+            else:
+                raise ValueError(f"Simulated FY6600 does not have waveform {code}")
+        elif line.startswith("DDS_WAVE"):
+            self.upload = (int(line[8:]), bytearray())
+            self.replies.append("W")
+        elif line == "RMF":
+            self.replies.append(f"{circuit.frequency:.6f}")
+        elif line == "RMA":
+            self.replies.append(f"{circuit.amplitude * 1e4:.0f}")
+        else:
+            raise ValueError(f"Simulated FY6600 does not support '{line}'")
+        self.bench.circuit_changed = self.bench.clock.time()
+
+    def readline(self):
+        if len(self.replies) == 0:
+            return b""
+        return (self.replies.pop(0) + "\n").encode()
+
+    def reset_input_buffer(self):
+        self.replies.clear()
+
+    def close(self):
+        self.is_open = False
+
+class SimScope:
+    '''
+    Simulated DS1054Z VISA resource. Supports the SCPI commands
+    used by the DS1054Z class. Every write or query takes latency
+    seconds. Multiple commands may be joined with ';' into one
+    message.
+
+    The statistics are invalid (9.9E37) for ready_delay seconds
+    after a reset, a change of settings or a change of the
+    generator output. The standard deviation of a single
+    measurement is vpp_noise (relative to the Vpp) or phase_noise
+    (in degrees), plus the ADC quantisation. The averages reduce
+    this by the square root of the number of acquisitions, which
+    are made every acquisition_period seconds.
+
+    Waveform samples have sample_noise divisions (rms) of noise
+    added before they are quantised. Binary data is transferred at
+    bytes_per_second.
+
+    The status byte can be read with read_stb(), and service
+    requests can be waited for with wait_on_event(), unless
+    service_requests is False.
+    '''
+    def __init__(self, bench, latency = 2e-3, vpp_noise = 0.01,
+                 phase_noise = 1.0, ready_delay = 0.3,
+                 acquisition_period = 0.05, sample_noise = 0.05,
+                 bytes_per_second = 1e6, service_requests = True):
+        self.bench = bench
+        self.service_requests = service_requests
+        self.latency = latency
+        self.vpp_noise = vpp_noise
+        self.phase_noise = phase_noise
+        self.ready_delay = ready_delay
+        self.acquisition_period = acquisition_period
+        self.sample_noise = sample_noise
+        self.bytes_per_second = bytes_per_second
+        self.timeout = 2000
+        self.replies = []
+        # The status enable registers are not changed by *RST
+        self.event_enable = 0
+        self.service_request_enable = 0
+        self.commands = [
+            (r"\*IDN\?", self.idn),
+            (r"\*OPC\?", lambda: "1"),
+            (r"\*OPC", self.operation_complete),
+            (r"\*RST", self.reset),
+            (r"\*CLS", self.clear_status),
+            (r"\*ESE (\d+)", self.set_event_enable),
+            (r"\*SRE (\d+)", self.set_service_request_enable),
+            (r"\*ESR\?", self.event_status_query),
+            (r"\*STB\?", lambda: str(self.status_byte())),
+            (r":CHANNEL(\d):DISPLAY (ON|OFF|1|0)", self.set_display),
+            (r":CHANNEL(\d):DISPLAY\?", self.display_query),
+            (r":CHANNEL(\d):SCALE (\S+)", self.set_scale),
+            (r":CHANNEL(\d):SCALE\?", self.scale_query),
+            (r":CHANNEL(\d):OFFSET (\S+)", self.set_offset),
+            (r":CHANNEL(\d):OFFSET\?", self.offset_query),
+            (r":TIMEBASE:MAIN:SCALE (\S+)", self.set_timebase),
+            (r":TIMEBASE:MAIN:SCALE\?", self.timebase_query),
+            (r":TRIGGER:EDGE:(SOURCE|SLOPE|LEVEL) (\S+)", self.set_trigger),
+            (r":TRIGGER:EDGE:(SOURCE|SLOPE|LEVEL)\?", self.trigger_query),
+            (r":MEASURE:STATISTIC:RESET", self.reset_statistic),
+            (r":MEASURE:STATISTIC:ITEM\? (AVERAGES|CURRENT|DEVIATION),"
+             r"(VPP|RPHASE),CHANNEL(\d)(?:,CHANNEL(\d))?", self.statistic),
+            (r":RUN", self.run),
+            (r":STOP", self.stop),
+            (r":SINGLE", self.single),
+            (r":TRIGGER:STATUS\?", self.trigger_status),
+            (r":WAVEFORM:SOURCE CHANNEL(\d)", self.set_waveform_source),
+            (r":WAVEFORM:MODE (NORMAL|RAW)", self.set_waveform_mode),
+            (r":WAVEFORM:FORMAT (BYTE|WORD)", self.set_waveform_format),
+            (r":WAVEFORM:(START|STOP) (\d+)", self.set_waveform_range),
+            (r":ACQUIRE:MDEPTH (AUTO|\d+)", self.set_memory_depth),
+            (r":ACQUIRE:MDEPTH\?", self.memory_depth_query),
+            (r":WAVEFORM:PREAMBLE\?", self.waveform_preamble),
+            (r":WAVEFORM:DATA\?", self.waveform_data),
+        ]
+        self.reset()
+
+    def reset(self):
+        '''
+        Return to the power-on settings (only channel 1 displayed)
+        '''
+        self.display = {n: n == 1 for n in range(1, 5)}
+        self.scale = {n: 1.0 for n in range(1, 5)}
+        self.offset = {n: 0.0 for n in range(1, 5)}
+        self.timebase = 1e-6
+        self.trigger = {"SOURCE": "CHANNEL1", "SLOPE": "POSITIVE",
+                        "LEVEL": 0.0}
+        self.waveform_source = 1
+        self.waveform_mode = "NORMAL"
+        self.waveform_format = "BYTE"
+        self.waveform_range = {"START": 1, "STOP": SCREEN_POINTS}
+        self.memory_depth = "AUTO"
+        self.run()
+        self.reset_statistic()
+        self.clear_status()
+
+    def write(self, message):
+        self.check_connected()
+        self.bench.clock.sleep(self.latency)
+        self.bench.messages["scope"] += 1
+        for cmd in message.strip().split(";"):
+            self.command(cmd.strip())
+        return len(message)
+
+    def read_raw(self):
+        self.check_connected()
+        if len(self.replies) == 0:
+            self.bench.clock.sleep(self.timeout / 1e3)
+            raise pyvisa.errors.VisaIOError(pyvisa.constants.VI_ERROR_TMO)
+        reply = self.replies.pop(0)
+        if isinstance(reply, str):
+            reply = reply.encode()
+        self.bench.clock.sleep(len(reply) / self.bytes_per_second)
+        return reply + b"\n"
+
+    def read(self):
+        return self.read_raw().decode()
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def read_stb(self):
+        '''
+        Read the status byte (as a USB control request, not a
+        query)
+        '''
+        self.check_connected()
+        self.bench.clock.sleep(self.latency)
+        self.bench.messages["scope"] += 1
+        self.bench.count("scope", "read_stb")
+        return self.status_byte()
+
+    def enable_event(self, event_type, mechanism):
+        if not self.service_requests:
+            raise pyvisa.errors.VisaIOError(pyvisa.constants.VI_ERROR_NSUP_OPER)
+
+    def disable_event(self, event_type, mechanism):
+        pass
+
+    def discard_events(self, event_type, mechanism):
+        pass
+
+    def wait_on_event(self, event_type, timeout, capture_timeout = False):
+        '''
+        Wait up to timeout ms for a service request (the status
+        byte has the RQS bit set), without sending anything
+        '''
+        self.check_connected()
+        deadline = self.bench.clock.time() + timeout / 1e3
+        while not self.status_byte() & 0x40:
+            now = self.bench.clock.time()
+            end = self.acquisition_end() if self.opc_pending else np.inf
+            if end > deadline:
+                self.bench.clock.sleep(max(deadline - now, 0))
+                if capture_timeout:
+                    return SimpleNamespace(timed_out = True)
+                raise pyvisa.errors.VisaIOError(pyvisa.constants.VI_ERROR_TMO)
+            self.bench.clock.sleep(max(end - now, 0))
+        return SimpleNamespace(timed_out = False)
+
+    def close(self):
+        pass
+
+    def check_connected(self):
+        '''
+        Raise the VISA error for a lost connection if the bench is
+        unplugged (losing any replies waiting to be read)
+        '''
+        if not self.bench.connected():
+            self.replies.clear()
+            raise pyvisa.errors.VisaIOError(pyvisa.constants.VI_ERROR_CONN_LOST)
+
+    def command(self, cmd):
+        '''
+        Run a single SCPI command, storing the reply (if any)
+        '''
+        for pattern, handler in self.commands:
+            match = re.fullmatch(pattern, cmd)
+            if match:
+                self.bench.count("scope", cmd.split(" ")[0])
+                reply = handler(*match.groups())
+                if reply is not None:
+                    self.replies.append(reply)
+                return
+        raise ValueError(f"Simulated DS1054Z does not support '{cmd}'")
+
+    def idn(self):
+        return "RIGOL TECHNOLOGIES,DS1054Z,SIMULATED,00.04.04.SP4"
+
+    def set_display(self, n, state):
+        self.display[int(n)] = state in ("ON", "1")
+        self.reset_statistic()
+
+    def display_query(self, n):
+        return str(int(self.display[int(n)]))
+
+    def set_scale(self, n, volts_per_div):
+        self.scale[int(n)] = nearest_125(float(volts_per_div), 1e-3, 10)
+        self.reset_statistic()
+
+    def scale_query(self, n):
+        return f"{self.scale[int(n)]:e}"
+
+    def set_offset(self, n, offset):
+        self.offset[int(n)] = float(offset)
+        self.reset_statistic()
+
+    def offset_query(self, n):
+        return f"{self.offset[int(n)]:e}"
+
+    def set_timebase(self, seconds_per_div):
+        self.timebase = nearest_125(float(seconds_per_div), 5e-9, 50)
+        self.reset_statistic()
+
+    def timebase_query(self):
+        return f"{self.timebase:e}"
+
+    def set_trigger(self, item, value):
+        self.trigger[item] = float(value) if item == "LEVEL" else value
+
+    def trigger_query(self, item):
+        value = self.trigger[item]
+        return f"{value:e}" if item == "LEVEL" else value
+
+    def reset_statistic(self):
+        self.statistic_start = self.bench.clock.time()
+        self.current = {}
+
+    def acquisitions(self):
+        '''
+        Number of acquisitions contributing to the statistics, or
+        zero if the statistics are not ready yet
+        '''
+        start = max(self.statistic_start, self.bench.circuit_changed)
+        elapsed = self.bench.clock.time() - start
+        if elapsed < self.ready_delay:
+            return 0
+        return 1 + int(elapsed / self.acquisition_period)
+
+    def on_screen(self, n, vpp):
+        return self.display[n] and vpp < VERTICAL_DIVS * self.scale[n]
+
+    def statistic(self, kind, item, n1, n2 = None):
+        '''
+        Return a (noisy) measurement of VPP or RPHASE
+        '''
+        n1 = int(n1)
+        n2 = int(n2) if n2 is not None else None
+        count = self.acquisitions()
+        v = dict(zip((1, 2), self.bench.circuit.voltages()))
+        if count == 0 or n1 not in v or (n2 is not None and n2 not in v):
+            return f"{INVALID:e}"
+        lsb = {n: ADC_LSB_DIVS * self.scale[n] for n in v}
+        if item == "VPP":
+            vpp = abs(v[n1])
+            if not self.on_screen(n1, vpp):
+                return f"{INVALID:e}"
+            value = vpp
+            sigma = self.vpp_noise * vpp + lsb[n1]
+        else:
+            if not all(self.on_screen(n, abs(v[n])) for n in (n1, n2)):
+                return f"{INVALID:e}"
+            value = -np.degrees(np.angle(v[n2] / v[n1]))
+            resolution = max(lsb[n] / max(abs(v[n]), 1e-12) for n in (n1, n2))
+            sigma = self.phase_noise + np.degrees(min(resolution, 1))
+        if kind == "DEVIATION":
+            return f"{sigma:e}"
+        if kind == "AVERAGES":
+            sigma = sigma / np.sqrt(count)
+        elif kind == "CURRENT":
+            # The current value only changes with each acquisition
+            key = (item, n1, n2)
+            if key not in self.current or self.current[key][0] != count:
+                noise = sigma * self.bench.rng.standard_normal()
+                self.current[key] = (count, value + noise)
+            return f"{self.current[key][1]:e}"
+        return f"{value + sigma * self.bench.rng.standard_normal():e}"
+
+    def run(self):
+        self.running = True
+        self.single_start = None
+
+    def stop(self):
+        self.running = False
+
+    def single(self):
+        self.running = False
+        self.single_start = self.bench.clock.time()
+
+    def acquisition_end(self):
+        '''
+        Return the time a single acquisition finishes: after one
+        acquisition period since the generator output last changed
+        (or the past, if there is no single acquisition)
+        '''
+        if self.running or self.single_start is None:
+            return -np.inf
+        start = max(self.single_start, self.bench.circuit_changed)
+        return start + self.acquisition_period
+
+    def trigger_status(self):
+        '''
+        After :SINGLE, the status is WAIT until an acquisition has
+        been made after the generator output last changed
+        '''
+        if self.running:
+            return "RUN"
+        if self.bench.clock.time() < self.acquisition_end():
+            return "WAIT"
+        return "STOP"
+
+    def operation_complete(self):
+        '''
+        *OPC: set the operation complete bit of the event status
+        register once any single acquisition has finished
+        '''
+        self.opc_pending = True
+
+    def event_status(self):
+        '''
+        Return the event status register
+        '''
+        if self.opc_pending and self.bench.clock.time() >= self.acquisition_end():
+            self.opc_pending = False
+            self.event_status_register |= 0x01
+        return self.event_status_register
+
+    def event_status_query(self):
+        '''
+        *ESR?: read and clear the event status register
+        '''
+        status = self.event_status()
+        self.event_status_register = 0
+        return str(status)
+
+    def status_byte(self):
+        '''
+        Return the status byte: the event summary bit (0x20) is
+        set when an enabled event is set, and the request service
+        bit (0x40) when an enabled bit of the status byte is set
+        '''
+        stb = 0x20 if self.event_status() & self.event_enable else 0
+        return stb | (0x40 if stb & self.service_request_enable else 0)
+
+    def clear_status(self):
+        self.event_status_register = 0
+        self.opc_pending = False
+
+    def set_event_enable(self, mask):
+        self.event_enable = int(mask)
+
+    def set_service_request_enable(self, mask):
+        self.service_request_enable = int(mask)
+
+    def set_waveform_source(self, n):
+        self.waveform_source = int(n)
+
+    def set_waveform_mode(self, mode):
+        self.waveform_mode = mode
+
+    def set_waveform_format(self, format):
+        self.waveform_format = format
+
+    def set_waveform_range(self, item, point):
+        self.waveform_range[item] = int(point)
+
+    def set_memory_depth(self, points):
+        '''
+        Set the memory depth, which is shared between the channels
+        that are turned on
+        '''
+        if points != "AUTO":
+            channels = sum(self.display.values())
+            if int(points) * channels > MAX_MEMORY_DEPTH:
+                raise ValueError(f"Memory depth {points} is too deep for "
+                                 f"{channels} channels")
+            points = int(points)
+        self.memory_depth = points
+
+    def memory_depth_query(self):
+        return str(self.memory_depth)
+
+    def memory_points(self):
+        '''
+        Return the number of points in the acquisition memory
+        '''
+        return AUTO_MEMORY_DEPTH if self.memory_depth == "AUTO" else self.memory_depth
+
+    def preamble(self):
+        '''
+        Return the preamble fields of the current waveform source.
+        In RAW mode, the acquisition memory is centred on the
+        trigger, and sampled at the rate that fits it on the
+        screen (or the highest sample rate, if that is lower).
+        '''
+        n = self.waveform_source
+        yincrement = ADC_LSB_DIVS * self.scale[n]
+        if self.waveform_mode == "RAW":
+            points = self.memory_points()
+            channels = sum(self.display.values())
+            xincrement = max(self.timebase * HORIZONTAL_DIVS / points,
+                             channels / MAX_SAMPLE_RATE)
+        else:
+            points = SCREEN_POINTS
+            xincrement = self.timebase * HORIZONTAL_DIVS / SCREEN_POINTS
+        return {
+            "format": 0 if self.waveform_format == "BYTE" else 1,
+            "type": 2 if self.waveform_mode == "RAW" else 0,
+            "points": points, "count": 1,
+            "xincrement": xincrement, "xorigin": -xincrement * points / 2,
+            "xreference": 0, "yincrement": yincrement,
+            "yorigin": self.offset[n] / yincrement, "yreference": 127,
+        }
+
+    def waveform_preamble(self):
+        return ",".join(f"{value:g}" for value in self.preamble().values())
+
+    def waveform_data(self):
+        '''
+        Return the waveform of the source channel as a binary block.
+        In NORMAL mode, this is the screen waveform (in BYTE
+        format); in RAW mode, it is the points from START to STOP
+        of the acquisition memory (up to 250000 in BYTE format, or
+        125000 in WORD format). For a sine wave, the trigger (a
+        rising zero crossing on channel 1) is at the centre.
+        '''
+        n = self.waveform_source
+        if n > 2 or not self.display[n]:
+            return b"#9000000000"
+        p = self.preamble()
+        start, stop = 0, p["points"]
+        if self.waveform_mode == "RAW":
+            start = self.waveform_range["START"] - 1
+            stop = min(self.waveform_range["STOP"], p["points"])
+            limit = 250000 if self.waveform_format == "BYTE" else 125000
+            if start < 0 or stop - start > limit:
+                return b"#9000000000"
+        codes = self.samples(n, p, start, stop)
+        dtype = np.uint8 if self.waveform_format == "BYTE" else np.dtype("<u2")
+        data = codes.astype(dtype).tobytes()
+        return f"#9{len(data):09d}".encode() + data
+
+    def samples(self, n, p, start, stop):
+        '''
+        Return the ADC codes of the points from start to stop of the
+        waveform of channel n (with preamble p)
+        '''
+        f, *voltages = self.bench.circuit.components()
+        t = p["xorigin"] + np.arange(start, stop) * p["xincrement"]
+        phasors = voltages[n - 1] / 2
+        if len(f) == 1:
+            v_trigger = voltages[0][0]
+            phasors = -1j * phasors * abs(v_trigger) / v_trigger
+        v = np.real(phasors @ np.exp(2j*np.pi*np.outer(f, t)))
+        noise = self.sample_noise * self.scale[n]
+        v += noise * self.bench.rng.standard_normal(len(t))
+        codes = np.round(v / p["yincrement"] + p["yorigin"] + p["yreference"])
+        return np.clip(codes, 0, 255)
+
+class SimBench:
+    '''
+    A simulated circuit with an FY6600 and DS1054Z attached. The
+    bench counts every command sent to either instrument (see
+    count() and total_commands()), and the number of messages
+    (round trips) sent to each instrument in messages. Use generator() and scope() to
+    make driver objects that can be passed to FrequencyResponse.
+    The instruments can be disconnected for a while with unplug().
+    '''
+    def __init__(self, circuit = None, clock = None, seed = None):
+        self.circuit = circuit if circuit is not None else SimCircuit()
+        self.clock = clock if clock is not None else SimClock()
+        self.rng = np.random.default_rng(seed)
+        self.circuit_changed = self.clock.time()
+        self.commands = Counter()
+        self.messages = Counter()
+        self.unplugged_until = None
+
+    def count(self, instrument, header):
+        '''
+        Record a command sent to an instrument
+        '''
+        self.commands[(instrument, header)] += 1
+
+    def total_commands(self, instrument = None):
+        '''
+        Return the total number of commands sent to the instrument
+        ("gen" or "scope"), or to both if instrument is None.
+        '''
+        return sum(count for (name, header), count in self.commands.items()
+                   if instrument is None or name == instrument)
+
+    def unplug(self, seconds):
+        '''
+        Disconnect both instruments for a number of seconds (as if
+        the USB connections had dropped out)
+        '''
+        self.unplugged_until = self.clock.time() + seconds
+
+    def connected(self):
+        '''
+        Return True unless the instruments are unplugged
+        '''
+        return self.unplugged_until is None or \
+            self.clock.time() >= self.unplugged_until
+
+    def reopen(self, connection):
+        '''
+        Reopen a simulated connection (which fails while unplugged)
+        '''
+        if not self.connected():
+            raise OSError("Simulated instrument not found")
+        return connection
+
+    def reconnecting(self, connection, reconnect):
+        '''
+        Wrap a simulated connection in Reconnecting (see
+        discovery.py) if reconnect is True
+        '''
+        if not reconnect:
+            return connection
+        return Reconnecting(connection, lambda: self.reopen(connection),
+                            interval = 0.1)
+
+    def generator(self, reconnect = False, **kwargs):
+        '''
+        Make an FY6600 connected to the simulated circuit. If
+        reconnect is True, the FY6600 reconnects after unplug(),
+        like a real one. Keyword arguments are passed to SimSerial.
+        '''
+        ser = SimSerial(self, **kwargs)
+        return FY6600(ser = self.reconnecting(ser, reconnect))
+
+    def scope(self, timeout_seconds = 1, reconnect = False, **kwargs):
+        '''
+        Make a DS1054Z connected to the simulated circuit. If
+        reconnect is True, the DS1054Z reconnects after unplug(),
+        like a real one. Keyword arguments are passed to SimScope.
+        '''
+        dev = SimScope(self, **kwargs)
+        return DS1054Z(timeout_seconds, dev = self.reconnecting(dev, reconnect))
@@ -0,0 +1,296 @@
+# Binary store of sweep results
+#
+# A store is a directory holding many sweeps, for analysing
+# campaigns of repeated sweeps on several benches without parsing
+# CSV files:
+#
+#   results.store/
+#     index.json      the columns and their types, and for each sweep
+#                     its id, name, rows and metadata
+#     f.bin           one file per column: the values of all the
+#     v_in.bin ...    sweeps, one after another (little-endian)
+#
+# The column files are memory-mapped, so loading a sweep returns
+# views of the mapped files without copying or parsing anything,
+# and loading thousands of sweeps takes milliseconds:
+#
+#   store = ResultStore("results.store")
+#   sweep = store.import_csv("meas.csv", metadata = {"circuit": {...}})
+#   data, metadata = store.load(sweep)       # dictionary of arrays
+#   store.export_csv(sweep, "copy.csv")      # the same as meas.csv
+#
+# Sweeps are appended by writing their values to the end of the
+# column files, then replacing index.json, so an interrupted
+# append leaves the store as it was (the extra values are
+# overwritten by the next append). Only one process should write
+# to a store at a time; any number can read it.
+#
+import json
+import os
+import re
+from pathlib import Path
+import numpy as np
+from results import read_arrays, read_text
+
+# Name of the index file of a store
+INDEX_FILE = "index.json"
+
+# Value stored in float columns for rows of sweeps without that
+# column (and missing values of integer columns)
+MISSING = {"f": np.nan, "i": -1}
+
+class ResultStore:
+    '''
+    A directory of sweeps (see above), which is created if it does
+    not exist
+    '''
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents = True, exist_ok = True)
+        self.maps = {}
+        self.read_index()
+
+    def read_index(self):
+        '''
+        Read the index of the store (again, if another process may
+        have added sweeps)
+        '''
+        index_path = self.path / INDEX_FILE
+        if index_path.is_file():
+            index = json.loads(index_path.read_text())
+        else:
+            index = {"rows": 0, "columns": {}, "sweeps": []}
+        self.rows = index["rows"]
+        self.columns = index["columns"]
+        self.index = index["sweeps"]
+        self.by_id = {sweep["id"]: sweep for sweep in self.index}
+        self.maps = {}
+
+    def write_index(self):
+        '''
+        Replace the index file (atomically, so that readers never
+        see a partly written index)
+        '''
+        index = {"rows": self.rows, "columns": self.columns, "sweeps": self.index}
+        temporary = self.path / (INDEX_FILE + ".tmp")
+        with open(temporary, "w") as f:
+            json.dump(index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path / INDEX_FILE)
+
+    def column_path(self, name):
+        return self.path / f"{name}.bin"
+
+    def column(self, name):
+        '''
+        Return all the values of a column (of every sweep), as a
+        read-only array mapped from its file
+        '''
+        if name not in self.maps:
+            dtype = np.dtype(self.columns[name])
+            if self.rows == 0:
+                self.maps[name] = np.empty(0, dtype)
+            else:
+                self.maps[name] = np.asarray(np.memmap(
+                    self.column_path(name), dtype = dtype, mode = "r",
+                    shape = (self.rows,)))
+        return self.maps[name]
+
+    def sweeps(self, **match):
+        '''
+        Return the index entries of the sweeps (dictionaries of the
+        id, name, start and number of rows, columns and metadata),
+        in the order they were added. Keyword arguments select the
+        sweeps whose metadata have those values, as in
+        sweeps(oscilloscope = "RIGOL ...", measurement = "waveform").
+        '''
+        return [sweep for sweep in self.index
+                if all(sweep["metadata"].get(key) == value
+                       for key, value in match.items())]
+
+    def sweep(self, key):
+        '''
+        Return the index entry of a sweep, given its id or name (or
+        a negative number, counting back from the last sweep). Ids
+        may be given as strings, as on the command line.
+        '''
+        if isinstance(key, str) and re.fullmatch(r"-?\d+", key):
+            key = int(key)
+        if isinstance(key, int) and key < 0:
+            if -key > len(self.index):
+                raise ValueError(f"The store has {len(self.index)} sweeps")
+            return self.index[key]
+        if key in self.by_id:
+            return self.by_id[key]
+        for sweep in reversed(self.index):
+            if sweep["name"] == key:
+                return sweep
+        raise ValueError(f"No sweep '{key}' in {self.path}")
+
+    def load(self, key):
+        '''
+        Return the data of a sweep (a dictionary mapping each of its
+        columns to a read-only array) and its metadata
+        '''
+        sweep = self.sweep(key)
+        start, stop = sweep["start"], sweep["start"] + sweep["rows"]
+        data = {name: self.column(name)[start:stop] for name in sweep["columns"]}
+        return data, sweep["metadata"]
+
+    def load_many(self, keys = None):
+        '''
+        Return a list of the data and metadata (as load()) of the
+        sweeps in keys (by default, all of them)
+        '''
+        sweeps = self.index if keys is None else [self.sweep(key) for key in keys]
+        columns = {name: self.column(name) for name in self.columns}
+        return [({name: columns[name][sweep["start"]:sweep["start"] + sweep["rows"]]
+                  for name in sweep["columns"]}, sweep["metadata"])
+                for sweep in sweeps]
+
+    def add(self, data, metadata = None, name = None):
+        '''
+        Add a sweep (a dictionary, or data frame, of equal-length
+        columns), with a dictionary of its metadata (which must be
+        JSON serialisable), and return its id. The name defaults to
+        the start time in the metadata (or the id).
+        '''
+        return self.add_many([(data, metadata, name)])[0]
+
+    def add_many(self, sweeps):
+        '''
+        Add several sweeps at once (a list of (data, metadata, name)
+        tuples, as the arguments of add(), optionally followed by a
+        dictionary describing the file the sweep was imported from),
+        and return their ids. This is much faster than adding them
+        one at a time, as the files are only written once.
+        '''
+        entries, arrays = [], []
+        rows = self.rows
+        id = max(self.by_id, default = -1) + 1
+        for data, metadata, name, *source in sweeps:
+            columns = {str(column): np.asarray(values)
+                       for column, values in data.items()}
+            lengths = {len(values) for values in columns.values()}
+            if len(lengths) > 1:
+                raise ValueError("The columns of a sweep must have the same length")
+            length = lengths.pop() if lengths else 0
+            for column, values in columns.items():
+                if not re.fullmatch(r"\w+", column):
+                    raise ValueError(f"Invalid column name '{column}'")
+                if values.dtype.kind not in "iubf":
+                    raise ValueError(f"Column '{column}' is not numeric")
+                kind = "i" if values.dtype.kind in "iub" else "f"
+                if column not in self.columns:
+                    self.add_column(column, kind)
+                elif np.dtype(self.columns[column]).kind == "i" and kind == "f":
+                    raise ValueError(f"Column '{column}' is stored as integers")
+            metadata = dict(metadata or {})
+            entry = {"id": id, "name": str(name or metadata.get("started", id)),
+                     "start": rows, "rows": length,
+                     "columns": list(columns), "metadata": metadata}
+            if source:
+                entry["source"] = source[0]
+            entries.append(entry)
+            arrays.append(columns)
+            rows += length
+            id += 1
+
+        # Write every column (missing ones as MISSING), starting at
+        # the end of the rows in the index
+        for column, dtype in self.columns.items():
+            dtype = np.dtype(dtype)
+            values = [columns[column] if column in columns
+                      else np.full(entry["rows"], MISSING[dtype.kind])
+                      for entry, columns in zip(entries, arrays)]
+            with open(self.column_path(column), "r+b") as f:
+                f.seek(self.rows * dtype.itemsize)
+                f.truncate()
+                if values:
+                    f.write(np.concatenate(values).astype(dtype).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        for entry in entries:
+            self.index.append(entry)
+            self.by_id[entry["id"]] = entry
+        self.rows = rows
+        self.maps = {}
+        self.write_index()
+        return [entry["id"] for entry in entries]
+
+    def add_column(self, column, kind):
+        '''
+        Add a column file, filled with MISSING for the rows of the
+        sweeps already in the store
+        '''
+        dtype = np.dtype("<f8" if kind == "f" else "<i8")
+        with open(self.column_path(column), "wb") as f:
+            f.write(np.full(self.rows, MISSING[kind], dtype).tobytes())
+        self.columns[column] = dtype.str
+
+    def import_csv(self, path, metadata = None, name = None):
+        '''
+        Add a results file (see results.py), with its metadata and
+        any extra metadata given, and return the id of the sweep.
+        A file that has already been imported, and not changed
+        since, is not added again (its id is returned).
+        '''
+        return self.import_files([path], metadata, name)[0]
+
+    def import_files(self, paths, metadata = None, name = None):
+        '''
+        Import several results files (as import_csv()), and return
+        the ids of their sweeps. Each sweep is named after its file,
+        unless name is given.
+        '''
+        imported = {json.dumps(sweep["source"]): sweep["id"]
+                    for sweep in self.index if "source" in sweep}
+        ids, sweeps = [], []
+        for path in map(Path, paths):
+            stat = path.stat()
+            source = {"path": str(path.resolve()), "size": stat.st_size,
+                      "mtime": stat.st_mtime}
+            if json.dumps(source) in imported:
+                ids.append(imported[json.dumps(source)])
+                continue
+            data, file_metadata = read_arrays(path)
+            # The index column is only kept if it is not 0, 1, 2, ...
+            lines = [line for line in read_text(path)[0].splitlines()
+                     if not line.startswith("#")]
+            index = np.array([int(line.split(",", 1)[0]) for line in lines[1:]],
+                             dtype = int)
+            if not np.array_equal(index, np.arange(len(index))):
+                data = {"index": index, **data}
+            ids.append(None)
+            sweeps.append((data, {**file_metadata, **(metadata or {})},
+                           name or path.stem, source))
+        added = iter(self.add_many(sweeps))
+        return [next(added) if id is None else id for id in ids]
+
+    def export_csv(self, key, path):
+        '''
+        Write a sweep to a results file, in the format of
+        results.py (with the metadata of the sweep)
+        '''
+        data, metadata = self.load(key)
+        columns = [column for column in data if column != "index"]
+        rows = len(next(iter(data.values()))) if data else 0
+        index = data.get("index", range(rows))
+        with open(path, "w") as f:
+            for name, value in metadata.items():
+                f.write(f"# {name}: {json.dumps(value)}\n")
+            f.write("," + ",".join(columns) + "\n")
+            for n in range(rows):
+                values = [repr(float(data[column][n])) for column in columns]
+                f.write(",".join([str(index[n]), *values]) + "\n")
+
+def read_sweep(path, sweep = -1):
+    '''
+    Return the data (a dictionary of arrays) and metadata of a
+    results file, or of a sweep in a store (by default, the last)
+    '''
+    if Path(path).is_dir():
+        return ResultStore(path).load(sweep)
+    return read_arrays(path)
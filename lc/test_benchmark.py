@@ -0,0 +1,20 @@
+# Tests that the benchmarks (see benchmark.py) run, on small grids
+#
+#   python3 -m pytest test_benchmark.py
+#
+import argparse
+import pytest
+from benchmark import BENCHMARKS, run_benchmark
+
+@pytest.mark.parametrize("name", list(BENCHMARKS))
+@pytest.mark.parametrize("points", [2, 4])
+def test_benchmark(name, points):
+    '''
+    Each benchmark measures every point of a coarse sweep, where
+    the amplitude changes a lot from one point to the next
+    '''
+    args = argparse.Namespace(points = points, f_low = 1e3, f_high = 6e7, vin = 0.4,
+                              speedup = 1000, seed = 0, memory_depth = 120000,
+                              chunk_points = None, top = 5, profile = False)
+    result = run_benchmark(name, args)
+    assert result["points"] > 0
@@ -0,0 +1,44 @@
+# Tests of the Gummel-Poon transistor model in bjt.py:
+#
+#   python3 -m pytest test_bjt.py
+#
+import numpy as np
+import pytest
+from bjt import BJT
+
+# Parameters like those of a 2N3904 (with high injection and the
+# Early effect)
+MODEL = BJT({"is": 6.7e-15, "bf": 416, "br": 0.74, "vaf": 74, "ikf": 0.067,
+             "ise": 6.7e-15, "ne": 1.26, "cje": 4.5e-12, "mje": 0.26,
+             "cjc": 3.6e-12, "mjc": 0.3, "tf": 3e-10, "tr": 2.4e-7})
+
+VOLTAGES = [(0.6, -5.0), (0.75, -2.0), (0.85, 0.3), (-0.5, -5.0)]
+
+@pytest.mark.parametrize("vbe, vbc", VOLTAGES)
+def test_capacitances(vbe, vbc):
+    '''
+    The capacitances are the derivatives of the charges
+    '''
+    h = 1e-7
+    q_be, q_bc, c_be, c_bc, c_x = MODEL.charges(vbe, vbc)
+    d_vbe = (np.array(MODEL.charges(vbe + h, vbc)[:2])
+             - MODEL.charges(vbe - h, vbc)[:2]) / (2 * h)
+    d_vbc = (np.array(MODEL.charges(vbe, vbc + h)[:2])
+             - MODEL.charges(vbe, vbc - h)[:2]) / (2 * h)
+    scale = abs(c_be) + abs(c_bc)
+    assert d_vbe[0] == pytest.approx(c_be, abs = 1e-6 * scale)
+    assert d_vbc[1] == pytest.approx(c_bc, abs = 1e-6 * scale)
+    assert d_vbc[0] == pytest.approx(c_x, abs = 1e-6 * scale)
+
+def test_high_injection():
+    '''
+    The forward diffusion charge is TF*If/qb, so it falls below
+    TF*If at high injection
+    '''
+    vbe, vbc = 0.85, -2.0
+    i_f, _, _, _, qb, _, _ = MODEL.currents(vbe, vbc)[3]
+    q_depletion = MODEL.depletion(vbe, MODEL.p["cje"], MODEL.p["vje"],
+                                  MODEL.p["mje"])[0]
+    assert qb > 2
+    assert MODEL.charges(vbe, vbc)[0] - q_depletion == pytest.approx(
+        MODEL.p["tf"] * i_f / qb)
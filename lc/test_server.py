@@ -0,0 +1,71 @@
+# Tests of the bench server (see server.py), with simulated
+# instruments (see sim.py):
+#
+#   python3 -m pytest test_server.py
+#
+import threading
+from time import sleep
+import pytest
+from benchmark import simulated_sleep
+from server import JOB, BenchClient, BenchServer, connectable
+from sim import SimBench, SimClock
+
+@pytest.fixture
+def bench_server(tmp_path):
+    '''
+    Run a bench server with simulated instruments (on a fast
+    simulated clock) in a thread, and return its client
+    '''
+    bench = SimBench(clock = SimClock(speedup = 1000), seed = 1)
+    path = tmp_path / "bench.sock"
+    with simulated_sleep(bench.clock):
+        server = BenchServer(path, bench.generator(), bench.scope())
+        thread = threading.Thread(target = server.serve_forever, daemon = True)
+        thread.start()
+        for n in range(100):
+            if path.exists() and connectable(path):
+                break
+            sleep(0.01)
+        client = BenchClient(path)
+        yield client
+        client.stop()
+        thread.join(timeout = 10)
+    assert not thread.is_alive()
+    assert not path.exists()
+
+def test_sweep(bench_server, tmp_path):
+    '''
+    A job runs to the end, passing every point to on_point, and the
+    results are read back from its savefile
+    '''
+    savefile = tmp_path / "meas.csv"
+    points = []
+    df = bench_server.run({"f_low": 1e5, "f_high": 1e6, "steps": 3,
+                           "savefile": str(savefile), "calibration": ""},
+                          on_point = points.append)
+    assert len(df) == 3 and len(points) == 3
+    assert savefile.exists()
+    status = bench_server.status()
+    assert status["completed"] == 1
+    assert status["running"] is None and status["queued"] == []
+
+def test_status_has_defaults(bench_server, tmp_path):
+    '''
+    The status of a running job includes the defaults of the
+    settings that the client left out
+    '''
+    statuses = []
+    bench_server.run({"steps": 2, "savefile": str(tmp_path / "meas.csv"),
+                      "calibration": "", "measurement": "waveform"},
+                     on_point = lambda row: statuses.append(bench_server.status()))
+    running = statuses[0]["running"]
+    assert running["job"] == 1 and running["steps"] == 2
+    assert running["f_low"] == JOB["f_low"]
+    assert "f_high" in running and "vin" in running
+
+def test_invalid_job(bench_server):
+    '''
+    A job with unknown settings is refused
+    '''
+    with pytest.raises(RuntimeError, match = "Unknown job settings"):
+        bench_server.run({"points": 3})
@@ -0,0 +1,81 @@
+# Tests of the convergence-based averaging in settling.py, on a
+# fake clock:
+#
+#   python3 -m pytest test_settling.py
+#
+import numpy as np
+import pytest
+import settling
+
+class FakeClock:
+    '''
+    Clock which only moves on when sleep() is called
+    '''
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(settling, "monotonic", clock.monotonic)
+    monkeypatch.setattr(settling, "sleep", clock.sleep)
+    return clock
+
+def invalid():
+    raise RuntimeError("Invalid reading")
+
+def test_converges(clock):
+    '''
+    Quiet readings converge after a few samples
+    '''
+    readings = iter([1.0, 1.001, 0.999, 1.0, 1.001])
+    mean, ci = settling.converge(lambda: next(readings), 0.01)
+    assert mean == pytest.approx(1.0, abs = 1e-3) and ci < 0.01
+    assert clock.now == pytest.approx(0.15)
+
+def test_invalid_readings_timeout(clock):
+    '''
+    With no valid readings, RuntimeError is raised after timeout
+    '''
+    with pytest.raises(RuntimeError):
+        settling.converge(invalid, 0.1, timeout = 10)
+    assert clock.now == pytest.approx(10, abs = 0.1)
+
+def test_invalid_readings_deadline(clock):
+    '''
+    The deadline also ends the wait for the first valid readings
+    '''
+    with pytest.raises(RuntimeError):
+        settling.converge(invalid, 0.1, timeout = 10, deadline = 1.0)
+    assert clock.now == pytest.approx(1.0, abs = 0.1)
+
+def test_too_few_readings_deadline(clock):
+    '''
+    If there are too few valid readings at the deadline, their mean
+    is returned, with an infinite confidence interval
+    '''
+    readings = iter([2.0] + [None] * 1000)
+    def read():
+        value = next(readings)
+        if value is None:
+            raise RuntimeError("Invalid reading")
+        return value
+    mean, ci = settling.converge(read, 0.1, timeout = 10, deadline = 1.0)
+    assert mean == 2.0 and np.isinf(ci)
+    assert clock.now == pytest.approx(1.0, abs = 0.1)
+
+def test_noisy_readings_deadline(clock):
+    '''
+    Noisy readings are averaged until the deadline
+    '''
+    rng = np.random.default_rng(0)
+    mean, ci = settling.converge(lambda: rng.normal(1, 1), 0.001,
+                                 timeout = 10, deadline = 2.0)
+    assert clock.now == pytest.approx(2.0, abs = 0.1)
+    assert abs(mean - 1) < 3 * ci
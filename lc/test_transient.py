@@ -0,0 +1,74 @@
+# Tests of the transient analysis of netlists (see transient.py):
+#
+#   python3 -m pytest test_transient.py
+#
+import numpy as np
+import pytest
+import transient
+from mna import Circuit
+from netlist import read_netlist
+
+# Parallel LC tank (5.03 kHz) fed through a resistor, and an RC
+# circuit driven by a step
+TANK = '''LC tank
+V1 1 0 dc 1
+R1 1 2 1k
+L1 2 0 1m
+C1 2 0 1u
+.end
+'''
+RC = '''RC step
+V1 1 0 pulse(0 1 0 1n 1n 1 2)
+R1 1 2 1k
+C1 2 0 1u
+.end
+'''
+
+def write(tmp_path, text, name = "circuit.net"):
+    path = tmp_path / name
+    path.write_text(text)
+    return path
+
+def test_rc_step(tmp_path):
+    '''
+    The step response of an RC circuit is 1 - exp(-t/RC)
+    '''
+    circuit = Circuit(read_netlist(write(tmp_path, RC)))
+    result = transient.transient(circuit, 5e-3, 2e-5, uic = True)
+    expected = 1 - np.exp(-result.t / 1e-3)
+    assert np.abs(result.voltage("2") - expected).max() < 2e-3
+
+def test_tank_frequency(tmp_path):
+    '''
+    A kicked LC tank rings at its resonant frequency
+    '''
+    rows = transient.simulate(write(tmp_path, TANK), [{}, {"C1": 4e-6}], 4e-3, "2",
+                              max_step = 2e-6)
+    f = 1 / (2*np.pi * np.sqrt(1e-3 * np.array([1e-6, 4e-6])))
+    assert [row["frequency"] for row in rows] == pytest.approx(f, rel = 0.01)
+
+def test_simulate_fallback(tmp_path, monkeypatch):
+    '''
+    If a batch fails, the variants are simulated one at a time, and
+    only the one that fails has NaN measurements and an error
+    '''
+    batch = transient.transient_batch
+    def failing(circuits, *args, **kwargs):
+        if len(circuits) > 1 or circuits[0].netlist.elements["C1"].value == 4e-6:
+            raise RuntimeError("Time step too small")
+        return batch(circuits, *args, **kwargs)
+    monkeypatch.setattr(transient, "transient_batch", failing)
+    rows = transient.simulate(write(tmp_path, TANK), [{}, {"C1": 4e-6}], 4e-3, "2",
+                              max_step = 2e-6)
+    assert rows[0]["frequency"] == pytest.approx(5033, rel = 0.01)
+    assert "error" not in rows[0]
+    assert np.isnan(rows[1]["frequency"]) and rows[1]["error"] == "Time step too small"
+
+def test_breakpoints():
+    '''
+    The corners of sin and exp sources are at their delays
+    '''
+    assert list(transient.breakpoints("sin", [0, 1, 2e-4], 1e-6, 1e-3)) == []
+    assert list(transient.breakpoints("sin", [0, 1, 2e-4, 3e-4], 1e-6, 1e-3)) == [3e-4]
+    assert list(transient.breakpoints("exp", [0, 1, 1e-4, 1e-5, 5e-4, 1e-5],
+                                      1e-6, 1e-3)) == [1e-4, 5e-4]
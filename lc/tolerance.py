@@ -0,0 +1,266 @@
+# Monte Carlo tolerance analysis of the LC circuit
+#
+# The component tester measured L = 30 uH and C = 303 pF (the
+# target was 330 pF). How far could the true values be from these,
+# and where could the resonance land relative to the station's
+# channel? monte_carlo() draws n sets of component values from
+# their tolerance distributions, and evaluates the response of all
+# of them at every frequency of a grid at once (the model of
+# fit.response(), broadcast over arrays of component values). The
+# sets are evaluated in chunks, so memory use is bounded however
+# many are drawn (10^5 sets take about 20 s). The result has:
+#
+# * the resonant frequency of each set (the frequency of the notch
+#   in |Vout/Vin|, found on a fine grid around 1/(2 pi sqrt(LC)))
+# * bands of |Vout/Vin| and its phase at each frequency (quantiles
+#   of the sets, accumulated in histograms relative to the nominal
+#   response), which plot_response() draws around the model curves
+# * the sensitivity of the resonant frequency to each component
+#   (by regression over the sets), and of the response at any
+#   frequency (from the derivatives of the model)
+#
+#   result = monte_carlo(config["circuit"], {"L": 0.05, "C": 0.1}, n = 100000)
+#   print(result.summary(channel = (1566e3, 10e3)))
+#   plot_response(config, tolerance = result)
+#
+import numpy as np
+from config import DEFAULTS
+from fit import PARASITICS, response
+
+# Relative tolerances of the components (the tolerance is the
+# half-width of a uniform distribution, or three standard
+# deviations of a normal distribution)
+TOLERANCES = {name: DEFAULTS["tolerance"][name] for name in ["L", "C", "R", "Rs"]}
+
+# Largest number of (set, frequency) elements evaluated at once
+CHUNK_ELEMENTS = 2**22
+
+# Quantiles of the bands
+QUANTILES = [0.025, 0.16, 0.5, 0.84, 0.975]
+
+# Histogram bins of the magnitude (relative to the nominal, in dB)
+# and of the phase (relative to the nominal, in degrees) at each
+# frequency. Values outside the range count in the end bins.
+DB_RANGE = 40
+DB_BIN = 0.05
+PHASE_BIN = 0.1
+
+# Relative half-width and number of points of the grid around
+# 1/(2 pi sqrt(LC)) searched for the notch of each set
+NOTCH_SPAN = 0.01
+NOTCH_POINTS = 201
+
+def default_frequencies(circuit, points = 1000):
+    '''
+    Return the default frequency grid: points frequencies from 1 kHz
+    to 100 MHz, and points / 2 more within 10% of the resonant
+    frequency of the circuit
+    '''
+    fc = 1 / (2*np.pi*np.sqrt(circuit["L"] * circuit["C"]))
+    return np.union1d(np.geomspace(1e3, 1e8, points),
+                      np.geomspace(0.9 * fc, 1.1 * fc, points // 2))
+
+def draw(nominal, tolerances, n, distribution = "uniform", rng = None):
+    '''
+    Return n sets of component values (a dictionary of arrays),
+    drawn from the distribution ("uniform" or "normal") around the
+    nominal values, with the relative tolerances given (components
+    without a tolerance keep their nominal values)
+    '''
+    rng = rng if rng is not None else np.random.default_rng()
+    samples = {}
+    for name, value in nominal.items():
+        tolerance = tolerances.get(name, 0)
+        if not 0 <= tolerance < 1:
+            raise ValueError(f"The tolerance of {name} must be from 0 to 1")
+        if distribution == "uniform":
+            deviation = rng.uniform(-1, 1, n)
+        elif distribution == "normal":
+            deviation = np.clip(rng.standard_normal(n) / 3, -0.99 / tolerance
+                                if tolerance else -1, None)
+        else:
+            raise ValueError(f"Unknown distribution '{distribution}'")
+        samples[name] = value * (1 + tolerance * deviation)
+    return samples
+
+def log_response(f, L, C, R, Rs):
+    '''
+    Return log|Vout/Vin| and the phase of Vout/Vin (in radians) at
+    frequencies f for component values L, C, R and Rs (which
+    broadcast together). This is the model of fit.response() without
+    the probe parasitics, which is much quicker to evaluate for
+    many sets of components, in real arithmetic: with w = 2 pi f,
+    Vout/Vin = Rs M / (Rs M + R + jwL), where M = 1 - w^2 LC + jwRC.
+    '''
+    w = 2*np.pi*f
+    a = 1 - w*w*L*C
+    b = w*R*C
+    c = Rs*a + R
+    d = w*(Rs*R*C + L)
+    log_h = np.log(Rs) + 0.5 * np.log((a*a + b*b) / (c*c + d*d))
+    return log_h, np.arctan2(b, a) - np.arctan2(d, c)
+
+def notch_frequencies(L, C, R, Rs):
+    '''
+    Return the frequency of the minimum of |Vout/Vin| for each set of
+    component values (arrays), searching a grid around the resonant
+    frequency of each and interpolating between the grid points
+    '''
+    fc = 1 / (2*np.pi*np.sqrt(L * C))
+    offsets = np.linspace(-NOTCH_SPAN, NOTCH_SPAN, NOTCH_POINTS)
+    y = log_response(fc[:, None] * (1 + offsets), L[:, None], C[:, None],
+                     R[:, None], Rs[:, None])[0]
+    k = np.clip(y.argmin(axis = 1), 1, NOTCH_POINTS - 2)
+    rows = np.arange(len(k))
+    y0, y1, y2 = y[rows, k - 1], y[rows, k], y[rows, k + 1]
+    # Vertex of the parabola through the three points
+    curvature = y0 - 2*y1 + y2
+    shift = np.where(curvature > 0, 0.5 * (y0 - y2) / np.where(curvature > 0, curvature, 1), 0)
+    return fc * (1 + offsets[k] + shift * (offsets[1] - offsets[0]))
+
+class ToleranceResult:
+    '''
+    The result of monte_carlo(): the frequencies f, the nominal
+    component values and response (h_nominal, Vout/Vin), the
+    component values of each set (samples, a dictionary of arrays)
+    and its resonant frequency (resonance), and at each frequency,
+    the quantiles of |Vout/Vin| and of its phase in degrees
+    (magnitude and phase, dictionaries keyed by quantile) and the
+    lowest and highest |Vout/Vin| of any set (magnitude_range)
+    '''
+    def __init__(self, f, nominal, h_nominal, samples, resonance,
+                 magnitude, phase, magnitude_range):
+        self.f = f
+        self.nominal = nominal
+        self.h_nominal = h_nominal
+        self.samples = samples
+        self.resonance = resonance
+        self.magnitude = magnitude
+        self.phase = phase
+        self.magnitude_range = magnitude_range
+
+    def sensitivities(self):
+        '''
+        Return the sensitivity of the resonant frequency to each
+        component with a tolerance: a dictionary mapping its name
+        to the slope d log(f_res) / d log(value) (from a linear
+        regression over the sets; -0.5 for L and C), and the
+        fraction of the variance of log(f_res) it explains
+        '''
+        names = [name for name, values in self.samples.items()
+                 if np.ptp(values) > 0]
+        X = np.stack([np.log(self.samples[name]) for name in names], axis = 1)
+        X -= X.mean(axis = 0)
+        y = np.log(self.resonance)
+        y = y - y.mean()
+        slopes = np.linalg.lstsq(X, y, rcond = None)[0]
+        variance = max(y.var(), np.finfo(float).tiny)
+        return {name: {"slope": slope, "share": slope**2 * X[:, n].var() / variance}
+                for n, (name, slope) in enumerate(zip(names, slopes))}
+
+    def local_sensitivities(self, f):
+        '''
+        Return the changes of |Vout/Vin| (in dB) and of its phase (in
+        degrees) at frequency f for a 1% increase of each component
+        (from the derivatives of the model at the nominal values)
+        '''
+        names = [name for name in self.samples if name in self.nominal]
+        d_log_h = response(np.array([f]), self.nominal, names = names)[2]
+        return {name: {"dB": 0.01 * 20 / np.log(10) * d_log_h[name][0].real,
+                       "degrees": 0.01 * np.degrees(d_log_h[name][0].imag)}
+                for name in names}
+
+    def summary(self, channel = None):
+        '''
+        Return a text summary of the resonant frequencies and the
+        sensitivities. If channel (the centre frequency and the
+        bandwidth of a channel, in Hz) is given, the fraction of
+        the sets that resonate within the channel is included, and
+        the local sensitivities at its centre.
+        '''
+        r = self.resonance / 1e3
+        low, median, high = np.quantile(r, [0.025, 0.5, 0.975])
+        lines = [f"{len(r)} component sets",
+                 f"Resonant frequency: mean {r.mean():.2f} kHz, standard "
+                 f"deviation {r.std():.2f} kHz, median {median:.2f} kHz",
+                 f"  95% of the sets between {low:.2f} and {high:.2f} kHz"]
+        if channel is not None:
+            centre, bandwidth = channel
+            inside = abs(self.resonance - centre) <= bandwidth / 2
+            lines.append(f"  {inside.mean():.1%} within the channel at "
+                         f"{centre / 1e3:g} +/- {bandwidth / 2e3:g} kHz")
+        lines.append("Sensitivity of the resonant frequency (d log f / d log x, "
+                     "share of variance):")
+        for name, s in self.sensitivities().items():
+            lines.append(f"  {name:3s} {s['slope']:+.3f}  {s['share']:.1%}")
+        if channel is not None:
+            lines.append(f"Change of Vout/Vin at {channel[0] / 1e3:g} kHz for "
+                         "a 1% increase:")
+            for name, s in self.local_sensitivities(channel[0]).items():
+                lines.append(f"  {name:3s} {s['dB']:+.3f} dB  {s['degrees']:+.3f} deg")
+        return "\n".join(lines)
+
+def quantiles(counts, n, q, low, width):
+    '''
+    Return the values of quantile q at each row of histograms
+    counts (of n values each, in bins of width starting at low)
+    '''
+    index = (np.cumsum(counts, axis = 1) >= q * n).argmax(axis = 1)
+    return low + (index + 0.5) * width
+
+def monte_carlo(circuit, tolerances = TOLERANCES, n = 10000, f = None,
+                distribution = "uniform", seed = None,
+                chunk_elements = CHUNK_ELEMENTS):
+    '''
+    Draw n sets of the components L, C, R and Rs of the circuit (a
+    dictionary of their nominal values) with the given relative
+    tolerances (see draw()), evaluate the response of each set at
+    the frequencies f (by default, default_frequencies()), and
+    return a ToleranceResult. The sets are evaluated in chunks of
+    at most chunk_elements (set, frequency) pairs.
+    '''
+    nominal = {name: float(circuit[name]) for name in ["L", "C", "R", "Rs"]}
+    f = default_frequencies(nominal) if f is None else np.asarray(f, dtype = float)
+    rng = np.random.default_rng(seed)
+    samples = draw(nominal, tolerances, n, distribution, rng)
+    log_nominal, phase_nominal = log_response(f, **nominal)
+
+    m = len(f)
+    db_bins = int(round(2 * DB_RANGE / DB_BIN))
+    phase_bins = int(round(360 / PHASE_BIN))
+    db_counts = np.zeros(m * db_bins, dtype = np.int64)
+    phase_counts = np.zeros(m * phase_bins, dtype = np.int64)
+    lowest = np.full(m, np.inf)
+    highest = np.full(m, -np.inf)
+    resonance = np.empty(n)
+    offsets = np.arange(m)[None, :]
+    chunk = max(chunk_elements // m, 1)
+    for start in range(0, n, chunk):
+        p = {name: values[start:start + chunk] for name, values in samples.items()}
+        resonance[start:start + chunk] = notch_frequencies(**p)
+        log_h, phase = log_response(f, **{name: values[:, None]
+                                          for name, values in p.items()})
+        db = 20 / np.log(10) * (log_h - log_nominal)
+        lowest = np.minimum(lowest, db.min(axis = 0))
+        highest = np.maximum(highest, db.max(axis = 0))
+        # Count the values in the histogram of each frequency
+        bins = np.clip(((db + DB_RANGE) / DB_BIN).astype(int), 0, db_bins - 1)
+        db_counts += np.bincount((bins + offsets * db_bins).ravel(),
+                                 minlength = m * db_bins)
+        degrees = np.degrees(phase - phase_nominal + np.pi) % 360
+        bins = np.minimum((degrees / PHASE_BIN).astype(int), phase_bins - 1)
+        phase_counts += np.bincount((bins + offsets * phase_bins).ravel(),
+                                    minlength = m * phase_bins)
+
+    db_counts = db_counts.reshape(m, db_bins)
+    phase_counts = phase_counts.reshape(m, phase_bins)
+    h_nominal = np.exp(log_nominal + 1j * phase_nominal)
+    magnitude = {q: np.exp(log_nominal) * 10**(quantiles(db_counts, n, q, -DB_RANGE,
+                                                         DB_BIN) / 20)
+                 for q in QUANTILES}
+    phase = {q: np.degrees(phase_nominal) + quantiles(phase_counts, n, q, -180, PHASE_BIN)
+             for q in QUANTILES}
+    magnitude_range = (np.exp(log_nominal) * 10**(lowest / 20),
+                       np.exp(log_nominal) * 10**(highest / 20))
+    return ToleranceResult(f, {**nominal, **PARASITICS}, h_nominal, samples,
+                           resonance, magnitude, phase, magnitude_range)
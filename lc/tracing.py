@@ -0,0 +1,295 @@
+# Tracing of instrument commands and sweep timing
+#
+# A Tracer wraps the VISA resource of a DS1054Z (osc.dev) and the
+# serial port of an FY6600 (gen.ser), and records every command
+# sent to them: its duration, whether it failed (for example,
+# with a timeout, which wait_for_completion() retries), and the
+# step of the sweep that sent it. FrequencyResponse marks the
+# steps of each point (settle, level, amplitude and phase, or
+# waveform), so the tracer can also break down the time spent
+# on each point. Tracing is opt-in:
+#
+#   tracer = Tracer()
+#   fr = FrequencyResponse(1e3, 6e7, 100, 0.4, tracer = tracer)
+#   fr.run()
+#   tracer.save_breakdown("breakdown.csv")
+#   print(tracer.summary())
+#
+# Each command is also logged (at DEBUG level) to the "trace"
+# logger, with the fields of the record as attributes of the log
+# record. Use JsonFormatter to write them as JSON lines:
+#
+#   handler = logging.FileHandler("trace.jsonl")
+#   handler.setFormatter(JsonFormatter())
+#   logging.getLogger("trace").addHandler(handler)
+#   logging.getLogger("trace").setLevel(logging.DEBUG)
+#
+import json
+import logging
+import time
+from contextlib import contextmanager
+from pathlib import Path
+import pandas as pd
+
+log = logging.getLogger("trace")
+
+# Fields of each command record
+FIELDS = ["time", "instrument", "method", "command", "duration", "error",
+          "step", "point", "f"]
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Format log records as JSON objects (one per line), including
+    the fields of the trace records
+    '''
+    def format(self, record):
+        fields = {"time": record.created, "level": record.levelname,
+                  "logger": record.name, "message": record.getMessage()}
+        for name in FIELDS:
+            if name in record.__dict__ and name not in fields:
+                fields[name] = record.__dict__[name]
+        return json.dumps(fields, default = str)
+
+class Traced:
+    '''
+    Wraps an instrument connection, passing attribute accesses
+    through to it. Subclasses time the methods that communicate
+    with the instrument, using call().
+    '''
+    def __init__(self, connection, tracer, instrument):
+        self.__dict__.update(connection = connection, tracer = tracer,
+                             instrument = instrument)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.connection, name, value)
+
+    def call(self, method, command, func, *args):
+        '''
+        Call func(*args), recording its duration and any error
+        '''
+        start = self.tracer.clock()
+        error = None
+        try:
+            return func(*args)
+        except Exception as e:
+            error = getattr(e, "abbreviation", type(e).__name__)
+            raise
+        finally:
+            self.tracer.record(self.instrument, method, command,
+                               self.tracer.clock() - start, error)
+
+def headers(command):
+    '''
+    Return the headers of the commands in a message (without the
+    arguments), separated by ;
+    '''
+    return ";".join(part.split()[0] for part in command.split(";")
+                    if part.strip())
+
+class TracedResource(Traced):
+    '''
+    VISA resource (of the DS1054Z) which records each command
+    '''
+    def __init__(self, dev, tracer, instrument = "scope"):
+        super().__init__(dev, tracer, instrument)
+        self.__dict__["last_command"] = ""
+
+    def write(self, command):
+        self.__dict__["last_command"] = headers(command)
+        return self.call("write", self.last_command,
+                         self.connection.write, command)
+
+    def query(self, command):
+        return self.call("query", headers(command),
+                         self.connection.query, command)
+
+    def read(self):
+        # Record the read with the command it is the response to
+        return self.call("read", self.last_command, self.connection.read)
+
+    def read_raw(self):
+        return self.call("read", self.last_command,
+                         self.connection.read_raw)
+
+    def read_stb(self):
+        return self.call("read_stb", "*STB", self.connection.read_stb)
+
+    def wait_on_event(self, *args, **kwargs):
+        return self.call("wait", "SRQ", lambda: self.connection.wait_on_event(
+            *args, **kwargs))
+
+class TracedSerial(Traced):
+    '''
+    Serial port (of the FY6600) which records each command
+    '''
+    def __init__(self, ser, tracer, instrument = "gen"):
+        super().__init__(ser, tracer, instrument)
+
+    def write(self, data):
+        # The FY6600 commands are three letters followed by the
+        # value. Anything else is the data of a waveform upload.
+        if data.isascii() and data.endswith(b"\n"):
+            command = ";".join(line.strip()[:3]
+                               for line in data.decode().splitlines())
+        else:
+            command = "(data)"
+        return self.call("write", command, self.connection.write, data)
+
+    def readline(self):
+        return self.call("read", "readline", self.connection.readline)
+
+class Tracer:
+    '''
+    Records the commands sent to the instruments, and the time
+    spent on each step of each point of a sweep. clock is the
+    function returning the current time (in seconds), which can
+    be replaced by a simulated clock.
+    '''
+    def __init__(self, clock = time.perf_counter):
+        self.clock = clock
+        self.commands = []
+        self.points = []
+        # Current step (the outermost one, if steps are nested)
+        # and point (a dictionary of its timings)
+        self.current_step = None
+        self.current_point = None
+
+    def attach(self, gen = None, osc = None):
+        '''
+        Start recording the commands sent to the signal generator
+        and oscilloscope
+        '''
+        if gen is not None and not isinstance(gen.ser, Traced):
+            gen.ser = TracedSerial(gen.ser, self)
+        if osc is not None and not isinstance(osc.dev, Traced):
+            osc.dev = TracedResource(osc.dev, self)
+
+    def record(self, instrument, method, command, duration, error = None):
+        '''
+        Record a command sent to an instrument
+        '''
+        point = self.current_point
+        entry = {
+            "time": self.clock(),
+            "instrument": instrument,
+            "method": method,
+            "command": command,
+            "duration": duration,
+            "error": error,
+            "step": self.current_step,
+            "point": len(self.points) if point is not None else None,
+            "f": point["f"] if point is not None else None,
+        }
+        self.commands.append(entry)
+        if point is not None:
+            point["io_s"] += duration
+            point["commands"] += 1
+            point["errors"] += error is not None
+        log.debug("%s %s %s %.6f s", instrument, method, command, duration,
+                  extra = entry)
+
+    @contextmanager
+    def step(self, name):
+        '''
+        Context manager marking a step of the sweep. The commands
+        sent inside the block are recorded with the step, and its
+        duration is added to the current point. If steps are nested,
+        only the outermost one counts.
+        '''
+        if self.current_step is not None:
+            yield
+            return
+        self.current_step = name
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.current_step = None
+            if self.current_point is not None:
+                column = f"{name}_s"
+                self.current_point[column] = \
+                    self.current_point.get(column, 0) + self.clock() - start
+
+    @contextmanager
+    def point(self, f):
+        '''
+        Context manager marking the measurement of the point at
+        frequency f
+        '''
+        self.current_point = {"f": f, "total_s": 0, "io_s": 0,
+                              "commands": 0, "errors": 0}
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.current_point["total_s"] = self.clock() - start
+            self.points.append(self.current_point)
+            self.current_point = None
+
+    def breakdown(self):
+        '''
+        Return a data frame with a row for each point, containing
+        the frequency, the total time, the time spent in each step
+        (settle_s, level_s, and so on), the time spent waiting for
+        the instruments (io_s), and the numbers of commands and
+        errors (such as timeouts)
+        '''
+        return pd.DataFrame(self.points).fillna(0)
+
+    def command_summary(self, top = None):
+        '''
+        Return a data frame of the number of calls, total, mean and
+        maximum duration, and number of errors of each command,
+        sorted by total duration (limited to the top commands)
+        '''
+        df = pd.DataFrame(self.commands, columns = FIELDS)
+        summary = df.groupby(["instrument", "method", "command"]).agg(
+            count = ("duration", "size"),
+            total_s = ("duration", "sum"),
+            mean_s = ("duration", "mean"),
+            max_s = ("duration", "max"),
+            errors = ("error", "count"))
+        summary = summary.sort_values("total_s", ascending = False)
+        return summary if top is None else summary.head(top)
+
+    def summary(self, top = 10):
+        '''
+        Return a text summary of the mean time per point spent on
+        each step, and the top commands by total time
+        '''
+        lines = []
+        points = self.breakdown()
+        if len(points) > 0:
+            lines.append(f"Mean time per point ({len(points)} points):")
+            for column in points.columns:
+                if column.endswith("_s"):
+                    lines.append(f"  {column[:-2]:<10}{points[column].mean():>10.3f} s")
+        lines.append(f"Top commands by total time:")
+        lines.append(self.command_summary(top).to_string())
+        return "\n".join(lines)
+
+    def save_breakdown(self, path):
+        '''
+        Save the breakdown of the time per point (see breakdown())
+        as JSON (if the path ends in .json) or CSV
+        '''
+        save(self.breakdown(), path)
+
+    def save_commands(self, path):
+        '''
+        Save the record of every command as JSON (if the path ends
+        in .json) or CSV
+        '''
+        save(pd.DataFrame(self.commands, columns = FIELDS), path)
+
+def save(df, path):
+    '''
+    Save a data frame as JSON or CSV, depending on the extension
+    '''
+    if Path(path).suffix == ".json":
+        df.to_json(path, orient = "records", indent = 1)
+    else:
+        df.to_csv(path, index = False)
@@ -0,0 +1,589 @@
+# Transient analysis of netlists
+#
+# Integrates the equations of a netlist (see mna.py) in time, with
+# the currents and charges of the transistors (bjt.py) evaluated at
+# every step, for circuits that are not small-signal, such as the
+# start-up of the Colpitts oscillator:
+#
+#   circuit = Circuit(read_netlist("../colpitts/colpitts.net"))
+#   result = transient(circuit, 1e-3, uic = True)
+#   result.probe("v(4)")
+#   oscillation(result, "4")    # frequency, amplitude and startup_time
+#
+# The equations are
+#
+#   G x + i(x) + d/dt (C x + q(x)) = b(t)
+#
+# where G and C are the MNA matrices of the linear elements, i(x)
+# and q(x) the currents and charges of the transistors, and b(t)
+# the sources (with their sin, pulse, pwl or exp functions). Each
+# time step is solved by Newton's method (limiting the junction
+# voltages, as for the operating point), with the trapezoidal rule
+# or (method = "bdf2") the second-order backward differentiation
+# formula, which damps ringing but also damps oscillations a
+# little. The first step, and the step after each corner of a
+# source (a breakpoint), are backward Euler steps. The step size
+# is adapted to keep the local truncation error (estimated from
+# the difference between the solution and its extrapolation from
+# the previous points) within tolerance. The transistors are
+# evaluated together (see bjt.stack()), and their linearisations
+# added to the Newton matrix in one operation.
+#
+# As in SPICE, the analysis starts from the operating point, or
+# with uic = True, from zero (all the capacitors discharged, and no
+# current in the inductors, as when the supply is switched on),
+# which an oscillator needs to start.
+#
+# sweep() runs the analysis of a netlist with several sets of
+# component values, in parallel processes, and measures the
+# oscillation of each:
+#
+#   sweep("../colpitts/colpitts.net", [{"L1": 10e-6}, {"L1": 22e-6}], 4e-3, "4")
+#
+import logging
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from bjt import limit_junction, stack
+from mna import GMIN, Circuit
+from netlist import read_netlist
+
+log = logging.getLogger(__name__)
+
+# Error constants of the local truncation error estimate (the
+# ratio of the error of the step to the difference between the
+# solution and the quadratic extrapolation of the previous points)
+ERROR_CONSTANTS = {"trap": 1 / 13, "bdf2": 2 / 11}
+
+def source_value(function, arguments, t, step, stop):
+    '''
+    Return the value at times t of a SPICE transient source
+    function ("sin", "pulse", "pwl" or "exp", with the arguments of
+    the netlist), with the defaults of SPICE, which depend on the
+    step and stop time of the analysis
+    '''
+    t = np.asarray(t, dtype = float)
+    a = list(arguments)
+    if function == "sin":
+        vo, va, freq, td, theta, phase = a + [0, 0, 1 / stop, 0, 0, 0][len(a):]
+        s = np.maximum(t - td, 0)
+        return vo + va * np.exp(-s * theta) * np.sin(2*np.pi * (freq * s + phase / 360)) \
+            * (t >= td)
+    if function == "pulse":
+        v1, v2, td, tr, tf, pw, per = a + [0, 0, 0, step, step, stop, stop][len(a):]
+        tr, tf = tr or step, tf or step
+        s = np.where(t >= td, (t - td) % per if per > 0 else t - td, -1)
+        rising = v1 + (v2 - v1) * s / tr
+        falling = v2 + (v1 - v2) * (s - tr - pw) / tf
+        return np.select([s < 0, s < tr, s < tr + pw, s < tr + pw + tf],
+                         [v1, rising, v2, falling], v1)
+    if function == "pwl":
+        return np.interp(t, a[0::2], a[1::2])
+    if function == "exp":
+        v1, v2, td1, tau1, td2, tau2 = a + [0, 0, 0, step, 0, step][len(a):]
+        td2 = td2 or td1 + step
+        rise = (v2 - v1) * (1 - np.exp(-np.maximum(t - td1, 0) / tau1))
+        fall = (v1 - v2) * (1 - np.exp(-np.maximum(t - td2, 0) / tau2))
+        return v1 + rise + fall * (t >= td2)
+    raise ValueError(f"Unknown source function '{function}'")
+
+def breakpoints(function, arguments, step, stop):
+    '''
+    Return the times (up to stop) at which a source function has
+    corners, which the time steps must not cross
+    '''
+    a = list(arguments)
+    if function == "pulse":
+        _, _, td, tr, tf, pw, per = a + [0, 0, 0, step, step, stop, stop][len(a):]
+        tr, tf = tr or step, tf or step
+        starts = td + per * np.arange(int(stop // per) + 1 if per > 0 else 1)
+        points = (starts[:, None] + [0, tr, tr + pw, tr + pw + tf]).ravel()
+    elif function == "pwl":
+        points = np.array(a[0::2])
+    elif function == "sin":
+        points = np.array(a[3:4])
+    elif function == "exp":
+        _, _, td1, _, td2 = a[:5] + [0, 0, 0, step, 0][len(a):]
+        points = np.array([td1, td2 or td1 + step])
+    else:
+        points = np.array([])
+    return points[(points > 0) & (points < stop)]
+
+class TransientResult:
+    '''
+    The result of a transient analysis: the times t of the
+    accepted steps, and the solution x (one row per time) of the
+    circuit
+    '''
+    def __init__(self, circuit, t, x):
+        self.circuit = circuit
+        self.t = t
+        self.x = x
+
+    def voltage(self, node, reference = "0"):
+        '''
+        Return the voltage of a node (relative to the reference
+        node) at each time
+        '''
+        x = lambda name: self.x[:, self.circuit.node(name)] \
+            if self.circuit.node(name) >= 0 else 0
+        return x(node) - x(reference)
+
+    def current(self, name):
+        '''
+        Return the current through a voltage source or inductor
+        (flowing from its first node to its second) at each time
+        '''
+        return self.x[:, self.circuit.branch(name)]
+
+    def probe(self, expression):
+        '''
+        Evaluate an expression such as v(4), v(4,3) or i(Vcc)
+        '''
+        function, arguments = expression.lower().rstrip(")").split("(")
+        arguments = arguments.split(",")
+        if function == "i":
+            return self.current(arguments[0])
+        if function == "v":
+            return self.voltage(*arguments)
+        raise ValueError(f"Unknown function '{function}' in a transient analysis")
+
+class Transistors:
+    '''
+    The transistors of a batch of circuits (variants of the same
+    netlist), evaluated together: the indices of their collector,
+    base and emitter (nodes, with ground as the last index of the
+    padded matrices), and their models stacked into one (see
+    bjt.stack()), whose parameters have one row per circuit
+    '''
+    def __init__(self, circuits):
+        circuit = circuits[0]
+        self.size = size = circuit.size + 1
+        self.nodes = np.array([[circuit.node(node) for node in terminals]
+                               for _, _, terminals in circuit.transistors],
+                              dtype = int).reshape(-1, 3) % size
+        k = len(self.nodes)
+        # Incidence of the terminals on the nodes, which gathers the
+        # terminal voltages from a solution and scatters the terminal
+        # currents (and the 3 x 3 derivatives) onto the nodes (and
+        # the matrix), as matrix products
+        terminals = np.zeros((size, k, 3))
+        terminals[self.nodes, np.arange(k)[:, None], np.arange(3)] = 1
+        self.gather = terminals[:-1].reshape(size - 1, 3 * k)
+        self.scatter = terminals.reshape(size, 3 * k).T
+        self.scatter_matrix = np.einsum("ati,btj->tijab", terminals, terminals) \
+            .reshape(9 * k, size * size)
+        self.model = None
+        if circuit.transistors:
+            self.model = stack([model for circuit in circuits
+                                for _, model, _ in circuit.transistors])
+            shape = (len(circuits), k)
+            self.model.polarity = self.model.polarity.reshape(shape)
+            self.model.p = {name: value.reshape(shape)
+                            for name, value in self.model.p.items()}
+
+    def junctions(self, x):
+        '''
+        Return the junction voltages vbe and vbc (one row per
+        circuit) in the solutions x (one row per circuit)
+        '''
+        v = (x @ self.gather).reshape(len(x), -1, 3)
+        polarity = self.model.polarity
+        return polarity * (v[..., 1] - v[..., 2]), polarity * (v[..., 1] - v[..., 0])
+
+    def charges(self, x):
+        '''
+        Return the charges of the transistors on each node (one row
+        per circuit, the size of the padded matrices) in the
+        solutions x
+        '''
+        vbe, vbc = self.junctions(x)
+        q_be, q_bc = self.model.charges(vbe, vbc)[:2]
+        q = self.model.polarity[..., None] * np.stack([-q_bc, q_be + q_bc, -q_be], -1)
+        return q.reshape(len(x), -1) @ self.scatter
+
+    def stamp(self, A, rhs, vbe, vbc, alpha):
+        '''
+        Add the transistors, linearised at the junction voltages vbe
+        and vbc, to the Newton matrices A and right-hand sides rhs
+        (one per circuit, padded with a row for ground), with their
+        charges multiplied by alpha (the coefficient of the
+        integration formula)
+        '''
+        ic, ib, J, diodes = self.model.currents(vbe, vbc)
+        q_be, q_bc, c_be, c_bc, c_x = self.model.charges(vbe, vbc, diodes)
+        # Derivatives of the currents (plus alpha times the charges)
+        # into the collector, base and emitter with respect to the
+        # voltages of the three nodes (in the same order)
+        local = np.empty(vbe.shape + (3, 3))
+        local[..., 0, 0] = -J[0, 1] + alpha * c_bc
+        local[..., 0, 1] = J[0, 0] + J[0, 1] - alpha * c_bc
+        local[..., 0, 2] = -J[0, 0]
+        local[..., 1, 0] = -J[1, 1] - alpha * (c_bc + c_x)
+        local[..., 1, 1] = J[1, 0] + J[1, 1] + alpha * (c_be + c_bc + c_x)
+        local[..., 1, 2] = -J[1, 0] - alpha * c_be
+        local[..., 2, :] = -local[..., 0, :] - local[..., 1, :]
+        A += (local.reshape(len(A), -1) @ self.scatter_matrix).reshape(A.shape)
+        # Currents and charges of the linearisation at vbe and vbc
+        polarity = self.model.polarity
+        i_c = polarity * (ic - J[0, 0]*vbe - J[0, 1]*vbc)
+        i_b = polarity * (ib - J[1, 0]*vbe - J[1, 1]*vbc)
+        q_e = polarity * (q_be - c_be*vbe - c_x*vbc)
+        q_c = polarity * (q_bc - c_bc*vbc)
+        constant = np.empty(vbe.shape + (3,))
+        constant[..., 0] = i_c - alpha * q_c
+        constant[..., 1] = i_b + alpha * (q_e + q_c)
+        constant[..., 2] = -constant[..., 0] - constant[..., 1]
+        rhs -= constant.reshape(len(rhs), -1) @ self.scatter
+
+class Sources:
+    '''
+    The source vector b(t) of a circuit: the DC values, and the
+    sources with transient functions
+    '''
+    def __init__(self, circuit, step, stop):
+        self.b_dc = circuit.b_dc
+        self.step = step
+        self.stop = stop
+        self.functions = []
+        columns = []
+        for element in circuit.netlist.elements.values():
+            if element.kind not in "VI" or element.tran is None:
+                continue
+            column = np.zeros(circuit.size + 1)
+            if element.kind == "V":
+                column[circuit.branch(element.name)] = 1
+            else:
+                a, b = (circuit.node(node) for node in element.nodes)
+                column[a] -= 1
+                column[b] += 1
+            columns.append(column[:-1])
+            self.functions.append((element.tran, element.params["dc"]))
+        self.columns = np.array(columns).T.reshape(circuit.size, -1)
+
+    def __call__(self, t):
+        if not self.functions:
+            return self.b_dc
+        values = [source_value(*tran, t, self.step, self.stop) - dc
+                  for tran, dc in self.functions]
+        return self.b_dc + self.columns @ np.array(values)
+
+    def breakpoints(self):
+        '''
+        Return the breakpoints of all the sources
+        '''
+        return np.concatenate([[]] + [breakpoints(*tran, self.step, self.stop)
+                                      for tran, _ in self.functions])
+
+def transient(circuit, stop, max_step = None, **options):
+    '''
+    Integrate the equations of circuit (an mna.Circuit) from time
+    0 to stop, and return a TransientResult (see
+    transient_batch(), for the options)
+    '''
+    return transient_batch([circuit], stop, max_step, **options)[0]
+
+def transient_batch(circuits, stop, max_step = None, method = "trap", uic = False,
+                    ic = None, kick = None, reltol = 1e-3, vntol = 1e-6,
+                    abstol = 1e-9, max_iter = 20):
+    '''
+    Integrate the equations of a batch of circuits (mna.Circuits of
+    variants of the same netlist, which differ only in their
+    element and model values) from time 0 to stop (see above),
+    together, with the same steps of at most max_step (by default
+    stop / 50), and return a TransientResult for each. Integrating
+    several variants together takes little longer than one.
+
+    The analysis starts from the operating point, or from zero if
+    uic is True. ic is a dictionary of initial node voltages (as
+    SPICE's .ic) which replace those of the starting point, and
+    kick a dictionary of voltages added to them (starting an
+    oscillator from its operating point with a small kick shows its
+    start-up). The local truncation error of each
+    step is kept within reltol of the values, plus vntol for
+    voltages and abstol for currents. RuntimeError is raised if
+    the step size becomes too small (if Newton's method does not
+    converge, or the error cannot be kept within tolerance).
+    '''
+    if method not in ERROR_CONSTANTS:
+        raise ValueError(f"Unknown integration method '{method}'")
+    circuit = circuits[0]
+    for other in circuits[1:]:
+        if other.nodes != circuit.nodes or other.branches != circuit.branches:
+            raise ValueError("The circuits of a batch must have the same nodes "
+                             "and elements")
+    max_step = max_step or stop / 50
+    n = circuit.size
+    batch = len(circuits)
+    transistors = Transistors(circuits)
+    sources = [Sources(other, max_step, stop) for other in circuits]
+    # Linear matrices, padded with a row and column for ground, with
+    # the junction conductances (GMIN) of the transistors
+    G = np.stack([np.pad(other.G, (0, 1)) for other in circuits])
+    C = np.stack([np.pad(other.C, (0, 1)) for other in circuits])
+    for c, b, e in transistors.nodes:
+        for matrix in G:
+            circuit.stamp(matrix, b, e, GMIN)
+            circuit.stamp(matrix, b, c, GMIN)
+    tolerance = np.where(np.arange(n) < len(circuit.nodes), vntol, abstol)
+    # The truncation error is controlled for the node voltages and
+    # the inductor currents (the currents of the sources follow
+    # from them, as in SPICE)
+    states = np.arange(n) < len(circuit.nodes)
+    for element in circuit.netlist.elements.values():
+        if element.kind == "L":
+            states[circuit.branch(element.name)] = True
+
+    def source_vectors(t):
+        return np.stack([source(t) for source in sources])
+
+    def charge(x):
+        # Total charge (and flux) of each equation at the solutions x
+        q = (C[:, :n, :n] @ x[..., None])[..., 0]
+        if transistors.model is not None:
+            q += transistors.charges(x)[:, :n]
+        return q
+
+    def solve(t, x, alpha, history):
+        # Newton's method for the solutions at time t, starting from
+        # x, where the derivative of the charge is alpha q + history
+        base = G + alpha * C
+        rhs_base = np.zeros((batch, n + 1))
+        rhs_base[:, :n] = source_vectors(t) - history
+        junctions = transistors.junctions(x) if transistors.model is not None else None
+        for iteration in range(max_iter):
+            A = base.copy()
+            rhs = rhs_base.copy()
+            limited = False
+            if junctions is not None:
+                p = transistors.model.p
+                vbe, vbc = transistors.junctions(x)
+                vbe_limited = limit_junction(vbe, junctions[0], p["nf"], p["is"])
+                vbc_limited = limit_junction(vbc, junctions[1], p["nr"], p["is"])
+                limited = np.any(vbe_limited != vbe) or np.any(vbc_limited != vbc)
+                junctions = (vbe_limited, vbc_limited)
+                transistors.stamp(A, rhs, vbe_limited, vbc_limited, alpha)
+            try:
+                x_new = np.linalg.solve(A[:, :n, :n], rhs[:, :n, None])[..., 0]
+            except np.linalg.LinAlgError:
+                return None
+            converged = np.all(abs(x_new - x) <= reltol * np.maximum(abs(x_new), abs(x))
+                               + tolerance)
+            x = x_new
+            if converged and not limited:
+                return x
+        return None
+
+    if uic:
+        x = np.zeros((batch, n))
+    else:
+        x = np.stack([other.operating_point(source(0))
+                      for other, source in zip(circuits, sources)])
+    for node, voltage in (ic or {}).items():
+        x[:, circuit.node(node)] = voltage
+    for node, voltage in (kick or {}).items():
+        x[:, circuit.node(node)] += voltage
+    t = 0.0
+    times, solutions = [t], [x]
+    stops = list(np.unique(np.concatenate([source.breakpoints() for source in sources]
+                                          + [[stop]])))
+    min_step = stop * 1e-12
+    h = max_step / 100
+    # Charge at the last two points and its derivative at the last
+    # point, and whether the last point is the start or a
+    # breakpoint (after which the history is not smooth, so the next
+    # step is backward Euler)
+    charges = [charge(x)]
+    derivative = np.zeros_like(x)
+    restart = True
+    # Largest magnitude of each variable so far (the scale of the
+    # relative tolerance, which would otherwise shrink to nothing
+    # whenever a variable crosses zero)
+    peak = abs(x)
+    steps = rejected = 0
+    while t < stop * (1 - 1e-12):
+        h = min(h, max_step, stops[0] - t)
+        t_new = t + h
+        # Coefficients of the integration formula, for the derivative
+        # of the charge alpha q(t_new) + history
+        if restart:
+            alpha, history = 1 / h, -charges[-1] / h
+        elif method == "trap":
+            alpha, history = 2 / h, -2 * charges[-1] / h - derivative
+        else:
+            rho = h / (t - times[-2])
+            alpha = (1 + 2*rho) / (1 + rho) / h
+            history = (-(1 + rho) * charges[-1] + rho**2 / (1 + rho) * charges[-2]) / h
+        # Prediction by extrapolation of the last (up to) three points
+        if restart or len(times) < 3:
+            prediction = solutions[-1]
+        else:
+            t0, t1, t2 = times[-3:]
+            x0, x1, x2 = solutions[-3:]
+            slope = (x2 - x1) / (t2 - t1)
+            curvature = (slope - (x1 - x0) / (t1 - t0)) / (t2 - t0)
+            prediction = x2 + (t_new - t2) * (slope + (t_new - t1) * curvature)
+        x_new = solve(t_new, prediction, alpha, history)
+        if x_new is None:
+            h /= 8
+            rejected += 1
+            if h < min_step:
+                raise RuntimeError(f"Time step too small at t = {t:.6g} s "
+                                   "(Newton's method did not converge)")
+            continue
+        if not restart and len(times) >= 3:
+            error = ERROR_CONSTANTS[method] * abs(x_new - prediction)[:, states] \
+                / (reltol * np.maximum(abs(x_new), peak) + tolerance)[:, states]
+            ratio = error.max()
+            if ratio > 1:
+                h *= max(0.9 * ratio ** (-1 / 3), 0.2)
+                rejected += 1
+                if h < min_step:
+                    raise RuntimeError(f"Time step too small at t = {t:.6g} s "
+                                       "(the error is not within tolerance)")
+                continue
+            factor = min(0.9 * max(ratio, 1e-12) ** (-1 / 3), 2)
+        else:
+            factor = 2
+        peak = np.maximum(peak, abs(x_new))
+        q = charge(x_new)
+        derivative = alpha * q + history
+        charges = [charges[-1], q]
+        t = t_new
+        times.append(t)
+        solutions.append(x_new)
+        steps += 1
+        restart = False
+        if t >= stops[0] * (1 - 1e-12):
+            t = times[-1] = stops.pop(0)
+            restart = True
+            h = min(h, max_step / 100)
+        else:
+            h *= factor
+    log.debug(f"Transient analysis: {steps} steps, {rejected} rejected")
+    times = np.array(times)
+    solutions = np.stack(solutions, axis = 1)
+    return [TransientResult(other, times, x) for other, x in zip(circuits, solutions)]
+
+def oscillation(result, node, reference = "0", settled = 0.9, steady = 0.05):
+    '''
+    Measure the oscillation of the voltage of node (relative to the
+    reference node) in a transient result, and return a dictionary
+    of its frequency (over the last half of the cycles), amplitude
+    (the mean over the last quarter of the cycles), and
+    startup_time, when the amplitude of a cycle first reaches the
+    fraction settled of the final amplitude. The slow drift of the
+    voltage (as the bias settles, or coupling capacitors charge) is
+    removed first. The values are NaN if the voltage does not
+    oscillate, and startup_time is NaN if the amplitude is not
+    steady (if it changes by more than the fraction steady over the
+    last quarter of the cycles, so the analysis needs to be longer,
+    or the oscillation is dying away).
+    '''
+    none = {"frequency": np.nan, "amplitude": np.nan, "startup_time": np.nan}
+    v = result.voltage(node, reference)
+    # Resample evenly, with the smallest step of the analysis (but
+    # at most 10^6 points), and estimate the period from the
+    # spectrum of the second half
+    dt = max(np.diff(result.t).min(), result.t[-1] / 1e6)
+    t = np.arange(0, result.t[-1], dt)
+    v = np.interp(t, result.t, v)
+    half = v[len(v) // 2:]
+    if len(half) < 8:
+        return none
+    spectrum = abs(np.fft.rfft((half - half.mean()) * np.hanning(len(half))))
+    peak = spectrum[1:].argmax() + 1
+    if spectrum[peak] < 1e-9 * len(half):
+        return none
+    period = max(int(round(len(half) / peak)), 2)
+    # Remove the drift (the mean over one period around each point)
+    sums = np.cumsum(np.insert(v, 0, 0))
+    drift = (sums[period:] - sums[:-period]) / period
+    start = period // 2
+    ac = v[start:start + len(drift)] - drift
+    t = t[start:start + len(drift)]
+    # Cycles between rising zero crossings
+    rising = np.flatnonzero((ac[:-1] < 0) & (ac[1:] >= 0))
+    if len(rising) < 9:
+        return none
+    crossings = t[rising] - ac[rising] * dt / (ac[rising + 1] - ac[rising])
+    amplitudes = np.array([np.ptp(cycle) / 2 for cycle in np.split(ac, rising)[1:-1]])
+    half, quarter, eighth = len(crossings) // 2, len(amplitudes) * 3 // 4, \
+        len(amplitudes) * 7 // 8
+    frequency = (len(crossings) - 1 - half) / (crossings[-1] - crossings[half])
+    amplitude = amplitudes[quarter:].mean()
+    change = abs(amplitudes[eighth:].mean() - amplitudes[quarter:eighth].mean())
+    startup = crossings[np.argmax(amplitudes >= settled * amplitude)] \
+        if change <= steady * amplitude else np.nan
+    return {"frequency": float(frequency), "amplitude": float(amplitude),
+            "startup_time": float(startup)}
+
+def read_variant(path, values):
+    '''
+    Read the netlist at path, with values (a dictionary) setting the
+    values of elements (by name, such as {"L1": 22e-6}) or of
+    parameters, and return its Circuit
+    '''
+    netlist = read_netlist(path)
+    params = {name: value for name, value in values.items()
+              if name not in netlist.elements}
+    if params:
+        netlist = read_netlist(path, **params)
+    for name, value in values.items():
+        if name in netlist.elements:
+            netlist.elements[name].value = value
+    return Circuit(netlist)
+
+def simulate(path, variants, stop, node, max_step = None, kick = 0.01, **options):
+    '''
+    Run a transient analysis of the netlist at path with each of the
+    sets of values in variants (a list of dictionaries, see
+    read_variant()), all together (see transient_batch()), and
+    return a list of the values of each with the measurements of
+    the oscillation of node (see oscillation()). The analysis
+    starts from the operating point with a kick of the voltage of
+    node (in volts), unless uic or ic are given. If the analysis
+    fails, the variants are analysed one at a time, and those that
+    still fail have NaN measurements, and the reason as error.
+    '''
+    analysis = dict(options)
+    if not (options.get("uic") or options.get("ic")):
+        analysis["kick"] = {node: kick}
+    circuits = [read_variant(path, values) for values in variants]
+    try:
+        results = transient_batch(circuits, stop, max_step, **analysis)
+    except RuntimeError as e:
+        if len(variants) == 1:
+            log.warning(f"{variants[0]}: {e}")
+            return [{**variants[0], "frequency": np.nan, "amplitude": np.nan,
+                     "startup_time": np.nan, "error": str(e)}]
+        return [row for values in variants
+                for row in simulate(path, [values], stop, node, max_step, kick, **options)]
+    return [{**values, **oscillation(result, node)}
+            for values, result in zip(variants, results)]
+
+def sweep(path, variants, stop, node, max_step = None, batch = 8, processes = None,
+          **options):
+    '''
+    Simulate the netlist at path with each of the sets of values in
+    variants (see simulate()), in batches of batch variants (which
+    are integrated together), in a pool of processes (by default,
+    one per CPU), and return the list of their results (in the same
+    order). The keyword arguments are passed to simulate().
+    '''
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [pool.submit(simulate, path, variants[start:start + batch], stop,
+                               node, max_step, **options)
+                   for start in range(0, len(variants), batch)]
+        return [row for future in futures for row in future.result()]
+
+def probe_node(probes):
+    '''
+    Return the node of the first voltage expression in probes (such
+    as "5" for vdb(5)), or None if there is none
+    '''
+    for probe in probes:
+        match = re.fullmatch(r"v[a-z]*\(([^,)]+)\)", probe)
+        if match:
+            return match.group(1)
+    return None